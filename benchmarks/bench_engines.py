@@ -0,0 +1,64 @@
+"""Compares the download engines of InstagramSearcher.
+
+Downloads the same posts with the thread pool and with asyncio from a local
+stand-in of Instagram, and prints posts per second of each engine.
+
+    $ python -m benchmarks.bench_engines --posts 500 --latency 0.1
+"""
+from   benchmarks.fake_instagram    import FakeInstagram
+from   instagram_monitor.searcher   import InstagramSearcher
+import argparse
+import json
+import logging
+import time
+
+
+def bench_engine(engine, base_url, n_posts, n_threads, max_requests):
+    # The stand-in server is not rate limited
+    unlimited = {family: (0, 1) for family in ('graphql', 'web', 'private')}
+    searcher = InstagramSearcher(engine=engine, n_threads=n_threads,
+                                 max_requests=max_requests, base_url=base_url,
+                                 rate_limits=unlimited)
+    list_ids = [{'code': 'p{}'.format(i)} for i in range(n_posts)]
+    start = time.perf_counter()
+    posts = searcher.download_posts(list_ids)
+    elapsed = time.perf_counter() - start
+    stats = searcher.connection_stats()
+    return {'engine': engine,
+            'requests': stats['requests'],
+            'connections': stats['connections'],
+            'posts': len(posts),
+            'comments': sum(len(post['comments']) for post in posts),
+            'seconds': elapsed,
+            'posts_per_second': len(posts) / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compares the download engines of InstagramSearcher.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--posts', type=int, default=200)
+    parser.add_argument('--comments', type=int, default=100)
+    parser.add_argument('--page_size', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='Seconds every response is delayed')
+    parser.add_argument('--threads', type=int, default=5)
+    parser.add_argument('--max_requests', type=int, default=200)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    results = []
+    with FakeInstagram(args.comments, args.page_size, args.latency) as fake:
+        for engine in ('threads', 'asyncio'):
+            results.append(bench_engine(engine, fake.base_url, args.posts,
+                                        args.threads, args.max_requests))
+    for result in results:
+        print('{engine:<8} {posts:>6} posts {seconds:>8.2f} s '
+              '{posts_per_second:>8.1f} posts/s {requests:>6} requests '
+              '{connections:>4} connections'.format(**result))
+    print(json.dumps(results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""Measures the monitor end to end against a local stand-in of Instagram.
+
+Searches, updates and exports the posts of some queries, stored in a local
+mongod or in an in-process stand-in of MongoDB, and writes the time,
+throughput and memory of each phase as JSON, to compare versions:
+
+    $ python -m benchmarks.bench_monitor --posts 200 --output new.json
+    $ python -m benchmarks.compare old.json new.json
+
+The peak RSS of a phase is the peak of the process until the phase ends,
+rss_growth_mb is how much the phase raised it.
+"""
+from   benchmarks.fake_instagram import FakeInstagram, FakeClient
+from   contextlib                import contextmanager
+from   functools                 import partial
+from   instagram_monitor         import metrics
+import argparse
+import json
+import logging
+import matplotlib
+import os
+import platform
+import pymongo
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+# The monitor imports pyplot, plots must not need a display
+matplotlib.use('Agg')
+
+from   instagram_monitor.clientpool import ClientPool
+from   instagram_monitor.monitor    import InstagramMonitor
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (2**20 if sys.platform == 'darwin' else 2**10)
+
+
+def histogram_sum(name):
+    return sum(histogram['sum']
+               for histogram in metrics.registry.snapshot()['histograms']
+               if histogram['name'] == name)
+
+
+def version():
+    try:
+        return subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@contextmanager
+def mongo_server(mongo):
+    # 'memory' patches pymongo with mongomock, anything else is a HOST:PORT
+    if mongo == 'memory':
+        import mongomock
+        with mongomock.patch(servers=(('localhost', 27017),)):
+            yield 'localhost', 27017
+    else:
+        host, port = mongo.rsplit(':', 1)
+        yield host, int(port)
+
+
+def stored(client, args, queries):
+    posts    = sum(client[args.post_db][query].count_documents({})
+                   for query in queries)
+    comments = sum(client[args.comments_db][coll].count_documents({})
+                   for coll in client[args.comments_db].list_collection_names())
+    return posts, comments
+
+
+def measure(phase, task, queries, count):
+    """Runs a task for every query, returns the measures of the phase."""
+    rss_before  = peak_rss_mb()
+    save_before = histogram_sum('save_seconds')
+    start       = time.perf_counter()
+    try:
+        for query in queries:
+            task(query)
+    except Exception as e:
+        # e.g. the graph export needs pydot, other phases are still measured
+        logging.exception('Phase {} failed.'.format(phase))
+        return {'phase': phase, 'skipped': repr(e)}
+    seconds     = time.perf_counter() - start
+    posts, comments = count()
+    return {'phase': phase,
+            'seconds': seconds,
+            'posts': posts,
+            'comments': comments,
+            'posts_per_second': posts / seconds,
+            'comments_per_second': comments / seconds,
+            'save_seconds': histogram_sum('save_seconds') - save_before,
+            'peak_rss_mb': peak_rss_mb(),
+            'rss_growth_mb': peak_rss_mb() - rss_before}
+
+
+def run(args):
+    queries = (['#tag{}'.format(i) for i in range(args.tags)]
+               + ['user{}'.format(i) for i in range(args.users)])
+    # Every post is newer than update_days, so updates find them all
+    spacing = max(1, min(60, 12*60*60 // args.posts))
+    results = []
+    with FakeInstagram(args.comments, args.page_size, args.latency,
+                       n_posts=args.posts, post_spacing=spacing,
+                       error_rate=args.error_rate) as fake, \
+         mongo_server(args.mongo) as (host, port):
+        client = pymongo.MongoClient(host, port)
+        for db in (args.post_db, args.comments_db, args.post_db + '-state'):
+            client.drop_database(db)
+
+        unlimited = {family: (0, 1) for family in ('graphql', 'web',
+                                                   'private')}
+        monitor = InstagramMonitor(None, None, host, port,
+                                   args.post_db, args.comments_db,
+                                   args.rich, 1, args.batch_size,
+                                   args.comments_layout, args.engine,
+                                   args.max_requests, args.stream,
+                                   base_url=fake.base_url,
+                                   wait_time=args.wait_time,
+                                   n_threads=args.threads,
+                                   detect_changes=args.detect_changes,
+                                   rate_limits=unlimited)
+        if args.private and args.accounts > 1:
+            monitor.searcher.priv_client = ClientPool(
+                [('bench{}'.format(i), 'bench') for i in range(args.accounts)],
+                *unlimited['private'], factory=partial(FakeClient, fake))
+        elif args.private:
+            monitor.searcher.priv_client = FakeClient(fake)
+
+        def count():
+            return stored(client, args, queries)
+
+        def update(query):
+            monitor.update_query(query, older_days=1e-6)
+
+        phases = [('search', monitor.search_query),
+                  ('update', update),
+                  ('export_comments', monitor.export_comments_query),
+                  ('export_graph', monitor.export_graph_query),
+                  ('export_info', monitor.export_info_query)]
+        for phase, task in phases:
+            results.append(measure(phase, task, queries, count))
+            logging.warning('{}: {}'.format(phase, results[-1]))
+
+        return {'version': version(),
+                'time': time.time(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'config': vars(args),
+                'requests': fake.n_requests,
+                'throttled': fake.n_throttled,
+                'results': results,
+                'metrics': metrics.registry.snapshot()}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measures the monitor end to end.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--tags', type=int, default=2,
+                        help='Amount of tags searched')
+    parser.add_argument('--users', type=int, default=1,
+                        help='Amount of users searched')
+    parser.add_argument('--posts', type=int, default=100,
+                        help='Posts of every tag and user')
+    parser.add_argument('--comments', type=int, default=100,
+                        help='Comments of every post')
+    parser.add_argument('--page_size', type=int, default=50,
+                        help='Comments in a GraphQL page')
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help='Seconds every response is delayed')
+    parser.add_argument('--error_rate', type=float, default=0,
+                        help='Fraction of requests answered with a 429')
+    parser.add_argument('--wait_time', type=float, default=0.1,
+                        help='Seconds the searcher waits after errors')
+    parser.add_argument('--mongo', default='memory',
+                        help=('"memory" for an in-process stand-in, or '
+                              'HOST:PORT of a mongod whose benchmark '
+                              'databases are dropped'))
+    parser.add_argument('--post_db', default='bench_post')
+    parser.add_argument('--comments_db', default='bench_comment')
+    parser.add_argument('--comments_layout', default='collections',
+                        choices=['collections', 'single'])
+    parser.add_argument('--batch_size', type=int, default=1000)
+    parser.add_argument('--engine', default='threads',
+                        choices=['threads', 'asyncio'])
+    parser.add_argument('--threads', type=int, default=5)
+    parser.add_argument('--max_requests', type=int, default=200)
+    parser.add_argument('--stream', default=False, action='store_true')
+    parser.add_argument('--accounts', type=int, default=1,
+                        help=('Private API accounts used in turns by a '
+                              'client pool, with --private'))
+    parser.add_argument('--rich', default=False, action='store_true',
+                        help='Get comments from the private API, with --private')
+    parser.add_argument('--detect_changes', default=False,
+                        action='store_true',
+                        help='Update only posts whose counts changed')
+    parser.add_argument('--private', default=False, action='store_true',
+                        help='Get posts from the private API')
+    parser.add_argument('--output', default='benchmark.json',
+                        help='File where results are written')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING,
+                        format='%(levelname)-8s %(message)s')
+
+    output = os.path.abspath(args.output)
+    cwd    = os.getcwd()
+    # Exports are written in the working directory
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            report = run(args)
+        finally:
+            os.chdir(cwd)
+
+    with open(output, 'w') as file_output:
+        json.dump(report, file_output, indent=2)
+    for result in report['results']:
+        if 'skipped' in result:
+            print('{phase:<16} skipped: {skipped}'.format(**result))
+        else:
+            print('{phase:<16} {seconds:>8.2f} s {posts_per_second:>9.1f} '
+                  'posts/s {comments_per_second:>10.1f} comments/s '
+                  '{peak_rss_mb:>7.1f} MB'.format(**result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Compares the results of two runs of bench_monitor.
+
+Prints, for each phase, the seconds and throughput of both runs and how
+many times faster the new one is:
+
+    $ python -m benchmarks.compare old.json new.json
+"""
+import argparse
+import json
+
+
+def compare(old, new):
+    old_phases = {result['phase']: result for result in old['results']}
+    rows = []
+    for result in new['results']:
+        before = old_phases.get(result['phase'])
+        if (before is None or 'skipped' in before or 'skipped' in result):
+            rows.append({'phase': result['phase'], 'speedup': None})
+            continue
+        rows.append({'phase': result['phase'],
+                     'old_seconds': before['seconds'],
+                     'new_seconds': result['seconds'],
+                     'old_posts_per_second': before['posts_per_second'],
+                     'new_posts_per_second': result['posts_per_second'],
+                     'old_peak_rss_mb': before['peak_rss_mb'],
+                     'new_peak_rss_mb': result['peak_rss_mb'],
+                     'speedup': before['seconds'] / result['seconds']})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compares the results of two runs of bench_monitor.')
+    parser.add_argument('old', help='Results of the reference run')
+    parser.add_argument('new', help='Results of the run to compare')
+    parser.add_argument('--json', default=False, action='store_true',
+                        help='Print the comparison as JSON')
+    args = parser.parse_args()
+
+    with open(args.old) as file_old, open(args.new) as file_new:
+        old = json.load(file_old)
+        new = json.load(file_new)
+    rows = compare(old, new)
+    if args.json:
+        print(json.dumps(rows))
+        return
+
+    print('{} -> {}'.format(old.get('version'), new.get('version')))
+    for row in rows:
+        if row['speedup'] is None:
+            print('{phase:<16} not comparable'.format(**row))
+        else:
+            print('{phase:<16} {old_seconds:>8.2f} s -> {new_seconds:>8.2f} s '
+                  '{speedup:>6.2f}x  {old_posts_per_second:>9.1f} -> '
+                  '{new_posts_per_second:>9.1f} posts/s  '
+                  '{old_peak_rss_mb:>7.1f} -> {new_peak_rss_mb:>7.1f} MB'
+                  .format(**row))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,329 @@
+from   http.cookies import SimpleCookie
+from   http.server  import BaseHTTPRequestHandler, ThreadingHTTPServer
+from   threading    import Lock, Thread
+from   urllib.parse import parse_qs, urlparse
+import instagram_private_api as api
+import json
+import random
+import time
+import zlib
+
+
+class FakeInstagram(object):
+
+    def __init__(self, n_comments=100, page_size=1000, latency=0.05,
+                 host='127.0.0.1', port=0, n_posts=100, feed_page_size=50,
+                 private_page_size=20, post_spacing=60, error_rate=0,
+                 seed=0, throttled_users=(), bad_logins=(), missing_users=()):
+        """A local stand-in of the Instagram endpoints used by the searcher.
+
+        It serves the web API of posts and users, the GraphQL feeds of tags
+        and users and pages of comments, and the private API endpoints to
+        log in, get a post and its comments.
+
+        Every post shortcode exists, its id is the shortcode without the
+        leading 'p', and it has n_comments comments. Every tag and user has
+        n_posts posts, one every post_spacing seconds before now.
+
+        Args:
+            n_comments (int): Amount of comments of every post.
+            page_size (int): Amount of comments in a GraphQL page.
+            latency (float): Seconds every response is delayed.
+            host (str): Address where the server listens.
+            port (int): Port where the server listens, 0 picks a free one.
+            n_posts (int): Amount of posts of every tag and user.
+            feed_page_size (int): Amount of posts in a GraphQL feed page.
+            private_page_size (int): Amount of comments in a private API
+                page.
+            post_spacing (int): Seconds between the dates of posts.
+            error_rate (float): Fraction of requests answered with a 429.
+            seed (int): Seed of the injected 429 responses.
+            throttled_users (tuple[str]): Accounts whose private API
+                requests are always answered with a 429.
+            bad_logins (tuple[str]): Accounts which fail to log in.
+            missing_users (tuple[str]): Users whose web API info is
+                answered with a 404, like deleted or renamed users.
+
+        """
+        self.n_comments        = n_comments
+        self.page_size         = page_size
+        self.latency           = latency
+        self.n_posts           = n_posts
+        self.feed_page_size    = feed_page_size
+        self.private_page_size = private_page_size
+        self.post_spacing      = post_spacing
+        self.error_rate        = error_rate
+        self.throttled_users   = set(throttled_users)
+        self.bad_logins        = set(bad_logins)
+        self.missing_users     = set(missing_users)
+        # Private API requests answered, by account
+        self.user_requests     = {}
+        self.now               = int(time.time())
+        self.n_requests        = 0
+        self.n_throttled       = 0
+        self.__random          = random.Random(seed)
+        self.__lock            = Lock()
+        self.server     = _Server((host, port), _Handler)
+        self.server.fake = self
+        self.thread     = Thread(target=self.server.serve_forever,
+                                 daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    @property
+    def api_url(self):
+        return self.base_url + '/api/{version!s}/'
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def count(self, user=None):
+        """Counts a request, returns True if it must be throttled.
+
+        Args:
+            user (str): The account of a private API request.
+
+        """
+        with self.__lock:
+            self.n_requests += 1
+            throttled = (self.__random.random() < self.error_rate
+                         or user in self.throttled_users)
+            self.n_throttled += throttled
+            if user is not None and not throttled:
+                self.user_requests[user] = self.user_requests.get(user, 0) + 1
+        return throttled
+
+    @staticmethod
+    def user_id(username):
+        return str(zlib.crc32(username.encode('utf8')) % 10**6 + 1)
+
+    def taken_at(self, code):
+        return self.now - (int(code.lstrip('p')) % 10**6 + 1)*self.post_spacing
+
+    def post(self, code):
+        return {'graphql': {'shortcode_media': {
+            'id': code.lstrip('p'),
+            'shortcode': code,
+            'owner': {'id': '1', 'username': 'owner',
+                      'profile_pic_url': 'http://pic'},
+            'comments_disabled': False,
+            'edge_media_to_caption': {'edges': [
+                {'node': {'text': 'caption of {} @friend'.format(code)}}]},
+            'taken_at_timestamp': self.taken_at(code),
+            'dimensions': {'height': 1080, 'width': 1080},
+            'display_url': 'http://image',
+            'edge_media_preview_like': {'count': 10},
+            'edge_media_to_comment': {'count': self.n_comments}}}}
+
+    def comment_nodes(self, code, start, end):
+        # Comments from start to end counting from the newest, older first
+        return [{'id': '{}{:08d}'.format(code.lstrip('p'), i),
+                 'text': 'comment {} @user{}'.format(i, i % 10),
+                 'created_at': 1500000000 + i,
+                 'owner': {'id': str(i % 100),
+                           'username': 'user{}'.format(i % 100),
+                           'profile_pic_url': 'http://pic'}}
+                for i in range(self.n_comments - end,
+                               self.n_comments - start)]
+
+    def comments(self, code, after=None):
+        # Pages go from the newest comments to the oldest ones, comments of
+        # a page are older first. The cursor is the amount already returned.
+        start = int(after) if after else 0
+        end   = min(start + self.page_size, self.n_comments)
+        edges = [{'node': node}
+                 for node in self.comment_nodes(code, start, end)]
+        return {'status': 'ok', 'data': {'shortcode_media': {
+            'edge_media_to_comment': {
+                'count': self.n_comments,
+                'page_info': {'has_next_page': end < self.n_comments,
+                              'end_cursor': str(end)},
+                'edges': edges}}}}
+
+    def feed(self, name, after=None):
+        # Posts of a tag or user, the newest first. The ids of the posts of
+        # different names do not overlap.
+        start = int(after) if after else 0
+        end   = min(start + self.feed_page_size, self.n_posts)
+        base  = int(self.user_id(name)) * 10**6
+        edges = [{'node': {'id': str(base + i),
+                           'shortcode': 'p{}'.format(base + i),
+                           'taken_at_timestamp': self.taken_at(str(base + i)),
+                           'edge_media_preview_like': {'count': 10},
+                           'edge_media_to_comment': {
+                               'count': self.n_comments}}}
+                 for i in range(start, end)]
+        return {'page_info': {'has_next_page': end < self.n_posts,
+                              'end_cursor': str(end)},
+                'edges': edges}
+
+    def private_media(self, media_id):
+        media_id = media_id.split('_')[0]
+        user = {'pk': 1, 'username': 'owner', 'full_name': 'Owner',
+                'profile_pic_url': 'http://pic', 'is_private': False}
+        return {'status': 'ok', 'items': [{
+            'pk': int(media_id),
+            'id': '{}_1'.format(media_id),
+            'code': 'p' + media_id,
+            'taken_at': self.taken_at(media_id),
+            'media_type': 1,
+            'caption': {'pk': int(media_id), 'user': dict(user),
+                        'created_at': self.taken_at(media_id),
+                        'text': 'caption of p{} @friend'.format(media_id)},
+            'user': user,
+            'image_versions2': {'candidates': [
+                {'url': 'http://image', 'width': 1080, 'height': 1080}]},
+            'original_width': 1080,
+            'original_height': 1080,
+            'like_count': 10,
+            'comment_count': self.n_comments}]}
+
+    def private_comments(self, media_id, max_id=None, threading=False):
+        # Same order and cursor as the GraphQL pages of comments. Every
+        # fifth comment is a reply, with threading it is only a preview
+        # of the comment before it.
+        start = int(max_id) if max_id else 0
+        end   = min(start + self.private_page_size, self.n_comments)
+        comments = [{'pk': int(node['id']),
+                     'text': node['text'],
+                     'type': 0,
+                     'created_at': node['created_at'],
+                     'created_at_utc': node['created_at'],
+                     'user_id': int(node['owner']['id']),
+                     'user': {'pk': int(node['owner']['id']),
+                              'username': node['owner']['username'],
+                              'full_name': '',
+                              'profile_pic_url': 'http://pic'}}
+                    for node in self.comment_nodes('p' + media_id, start, end)]
+        if threading:
+            for comment, reply in zip(comments, comments[1:]):
+                if reply['pk'] % 5 == 4:
+                    comment['preview_child_comments'] = [reply]
+            comments = [comment for comment in comments
+                        if comment['pk'] % 5 != 4]
+        return {'status': 'ok', 'comments': comments,
+                'comment_count': self.n_comments,
+                'has_more_comments': end < self.n_comments,
+                'next_max_id': str(end) if end < self.n_comments else None}
+
+
+class FakeClient(api.Client):
+
+    def __init__(self, fake, username='bench', password='bench', **kwargs):
+        """A private API client logged in a FakeInstagram.
+
+        Args:
+            fake (FakeInstagram): The running stand-in server.
+            username (str): Any username.
+            password (str): Any password.
+            kwargs: Other keyword arguments of the client.
+
+        """
+        kwargs.setdefault('auto_patch', True)
+        kwargs.setdefault('drop_incompat_keys', True)
+        super().__init__(username, password, api_url=fake.api_url, **kwargs)
+
+    def get_cookie_value(self, key, domain=''):
+        # Cookies are matched by the host of the server, not of Instagram
+        return super().get_cookie_value(
+            key, domain or urlparse(self.api_url).hostname)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads     = True
+    request_queue_size = 1024
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body  = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        parts = [part for part in urlparse(self.path).path.split('/') if part]
+        if parts[2:] == ['si', 'fetch_headers']:
+            self.send_json({'status': 'ok'},
+                           cookies={'csrftoken': 'token'})
+        elif parts[2:] == ['accounts', 'login']:
+            # The body is 'signed_body=<signature>.<json of the parameters>'
+            signed   = parse_qs(body.decode('utf8')).get('signed_body', [''])
+            username = json.loads(signed[0].split('.', 1)[1])['username']
+            if username in self.server.fake.bad_logins:
+                self.send_json({'status': 'ok', 'logged_in_user': {}},
+                               cookies={'csrftoken': 'token'})
+            else:
+                self.send_json({'status': 'ok', 'logged_in_user': {'pk': 1}},
+                               cookies={'csrftoken': 'token',
+                                        'ds_user_id': '1',
+                                        'ds_user': username})
+        else:
+            self.send_json({'status': 'fail'}, 404)
+
+    def do_GET(self):
+        fake = self.server.fake
+        time.sleep(fake.latency)
+        user = None
+        if self.path.startswith('/api/'):
+            cookie = SimpleCookie(self.headers.get('Cookie', ''))
+            user   = cookie['ds_user'].value if 'ds_user' in cookie else ''
+        if fake.count(user):
+            self.send_json({'status': 'fail',
+                            'message': 'Please wait a few minutes'}, 429)
+            return
+        url   = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split('/') if part]
+        if parts[:1] == ['p'] and len(parts) == 2:
+            self.send_json(fake.post(parts[1]))
+        elif parts == ['graphql', 'query'] and 'shortcode' in query:
+            self.send_json(fake.comments(query['shortcode'],
+                                         query.get('after')))
+        elif parts == ['graphql', 'query'] and 'tag_name' in query:
+            self.send_json({'status': 'ok', 'data': {'hashtag': {
+                'edge_hashtag_to_media': fake.feed(query['tag_name'],
+                                                   query.get('after'))}}})
+        elif parts == ['graphql', 'query'] and 'id' in query:
+            self.send_json({'status': 'ok', 'data': {'user': {
+                'edge_owner_to_timeline_media': fake.feed(
+                    query['id'], query.get('after'))}}})
+        elif parts[:1] == ['api'] and parts[2:3] == ['media']:
+            if parts[4:] == ['info']:
+                self.send_json(fake.private_media(parts[3]))
+            elif parts[4:] == ['comments']:
+                self.send_json(fake.private_comments(
+                    parts[3].split('_')[0], query.get('max_id'),
+                    query.get('can_support_threading') == 'true'))
+            else:
+                self.send_json({'status': 'fail'}, 404)
+        elif (len(parts) == 1 and '__a' in query
+              and parts[0] not in fake.missing_users):
+            self.send_json({'user': {'id': fake.user_id(parts[0]),
+                                     'username': parts[0]}})
+        else:
+            self.send_json({'status': 'fail'}, 404)
+
+    def send_json(self, data, status=200, cookies=None):
+        body = json.dumps(data).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (cookies or {}).items():
+            self.send_header('Set-Cookie', '{}={}; Path=/'.format(name, value))
+        self.end_headers()
+        self.wfile.write(body)
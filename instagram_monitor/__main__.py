@@ -1,13 +1,27 @@
-from instagram_monitor.monitor  import InstagramMonitor
-from instagram_monitor.searcher import InstagramSearcher
-from urllib.error               import URLError
+from instagram_monitor.clientpool import ClientPool, load_credentials
+from instagram_monitor.executor   import QueryExecutor
+from instagram_monitor.metrics    import MetricsServer, SnapshotWriter
+from instagram_monitor.monitor    import InstagramMonitor
+from instagram_monitor.scheduler  import Scheduler, parse_queries
+from urllib.error                 import URLError
 import argparse
+import atexit
 import logging
-import requests
-import sys
 import time
 
 
+def rate_limit(value):
+    """Parses a rate limit with the format 'RATE,BURST'."""
+    rate, burst = value.split(',')
+    return (float(rate), int(burst))
+
+
+def interval(value):
+    """Parses the interval of a task with the format 'TASK=HOURS'."""
+    name, hours = value.split('=')
+    return (name, float(hours))
+
+
 def main():
 
     parser = argparse.ArgumentParser(
@@ -22,6 +36,15 @@ def main():
                         help='Instagram login user')
     parser.add_argument('--login_pass', default=None,
                         help='Instagram login password')
+    parser.add_argument('--login_file', default=None,
+                        help=('File with an Instagram user and its password '
+                              'in each line, private API requests are '
+                              'spread across these accounts, each one '
+                              'limited by --private_limit'))
+    parser.add_argument('--login_cooldown', type=float, default=600,
+                        help=('Seconds an account of --login_file is not '
+                              'used after too many requests or a failed '
+                              'login'))
 
     parser.add_argument('--host', default='localhost',
                         help='Address of MongoDB service')
@@ -32,21 +55,110 @@ def main():
     parser.add_argument('--comments_db', default='comment',
                         help='Comment database name of MongoDB service')
 
+    parser.add_argument('--batch_size', type=int, default=1000,
+                        help=('Amount of documents written to MongoDB '
+                              'in each bulk operation'))
+
+    parser.add_argument('--comments_layout', default='collections',
+                        choices=['collections', 'single'],
+                        help=('Store comments in a collection per post, or '
+                              'in a single collection'))
+    parser.add_argument('--migrate_comments',
+                        default=False, action='store_true',
+                        help=('Move comments stored in a collection per post '
+                              'to the single collection, then exit.'))
+
     parser.add_argument('--rich',
                         default=False, action='store_true',
                         help=('Comments have more information'))
 
+    parser.add_argument('--threads', type=int, default=5,
+                        help=('Amount of threads downloading posts, with '
+                              'adaptive, the amount at start'))
+    parser.add_argument('--adaptive',
+                        default=False, action='store_true',
+                        help=('Grow and shrink the amount of threads '
+                              'following latency and rate limit errors'))
+    parser.add_argument('--min_threads', type=int, default=1,
+                        help=('The least threads downloading, with adaptive'))
+    parser.add_argument('--max_threads', type=int, default=20,
+                        help=('The most threads downloading, with adaptive'))
+    parser.add_argument('--engine', default='threads',
+                        choices=['threads', 'asyncio'],
+                        help=('Download posts with a pool of threads, or '
+                              'with asyncio (needs aiohttp)'))
+    parser.add_argument('--max_requests', type=int, default=200,
+                        help=('Amount of requests in flight at the same time '
+                              'with the asyncio engine'))
+
+    parser.add_argument('--http_retries', type=int, default=3,
+                        help=('Amount of times a web request is retried '
+                              'after a connection or server error'))
+    parser.add_argument('--http_timeout', type=float, default=30,
+                        help=('Seconds to wait for a web request to answer'))
+
+    parser.add_argument('--graphql_limit', type=rate_limit, default='5,10',
+                        help=('Requests per second and burst of requests '
+                              'to GraphQL, as RATE,BURST'))
+    parser.add_argument('--web_limit', type=rate_limit, default='5,10',
+                        help=('Requests per second and burst of requests '
+                              'to the web API, as RATE,BURST'))
+    parser.add_argument('--private_limit', type=rate_limit, default='2,5',
+                        help=('Requests per second and burst of requests '
+                              'to the private API, as RATE,BURST'))
+
+    parser.add_argument('--stream',
+                        default=False, action='store_true',
+                        help=('Save downloaded posts in batches while the '
+                              'download continues'))
+    parser.add_argument('--queue_size', type=int, default=100,
+                        help=('Amount of downloaded posts waiting to be '
+                              'saved, with stream'))
+
+    parser.add_argument('--checkpoint_pages', type=int, default=5,
+                        help=('Pages of a search between checkpoints to '
+                              'resume it after a restart, 0 disables them'))
+    parser.add_argument('--checkpoint_dir', default=None,
+                        help=('Directory where checkpoints are saved, '
+                              'by default they are saved in MongoDB'))
+
+    parser.add_argument('--user_cache_days', type=float, default=7,
+                        help=('Days the ids of users are cached, '
+                              '0 disables the cache'))
+
     parser.add_argument('--update_days', type=int, default=2,
                         help=('Amount of days old a post must be, to not try '
                               'to search for new comments'))
+    parser.add_argument('--detect_changes',
+                        default=False, action='store_true',
+                        help=('Update only posts whose counts of comments '
+                              'or likes changed, checked in the pages of '
+                              'posts of their query'))
+    parser.add_argument('--incremental',
+                        default=False, action='store_true',
+                        help=('Update only comments newer than the newest '
+                              'stored comment of each post'))
+
+
+    parser.add_argument('--parallel', '-p', type=int, default=1,
+                        help=('Amount of queries running at the same time'))
 
 
     parser.add_argument('--loop', '-l',
                         default=False, action='store_true',
                         help=('Search and update periodically'))
 
-    parser.add_argument('--wait_time', type=int, default=2,
+    parser.add_argument('--wait_time', type=float, default=2,
                         help=('Hours to wait between iterations of the loop'))
+    parser.add_argument('--interval', type=interval, action='append',
+                        default=[],
+                        help=('Hours to wait between runs of a task in the '
+                              'loop, as TASK=HOURS, e.g. update=6. Lines of '
+                              'the queries file may also set them, as '
+                              '"query HOURS TASK=HOURS"'))
+    parser.add_argument('--jitter', type=float, default=0.1,
+                        help=('Fraction of the wait randomly added or '
+                              'removed in the loop'))
 
 
     parser.add_argument('--search', '-s',
@@ -60,6 +172,18 @@ def main():
     parser.add_argument('--export_comments', '-c',
                         default=False, action='store_true',
                         help=('Export post texts to a file.'))
+    parser.add_argument('--export_compression', default=None,
+                        choices=['gzip', 'zstd'],
+                        help=('Compression of the exported comments, zstd '
+                              'needs the zstandard package'))
+    parser.add_argument('--export_workers', type=int, default=1,
+                        help=('Amount of processes exporting the comments '
+                              'of a query, each one to its own files'))
+    parser.add_argument('--export_columnar', default=None,
+                        choices=['parquet', 'arrow'],
+                        help=('Export posts and comments to zstd compressed '
+                              'columnar files, Parquet or Arrow IPC, needs '
+                              'the pyarrow package'))
     parser.add_argument('--export_graphs', '-g',
                         default=False, action='store_true',
                         help=('Export mentions graph to a file.'))
@@ -67,6 +191,20 @@ def main():
                         default=False, action='store_true',
                         help=('Export general information of each query to a file.'))
 
+    parser.add_argument('--check_indexes',
+                        default=False, action='store_true',
+                        help=('Check and repair indexes of the stored '
+                              'collections, then exit.'))
+
+    parser.add_argument('--metrics_port', type=int, default=None,
+                        help=('Port where metrics are served in the '
+                              'Prometheus format, at /metrics'))
+    parser.add_argument('--metrics_file', default=None,
+                        help=('File where JSON snapshots of the metrics '
+                              'are appended periodically'))
+    parser.add_argument('--metrics_interval', type=float, default=60,
+                        help=('Seconds between snapshots of the metrics'))
+
     parser.add_argument('--quiet', '-q', default=False, action='store_true',
                         help='No logging info')
     parser.add_argument('--verbose', default='INFO',
@@ -86,51 +224,92 @@ def main():
         raise ValueError('Must provide host and port of MongoDB service')
 
     logging.basicConfig(level=(100 if args.quiet else args.verbose),
-                        format='%(levelname)-8s %(message)s')
+                        format=('%(levelname)-8s %(threadName)-20.20s '
+                                '%(message)s' if args.parallel > 1 else
+                                '%(levelname)-8s %(message)s'))
 
 
     with open(args.queries) as file_queries:
-        queries = file_queries.read().splitlines()
+        queries, intervals = parse_queries(file_queries.read().splitlines())
+    intervals.update(((None, name), hours) for name, hours in args.interval)
+
+    if args.check_indexes or args.migrate_comments:
+        monitor = InstagramMonitor(host=args.host, port=args.port,
+                                   post_db=args.post_db,
+                                   comments_db=args.comments_db,
+                                   batch_size=args.batch_size,
+                                   comments_layout=args.comments_layout)
+        if args.migrate_comments:
+            monitor.migrate_comments()
+        if args.check_indexes:
+            monitor.check_indexes()
+        return
+
+    if args.metrics_port:
+        MetricsServer(args.metrics_port).start()
+    if args.metrics_file:
+        writer = SnapshotWriter(args.metrics_file,
+                                args.metrics_interval).start()
+        atexit.register(writer.stop)
+
+    clients = (ClientPool(load_credentials(args.login_file),
+                          *args.private_limit, cooldown=args.login_cooldown)
+               if args.login_file else None)
 
     while True:
         try:
             monitor = InstagramMonitor(args.login_user, args.login_pass,
                                        args.host, args.port,
                                        args.post_db, args.comments_db,
-                                       args.rich, args.update_days)
-            tasks   = []
-            if args.search:
-                tasks.append(monitor.search_query)
-            if args.update:
-                tasks.append(monitor.update_query)
-            if args.export_comments:
-                tasks.append(monitor.export_comments_query)
-            if args.export_graphs:
-                tasks.append(monitor.export_graph_query)
-            if args.export_info:
-                tasks.append(monitor.export_info_query)
-
-            if not tasks:
-                tasks = [monitor.search_query,
-                         monitor.update_query]
-
-            for task in tasks:
-                for query in queries:
-                    task(query)
-
-            if not args.loop:
-                break
-
-            logging.info('Waiting {} hours.'.format(args.wait_time))
-            prev = time.time()
-            while True:
-                now = time.time()
-                if now - prev > args.wait_time*60*60:
-                    break
-            logging.info('Going back to scrape posts.')
-
+                                       args.rich, args.update_days,
+                                       args.batch_size, args.comments_layout,
+                                       args.engine, args.max_requests,
+                                       args.stream, args.checkpoint_pages,
+                                       args.checkpoint_dir, args.incremental,
+                                       args.user_cache_days,
+                                       export_compression=(
+                                           args.export_compression),
+                                       export_workers=args.export_workers,
+                                       columnar_format=(
+                                           args.export_columnar or 'parquet'),
+                                       detect_changes=args.detect_changes,
+                                       clients=clients,
+                                       queue_size=args.queue_size,
+                                       retries=args.http_retries,
+                                       timeout=args.http_timeout,
+                                       n_threads=args.threads,
+                                       adaptive=args.adaptive,
+                                       min_threads=args.min_threads,
+                                       max_threads=args.max_threads,
+                                       pool_size=(max(args.threads,
+                                                      args.max_threads)
+                                                  * args.parallel),
+                                       rate_limits={
+                                           'graphql': args.graphql_limit,
+                                           'web': args.web_limit,
+                                           'private': args.private_limit})
+            break
         except URLError as e:
-            pass
+            logging.warning('Could not log in: {}'.format(e))
+            time.sleep(60)
+
+    tasks = [('search', monitor.search_query),
+             ('update', monitor.update_query),
+             ('export_comments', monitor.export_comments_query),
+             ('export_columnar', monitor.export_columnar_query),
+             ('export_graphs', monitor.export_graph_query),
+             ('export_info', monitor.export_info_query)]
+    tasks = [(name, task) for name, task in tasks if getattr(args, name)]
+    if not tasks:
+        tasks = [('search', monitor.search_query),
+                 ('update', monitor.update_query)]
+
+    if args.loop:
+        Scheduler(tasks, queries, intervals, args.wait_time,
+                  args.jitter, args.parallel).run()
+    else:
+        QueryExecutor([task for _, task in tasks],
+                      args.parallel).run(queries)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
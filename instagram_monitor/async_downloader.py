@@ -0,0 +1,256 @@
+from   functools         import partial
+from   instagram_monitor import metrics
+import asyncio
+import instagram_private_api as api
+import json
+import logging
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class AsyncDownloader(object):
+
+    def __init__(self, searcher, max_requests=200, backoff=0.5):
+        """Downloads Instagram posts with an asyncio event loop.
+
+        Posts and pages of comments are requested concurrently to the web
+        API and GraphQL. Requests to the private API, which is synchronous,
+        are run in the default executor of the loop. Web requests wait up
+        to searcher.timeout seconds, and a post failing is retried up to
+        searcher.retries times, waiting longer after each failure, but
+        after a 0 or 429 the rate limiter makes every request wait.
+
+        Args:
+            searcher (InstagramSearcher): The searcher whose configuration
+                and private client are used.
+            max_requests (int): Amount of requests in flight at the same time.
+            backoff (float): Factor of the exponential wait between retries.
+
+        """
+        if aiohttp is None:
+            raise ImportError('The asyncio engine needs aiohttp, '
+                              'install it with: pip install aiohttp')
+        self.searcher      = searcher
+        self.max_requests  = max_requests
+        self.backoff       = backoff
+        self.n_requests    = 0
+        self.n_connections = 0
+
+    def download_posts(self, list_ids: list, callback=None):
+        """Retrieves Instagram posts with their comments from a id list.
+
+        If callback is given, posts are streamed to it through a queue
+        like in InstagramSearcher.download_posts, callback runs in a
+        thread so the loop keeps downloading.
+
+        Args:
+            list_ids (list[dict]): A list whose elements are dicts with
+                the key 'id' or 'code' from an Instagram's post.
+            callback (callable): A function receiving lists of posts.
+
+        Returns:
+            list: The downloaded posts, as dicts with the keys 'post'
+                and 'comments', or if callback is given, their ids.
+
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(
+                self.__download(list_ids, callback))
+        finally:
+            loop.close()
+
+    def connection_stats(self):
+        """Returns how many requests reused an open connection.
+
+        Returns:
+            dict: Amount of 'requests' made, of 'connections' opened, and
+                of 'reused' connections.
+
+        """
+        return {'requests': self.n_requests,
+                'connections': self.n_connections,
+                'reused': self.n_requests - self.n_connections}
+
+    async def __download(self, list_ids, callback):
+        self.__semaphore = asyncio.Semaphore(self.max_requests)
+        if callback is not None:
+            queue_posts = asyncio.Queue(self.searcher.queue_size)
+            writer = asyncio.ensure_future(
+                self.__write_posts(queue_posts, callback))
+        else:
+            queue_posts = None
+        connector = aiohttp.TCPConnector(limit=self.max_requests)
+        timeout   = aiohttp.ClientTimeout(total=self.searcher.timeout)
+        trace     = aiohttp.TraceConfig()
+        trace.on_request_start.append(self.__on_request)
+        trace.on_connection_create_end.append(self.__on_connection)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                         trace_configs=[trace]) as session:
+            posts = await asyncio.gather(
+                *[self.__post_task(session, enum_id, queue_posts)
+                  for enum_id in enumerate(list_ids)])
+        if callback is not None:
+            await queue_posts.put(None)
+            return await writer
+        return [post for post in posts if post is not None]
+
+    async def __write_posts(self, queue_posts, callback):
+        """Calls callback with queued posts until a None is queued.
+
+        Args:
+            queue_posts (asyncio.Queue): Queue containing downloaded posts.
+            callback (callable): A function receiving lists of posts.
+
+        """
+        loop     = asyncio.get_event_loop()
+        list_ids = []
+        error    = None
+        finished = False
+        while not finished:
+            batch = [await queue_posts.get()]
+            while not queue_posts.empty():
+                batch.append(queue_posts.get_nowait())
+            if batch[-1] is None:
+                finished = True
+                batch.pop()
+            if len(batch) and error is None:
+                try:
+                    await loop.run_in_executor(None, callback, batch)
+                    list_ids.extend(post['post']['id'] for post in batch)
+                except Exception as e:
+                    logging.error('Writing posts failed: {}'.format(e))
+                    error = e
+        if error is not None:
+            raise error
+        return list_ids
+
+    async def __post_task(self, session, enum_id, queue_posts=None):
+        """Downloads a post and its comments, retrying on failures.
+
+        Args:
+            session (aiohttp.ClientSession): The session to make requests.
+            enum_id (tuple): The position and the dict identifying the post.
+            queue_posts (asyncio.Queue): If given, where to put the post
+                instead of returning it.
+
+        """
+        searcher = self.searcher
+        failures = 0
+        while True:
+            try:
+                if 'id' in enum_id[1] and searcher.priv_client:
+                    post = await self.__run_sync(searcher.get_post,
+                                                 enum_id[1]['id'])
+                elif 'code' in enum_id[1]:
+                    with metrics.timer('endpoint_seconds',
+                                       endpoint='get_post2'):
+                        post = await self.__get_post(session,
+                                                     enum_id[1]['code'])
+
+                since = enum_id[1].get('since')
+                if post['comments']['count']:
+                    if searcher.rich_comments and searcher.priv_client:
+                        comments = await self.__run_sync(
+                            searcher.get_comments2, post['id'], 1000000, since)
+                    else:
+                        with metrics.timer('endpoint_seconds',
+                                           endpoint='get_comments'):
+                            comments = await self.__get_comments(
+                                session, post['code'], since)
+                else:
+                    comments = []
+
+                logging.info('Post {:>5}: {:>5} from {:>5} comments.'.format(
+                    enum_id[0]+1, post['comments']['count'], len(comments)))
+                if queue_posts is not None:
+                    await queue_posts.put({'post': post,
+                                           'comments': comments})
+                    return None
+                return {'post': post, 'comments': comments}
+
+            except api.ClientError as e:
+                logging.error('Post {:>5}: {} {}.'.format(
+                    enum_id[0]+1, str(e.code), str(e)))
+                # If error code is 400, 404, maybe the post was deleted
+                if int(e.code) in (400, 404):
+                    return None
+                # After a 0 or 429 the rate limiter makes every request wait
+                if int(e.code) in (0, 429):
+                    continue
+
+            except (asyncio.TimeoutError,
+                    aiohttp.ClientError,
+                    json.decoder.JSONDecodeError) as e:
+                logging.error('Post {:>5}: {}'.format(
+                    enum_id[0]+1, str(e) or type(e).__name__))
+
+            failures += 1
+            if failures > searcher.retries:
+                logging.error('Post {:>5}: failed {} times, skipped.'.format(
+                    enum_id[0]+1, failures))
+                return None
+            await asyncio.sleep(self.backoff * 2**(failures - 1))
+
+    async def __on_request(self, session, context, params):
+        self.n_requests += 1
+
+    async def __on_connection(self, session, context, params):
+        self.n_connections += 1
+
+    async def __run_sync(self, function, *args):
+        async with self.__semaphore:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(None, partial(function, *args))
+
+    async def __get_json(self, session, url, error):
+        limiter = self.searcher.limiter
+        family  = limiter.family(url)
+        async with self.__semaphore:
+            await asyncio.sleep(limiter.reserve(family))
+            with metrics.timer('http_request_seconds', family=family):
+                async with session.get(url) as response:
+                    body = await response.read()
+            metrics.inc('http_requests_total', family=family,
+                        status=response.status)
+            metrics.inc('http_response_bytes_total', len(body),
+                        family=family)
+            if response.status == 429:
+                limiter.cooldown(family, self.searcher.wait_time)
+            if response.status != 200:
+                raise api.errors.ClientError(error, response.status)
+            return json.loads(body)
+
+    async def __get_post(self, session, code):
+        post = await self.__get_json(session, self.searcher.post_url(code),
+                                     'Web API request failed')
+        return self.searcher.patch_post(post['graphql']['shortcode_media'],
+                                        code)
+
+    async def __get_comments(self, session, code, since=None):
+        comments   = None
+        end_cursor = None
+        pages      = []
+
+        while (not comments
+               or (comments['page_info']['has_next_page']
+                   and not (since is not None
+                            and any(node['created_at'] <= since
+                                    for node in pages[-1])))):
+            comments = await self.__get_json(
+                session, self.searcher.comments_url(code, end_cursor),
+                'GraphQL request failed')
+            if comments['status'] != 'ok':
+                raise api.errors.ClientError('GraphQL request failed', 200)
+            comments = (comments
+                ['data']['shortcode_media']['edge_media_to_comment'])
+            end_cursor = comments['page_info']['end_cursor']
+            pages.append([edge['node'] for edge in comments['edges']])
+
+        # Pages are newer first, comments are returned older first
+        return [self.searcher.patch_comment(comment)
+                for page in reversed(pages) for comment in page
+                if since is None or comment['created_at'] > since]
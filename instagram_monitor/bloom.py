@@ -0,0 +1,52 @@
+import hashlib
+import math
+
+
+class BloomFilter(object):
+
+    def __init__(self, capacity, error_rate=0.001):
+        """A set of fixed size that may answer false positives.
+
+        Uses a bit array sized for capacity items, so memory does not grow
+        with the amount of items added. Up to capacity items, at most a
+        fraction error_rate of new items are taken as already added.
+
+        Args:
+            capacity (int): The expected amount of items.
+            error_rate (float): The rate of false positives at capacity.
+
+        """
+        capacity      = max(int(capacity), 1)
+        self.n_bits   = max(int(-capacity * math.log(error_rate)
+                                / math.log(2)**2), 8)
+        self.n_hashes = max(int(round(self.n_bits / capacity
+                                      * math.log(2))), 1)
+        self.bits     = bytearray((self.n_bits + 7) // 8)
+
+    def __positions(self, item):
+        # Double hashing from one digest, instead of n_hashes digests
+        digest = hashlib.blake2b(str(item).encode('utf8'),
+                                 digest_size=16).digest()
+        first  = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i*second) % self.n_bits
+                for i in range(self.n_hashes)]
+
+    def add(self, item):
+        """Adds an item.
+
+        Returns:
+            bool: True if the item was probably added before.
+
+        """
+        found = True
+        for position in self.__positions(item):
+            byte, bit = divmod(position, 8)
+            if not self.bits[byte] & (1 << bit):
+                found = False
+                self.bits[byte] |= 1 << bit
+        return found
+
+    def __contains__(self, item):
+        return all(self.bits[position // 8] & (1 << position % 8)
+                   for position in self.__positions(item))
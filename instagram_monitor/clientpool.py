@@ -0,0 +1,198 @@
+from   functools                   import partial
+from   instagram_monitor           import metrics
+from   instagram_monitor.ratelimit import TokenBucket
+from   threading                   import Lock
+import instagram_private_api as api
+import logging
+import time
+
+
+def load_credentials(path):
+    """Reads Instagram credentials from a file.
+
+    Each line has a username and its password separated by whitespace,
+    empty lines and lines starting with '#' are skipped.
+
+    Args:
+        path (str): The path of the file.
+
+    Returns:
+        list[tuple]: Tuples (username, password).
+
+    """
+    credentials = []
+    with open(path, encoding='utf8') as file_credentials:
+        for line in file_credentials:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            username, password = line.split(None, 1)
+            credentials.append((username, password))
+    return credentials
+
+
+def login(username, password):
+    """Returns a private API client logged in an account."""
+    return api.Client(username, password,
+                      auto_patch=True, drop_incompat_keys=True)
+
+
+class _Account(object):
+    # An account of a pool, with its client, limits and health
+
+    def __init__(self, username, password, rate, burst):
+        self.username = username
+        self.password = password
+        self.client   = None
+        self.bucket   = TokenBucket(rate, burst)
+        self.until    = 0
+        self.failures = 0
+        self.requests = 0
+        self.lock     = Lock()
+
+
+class ClientPool(object):
+
+    def __init__(self, credentials, rate=2, burst=5, cooldown=600,
+                 factory=login):
+        """Private API clients of several accounts, used in turns.
+
+        Calls go to the accounts in turns, each one waits for the token
+        bucket of its account, so every account has its own rate limits.
+        An account answered with too many requests, or failing to log in,
+        cools down, longer after consecutive failures, while the others
+        keep working. Accounts log in when they are first used, and again
+        after a login error. Methods of the clients can be called on the
+        pool, e.g. pool.media_info(id).
+
+        Args:
+            credentials (list[tuple]): Tuples (username, password).
+            rate (float): Requests per second of each account, 0 means
+                no limit.
+            burst (int): Requests of each account made without waiting.
+            cooldown (float): Seconds an account is not used after a
+                failure, doubled after each consecutive failure up to 8
+                times.
+            factory (callable): Receives a username and a password,
+                returns a logged in client.
+
+        """
+        if not credentials:
+            raise ValueError('A client pool needs credentials')
+        self.cooldown = cooldown
+        self.factory  = factory
+        self.accounts = [_Account(username, password, rate, burst)
+                         for username, password in credentials]
+        self.__next   = 0
+        self.__lock   = Lock()
+
+    def __len__(self):
+        return len(self.accounts)
+
+    def __getattr__(self, method):
+        # Any other attribute is a method of the clients
+        if method.startswith('_'):
+            raise AttributeError(method)
+        return partial(self.call, method)
+
+    def call(self, method, *args, **kwargs):
+        """Calls a method of the client of the next healthy account.
+
+        Args:
+            method (str): The name of the method of the client.
+
+        """
+        account, client = self.__take()
+        try:
+            result = getattr(client, method)(*args, **kwargs)
+        except (api.ClientLoginError,
+                api.ClientLoginRequiredError,
+                api.ClientCookieExpiredError) as e:
+            with account.lock:
+                # Another call may have logged in again meanwhile
+                if account.client is client:
+                    account.client = None
+            self.__cool(account, e)
+            raise
+        except api.ClientError as e:
+            if int(e.code) in (0, 429):
+                self.__cool(account, e)
+            raise
+        account.failures = 0
+        return result
+
+    def stats(self):
+        """Returns the health and amount of requests of every account."""
+        now = time.monotonic()
+        return [{'username': account.username,
+                 'logged_in': account.client is not None,
+                 'cooldown': max(account.until - now, 0),
+                 'failures': account.failures,
+                 'requests': account.requests}
+                for account in self.accounts]
+
+    def __take(self):
+        """Returns the next account not cooling down, and its client.
+
+        Waits for the token bucket of the account, or if every account is
+        cooling down, until the first one recovers. The account logs in
+        after waiting, if another call found its session expired.
+
+        """
+        while True:
+            with self.__lock:
+                now     = time.monotonic()
+                account = None
+                for i in range(len(self.accounts)):
+                    candidate = self.accounts[(self.__next + i)
+                                              % len(self.accounts)]
+                    if candidate.until <= now:
+                        account     = candidate
+                        self.__next = ((self.__next + i + 1)
+                                       % len(self.accounts))
+                        break
+                if account is None:
+                    wait = min(candidate.until for candidate
+                               in self.accounts) - now
+            if account is None:
+                logging.info(('Every account is cooling down, waiting '
+                              '{:.0f} seconds.').format(wait))
+                time.sleep(wait)
+                continue
+            metrics.observe('ratelimit_wait_seconds',
+                            account.bucket.acquire(), family='private')
+            client = self.__login(account)
+            if client is not None:
+                account.requests += 1
+                return account, client
+
+    def __login(self, account):
+        """Returns the client of an account, logging in if needed.
+
+        Returns None if the login fails, and the account cools down.
+
+        """
+        with account.lock:
+            if account.client is None:
+                try:
+                    account.client = self.factory(account.username,
+                                                  account.password)
+                except (api.ClientError, OSError) as e:
+                    self.__cool(account, e)
+                    return None
+                logging.info('Account {} logged in.'.format(account.username))
+            return account.client
+
+    def __cool(self, account, error):
+        """Stops using an account for a while after a failure."""
+        with self.__lock:
+            now = time.monotonic()
+            # Calls made before the cooldown count as the same failure
+            if account.until > now:
+                return
+            account.failures += 1
+            sec = self.cooldown * min(2**(account.failures - 1), 8)
+            account.until = now + sec
+        metrics.inc('rate_limited_total', family='private')
+        logging.warning('Account {} cooling down {} seconds: {}'.format(
+            account.username, sec, error))
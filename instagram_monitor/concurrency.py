@@ -0,0 +1,82 @@
+from   threading import Condition
+import logging
+import time
+
+
+class AdaptiveLimit(object):
+
+    def __init__(self, initial=5, min_limit=1, max_limit=20,
+                 decrease=0.5, smoothing=0.2, tolerance=2):
+        """Limits how many threads work at the same time, adapting the limit.
+
+        The limit follows an AIMD rule: every success adds 1/limit, so the
+        limit grows by one after a round of successes, while latency stays
+        below tolerance times the lowest latency seen. An error from too
+        many requests or a timeout multiplies the limit by decrease, at
+        most once per round.
+
+        Args:
+            initial (int): The limit at start.
+            min_limit (int): The lowest limit.
+            max_limit (int): The highest limit.
+            decrease (float): Factor applied to the limit after an error.
+            smoothing (float): Weight of a new latency in its moving average.
+            tolerance (float): How many times the lowest latency seen the
+                average latency can be before the limit stops growing.
+
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease  = decrease
+        self.smoothing = smoothing
+        self.tolerance = tolerance
+        self.limit     = float(min(max(initial, min_limit), max_limit))
+        self.latency   = None
+        self.baseline  = None
+        self.__active  = 0
+        self.__last_decrease = 0
+        self.__condition = Condition()
+
+    @property
+    def current(self):
+        return int(self.limit)
+
+    def acquire(self):
+        """Blocks until the amount of working threads is below the limit."""
+        with self.__condition:
+            while self.__active >= self.current:
+                self.__condition.wait()
+            self.__active += 1
+
+    def release(self, latency=None, congested=False):
+        """Releases a working thread and updates the limit.
+
+        Args:
+            latency (float): Seconds the thread took for a request, if any.
+            congested (bool): If the thread got a rate limit error or a
+                timeout.
+
+        """
+        with self.__condition:
+            self.__active -= 1
+            previous = self.current
+            now = time.monotonic()
+            if latency is not None:
+                if self.latency is None:
+                    self.latency = latency
+                else:
+                    self.latency += self.smoothing*(latency - self.latency)
+                if self.baseline is None or self.latency < self.baseline:
+                    self.baseline = self.latency
+            if congested:
+                # Errors of requests made at the same time decrease once
+                if now - self.__last_decrease > (self.latency or 1):
+                    self.limit = max(self.min_limit,
+                                     self.limit*self.decrease)
+                    self.__last_decrease = now
+            elif (latency is not None
+                  and self.latency <= self.tolerance*self.baseline):
+                self.limit = min(self.max_limit, self.limit + 1/self.limit)
+            if self.current != previous:
+                logging.info('Concurrency: {} threads.'.format(self.current))
+            self.__condition.notify_all()
@@ -0,0 +1,90 @@
+from   concurrent.futures import ThreadPoolExecutor
+from   threading          import current_thread
+import logging
+import time
+
+
+class QueryExecutor(object):
+
+    def __init__(self, tasks, max_queries=1, stop=None):
+        """Runs tasks for several queries at the same time.
+
+        Tasks of a query run in order in the same thread, so a search ends
+        before the update of the same query starts. If a task fails, the
+        next tasks of its query are skipped, other queries continue.
+
+        Args:
+            tasks (list[callable]): Functions receiving a query.
+            max_queries (int): Amount of queries running at the same time.
+            stop (threading.Event): If given, when it is set the tasks not
+                started yet are skipped.
+
+        """
+        self.tasks       = tasks
+        self.max_queries = max_queries
+        self.stop        = stop
+
+    def run(self, queries):
+        """Runs every task for every query, and logs how long they took.
+
+        Args:
+            queries (list[str]): Tags or users in Instagram.
+
+        Returns:
+            list[dict]: For each query, the seconds taken by each task and
+                the error that stopped it, if any.
+
+        """
+        return self.run_jobs([(query, self.tasks) for query in queries])
+
+    def run_jobs(self, jobs):
+        """Runs some tasks for each query, and logs how long they took.
+
+        Args:
+            jobs (list[tuple]): Pairs of a query and the tasks to run for it.
+
+        Returns:
+            list[dict]: Same as run.
+
+        """
+        with ThreadPoolExecutor(self.max_queries) as pool:
+            results = list(pool.map(lambda job: self.run_query(*job), jobs))
+        self.log_summary(results)
+        return results
+
+    def run_query(self, query, tasks=None):
+        """Runs every task for a query, until one fails.
+
+        Args:
+            query (str): A tag or a user in Instagram.
+            tasks (list[callable]): Tasks to run, by default all of them.
+
+        """
+        current_thread().name = query
+        result = {'query': query, 'timings': [], 'error': None}
+        for task in (self.tasks if tasks is None else tasks):
+            if self.stop is not None and self.stop.is_set():
+                break
+            start = time.time()
+            try:
+                task(query)
+            except Exception as e:
+                logging.exception('Task {} of \'{}\' failed.'.format(
+                    task.__name__, query))
+                result['error'] = e
+            result['timings'].append((task.__name__, time.time() - start))
+            if result['error'] is not None:
+                break
+        return result
+
+    @staticmethod
+    def log_summary(results):
+        """Logs the seconds taken by each task of each query."""
+        logging.info('{:<25} {:>10}  {}'.format('Query', 'Seconds', 'Tasks'))
+        for result in results:
+            logging.info('{:<25} {:>10.1f}  {}{}'.format(
+                result['query'],
+                sum(seconds for _, seconds in result['timings']),
+                ' '.join('{}={:.1f}'.format(name, seconds)
+                         for name, seconds in result['timings']),
+                ' FAILED' if result['error'] is not None else ''))
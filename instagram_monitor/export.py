@@ -0,0 +1,410 @@
+from   concurrent.futures               import ProcessPoolExecutor
+from   instagram_monitor.bloom          import BloomFilter
+from   instagram_monitor.mongo_frontend import MongoFrontEnd
+from   pathlib                          import Path
+import gzip
+import io
+import logging
+import multiprocessing
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+SUFFIXES = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+
+def open_writer(path, compression=None, buffer_size=1 << 20):
+    """Opens a text file to write, buffered and optionally compressed.
+
+    Args:
+        path (str, Path): The path of the file, without the suffix of
+            the compression.
+        compression (str): None, 'gzip' or 'zstd', which needs the
+            zstandard package.
+        buffer_size (int): Bytes buffered before writing or compressing.
+
+    Returns:
+        io.TextIOWrapper: The file, to be closed by the caller.
+
+    """
+    path = str(path) + SUFFIXES[compression]
+    if compression is None:
+        return open(path, 'w', encoding='utf8', buffering=buffer_size)
+    if compression == 'gzip':
+        raw = gzip.open(path, 'wb', compresslevel=6)
+    elif zstandard is None:
+        raise ImportError('zstd compression needs the zstandard package')
+    else:
+        raw = zstandard.ZstdCompressor().stream_writer(open(path, 'wb'))
+    return io.TextIOWrapper(io.BufferedWriter(raw, buffer_size),
+                            encoding='utf8')
+
+
+class CommentsExporter(object):
+
+    def __init__(self, mongo, post_db, comments_db, layout='collections',
+                 comments_collection='comments', batch_size=1000,
+                 compression=None, error_rate=0.001):
+        """Writes the comments and captions of the posts of a query.
+
+        Comments of a batch of posts are read with one query in the 'single'
+        layout, and with one query per post in the 'collections' layout.
+        Repeated comment ids are counted with a Bloom filter sized by the
+        amount of comments of the query, so the count may be slightly
+        higher than the real one.
+
+        Args:
+            mongo (MongoFrontEnd): The frontend to read posts and comments.
+            post_db (str): Name of database storing Instagram posts.
+            comments_db (str): Name of database storing Instagram comments.
+            layout (str): How comments are stored, see InstagramMonitor.
+            comments_collection (str): Collection with all comments, in the
+                'single' layout.
+            batch_size (int): Amount of posts whose comments are read
+                together.
+            compression (str): None, 'gzip' or 'zstd'.
+            error_rate (float): Rate of false repeated ids.
+
+        """
+        self.mongo       = mongo
+        self.post_db     = post_db
+        self.comm_db     = comments_db
+        self.layout      = layout
+        self.comm_coll   = comments_collection
+        self.batch_size  = batch_size
+        self.compression = compression
+        self.error_rate  = error_rate
+
+    def paths(self, query, part=None):
+        """Returns the paths of the comments and captions files of a query.
+
+        Args:
+            query (str): A tag or a user in Instagram.
+            part (int): If given, the number of the part of the export.
+
+        """
+        name = query if part is None else '{}.{}'.format(query, part)
+        return (Path(''.join(['exported_comments/', query, '/',
+                              name, '_comments.txt'])),
+                Path(''.join(['exported_comments/', query, '/',
+                              name, '_captions.txt'])))
+
+    def export(self, query, post_ids=None, part=None):
+        """Writes the comments and captions of the posts of a query.
+
+        Args:
+            query (str): A tag or a user in Instagram.
+            post_ids (list[str]): If given, only these posts are exported.
+            part (int): If given, the number of the part of the export,
+                which names its files.
+
+        Returns:
+            tuple: The amount of comments written, and of repeated ids.
+
+        """
+        criteria = {} if post_ids is None else {'id': {'$in': post_ids}}
+        self.mongo.change_db(self.post_db, query)
+        total = list(self.mongo.aggregate([
+            {'$match': criteria},
+            {'$group': {'_id': None, 'n': {'$sum': '$comments.count'}}}]))
+        seen  = BloomFilter(total[0]['n'] if total else 0, self.error_rate)
+
+        pathcomm, pathcapt = self.paths(query, part)
+        pathcomm.parent.mkdir(parents=True, exist_ok=True)
+        n_comments = 0
+        n_repeated = 0
+        with open_writer(pathcomm, self.compression) as file_comm, \
+             open_writer(pathcapt, self.compression) as file_capt:
+            self.mongo.change_db(self.post_db, query)
+            posts = self.mongo.find(criteria, {'id': 1, 'comments.count': 1,
+                                               'caption': 1, '_id': 0})
+            batch = []
+            for post in posts.batch_size(self.batch_size):
+                caption = post.get('caption')
+                if caption and caption.get('text'):
+                    file_capt.write(''.join([
+                        post['id'], '\t',
+                        caption['from']['username'], '\t',
+                        caption.get('id', ''), '\t',
+                        caption['text'].replace('\n', ' '), '\n']))
+                if post['comments']['count']:
+                    batch.append(post['id'])
+                if len(batch) >= self.batch_size:
+                    n_com, n_rep = self.__write_comments(batch, file_comm,
+                                                         seen)
+                    n_comments += n_com
+                    n_repeated += n_rep
+                    batch = []
+            if batch:
+                n_com, n_rep = self.__write_comments(batch, file_comm, seen)
+                n_comments += n_com
+                n_repeated += n_rep
+        return n_comments, n_repeated
+
+    def comments(self, post_ids, fields=('id', 'text', 'from.username')):
+        """Yields the comments of some posts, with their 'post_id'.
+
+        Args:
+            post_ids (list[str]): Ids of the posts.
+            fields (tuple[str]): Fields of the comments read.
+
+        """
+        projection = dict.fromkeys(fields, 1)
+        projection['_id'] = 0
+        if self.layout == 'single':
+            self.mongo.change_db(self.comm_db, self.comm_coll)
+            projection['post_id'] = 1
+            comments = self.mongo.find({'post_id': {'$in': post_ids}},
+                                       projection)
+            for comment in comments.batch_size(10 * self.batch_size):
+                yield comment
+        else:
+            for post_id in post_ids:
+                self.mongo.change_db(self.comm_db, post_id)
+                for comment in self.mongo.find({}, projection).batch_size(
+                        10 * self.batch_size):
+                    comment['post_id'] = post_id
+                    yield comment
+
+    def __write_comments(self, post_ids, file_comm, seen):
+        n_comments = 0
+        n_repeated = 0
+        for comment in self.comments(post_ids):
+            n_comments += 1
+            n_repeated += seen.add(comment['id'])
+            file_comm.write(''.join([
+                comment['post_id'], '\t',
+                comment['from']['username'], '\t',
+                comment['id'], '\t',
+                comment['text'].replace('\n', ' '), '\n']))
+        return n_comments, n_repeated
+
+
+class ColumnarExporter(object):
+
+    FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+
+    def __init__(self, mongo, post_db, comments_db, layout='collections',
+                 comments_collection='comments', batch_size=1000,
+                 file_format='parquet', rows_per_group=65536,
+                 rows_per_file=1 << 22):
+        """Writes the posts and comments of a query to columnar files.
+
+        Posts and comments are written with a fixed schema, each one to
+        its own directory of parts of about rows_per_file rows, e.g.
+        'exported_columnar/<query>/comments/part-00000.parquet'. Parts
+        are compressed with zstd, and written by groups of rows, so only
+        a group is kept in memory. Parquet parts can be read column by
+        column, Arrow IPC parts can also be memory mapped. Comments are
+        read with a CommentsExporter, in batches of posts.
+
+        Args:
+            mongo (MongoFrontEnd): The frontend to read posts and comments.
+            post_db (str): Name of database storing Instagram posts.
+            comments_db (str): Name of database storing Instagram comments.
+            layout (str): How comments are stored, see InstagramMonitor.
+            comments_collection (str): Collection with all comments, in the
+                'single' layout.
+            batch_size (int): Amount of posts whose comments are read
+                together.
+            file_format (str): 'parquet' or 'arrow', Arrow IPC files.
+            rows_per_group (int): Rows written together, a row group of
+                Parquet or a record batch of Arrow.
+            rows_per_file (int): Rows after which a part is closed.
+
+        """
+        if pyarrow is None:
+            raise ImportError('Columnar exports need the pyarrow package')
+        self.mongo          = mongo
+        self.post_db        = post_db
+        self.batch_size     = batch_size
+        self.reader         = CommentsExporter(mongo, post_db, comments_db,
+                                               layout, comments_collection,
+                                               batch_size)
+        self.file_format    = file_format
+        self.rows_per_group = rows_per_group
+        self.rows_per_file  = rows_per_file
+
+    @staticmethod
+    def schemas():
+        """Returns the schemas of the posts and comments files."""
+        return (pyarrow.schema([('post_id', pyarrow.string()),
+                                ('username', pyarrow.string()),
+                                ('created_time', pyarrow.int64()),
+                                ('comments', pyarrow.int64()),
+                                ('likes', pyarrow.int64()),
+                                ('caption', pyarrow.string())]),
+                pyarrow.schema([('post_id', pyarrow.string()),
+                                ('comment_id', pyarrow.string()),
+                                ('username', pyarrow.string()),
+                                ('created_time', pyarrow.int64()),
+                                ('text', pyarrow.string())]))
+
+    def directories(self, query):
+        """Returns the directories of the posts and comments of a query."""
+        path = Path(''.join(['exported_columnar/', query]))
+        return path / 'posts', path / 'comments'
+
+    def export(self, query):
+        """Writes the posts and comments of a query.
+
+        Args:
+            query (str): A tag or a user in Instagram.
+
+        Returns:
+            tuple: The amount of posts and of comments written.
+
+        """
+        schema_posts, schema_comms = self.schemas()
+        path_posts, path_comms     = self.directories(query)
+        posts_out = _PartsWriter(path_posts, schema_posts, self.file_format,
+                                 self.rows_per_group, self.rows_per_file)
+        comms_out = _PartsWriter(path_comms, schema_comms, self.file_format,
+                                 self.rows_per_group, self.rows_per_file)
+        try:
+            self.mongo.change_db(self.post_db, query)
+            posts = self.mongo.find({}, {'id': 1, 'user.username': 1,
+                                         'created_time': 1,
+                                         'comments.count': 1,
+                                         'likes.count': 1, 'caption.text': 1,
+                                         '_id': 0})
+            batch = []
+            for post in posts.batch_size(self.batch_size):
+                caption = post.get('caption') or {}
+                posts_out.write((post['id'], post['user']['username'],
+                                 int(post['created_time']),
+                                 post['comments']['count'],
+                                 post['likes']['count'],
+                                 caption.get('text')))
+                if post['comments']['count']:
+                    batch.append(post['id'])
+                if len(batch) >= self.batch_size:
+                    self.__write_comments(batch, comms_out)
+                    batch = []
+            if batch:
+                self.__write_comments(batch, comms_out)
+        finally:
+            posts_out.close()
+            comms_out.close()
+        return posts_out.n_rows, comms_out.n_rows
+
+    def __write_comments(self, post_ids, comms_out):
+        fields = ('id', 'text', 'from.username', 'created_time')
+        for comment in self.reader.comments(post_ids, fields):
+            comms_out.write((comment['post_id'], comment['id'],
+                             comment['from']['username'],
+                             int(comment['created_time']), comment['text']))
+
+
+class _PartsWriter(object):
+    # Writes rows to the parts of a directory, by groups of rows
+
+    def __init__(self, path, schema, file_format, rows_per_group,
+                 rows_per_file):
+        self.path           = path
+        self.schema         = schema
+        self.file_format    = file_format
+        self.rows_per_group = rows_per_group
+        self.rows_per_file  = rows_per_file
+        self.n_rows         = 0
+        self.n_parts        = 0
+        self.file_rows      = 0
+        self.writer         = None
+        self.rows           = []
+        self.path.mkdir(parents=True, exist_ok=True)
+        # Parts of a previous export are replaced, not mixed
+        for old in self.path.glob('part-*'):
+            old.unlink()
+
+    def write(self, row):
+        self.rows.append(row)
+        self.n_rows += 1
+        if len(self.rows) >= self.rows_per_group:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        if self.writer is None:
+            self.__open()
+        batch = pyarrow.RecordBatch.from_arrays(
+            [pyarrow.array(column, type=field.type)
+             for column, field in zip(zip(*self.rows), self.schema)],
+            schema=self.schema)
+        self.writer.write_batch(batch)
+        self.file_rows += len(self.rows)
+        self.rows = []
+        if self.file_rows >= self.rows_per_file:
+            self.writer.close()
+            self.writer = None
+
+    def __open(self):
+        path = self.path / 'part-{:05d}{}'.format(
+            self.n_parts, ColumnarExporter.FORMATS[self.file_format])
+        if self.file_format == 'parquet':
+            self.writer = pyarrow.parquet.ParquetWriter(
+                str(path), self.schema, compression='zstd')
+        else:
+            self.writer = pyarrow.ipc.new_file(
+                str(path), self.schema,
+                options=pyarrow.ipc.IpcWriteOptions(compression='zstd'))
+        self.n_parts  += 1
+        self.file_rows = 0
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+def _export_part(host, port, options, query, post_ids, part):
+    # Runs in a worker process, which needs its own connections
+    exporter = CommentsExporter(MongoFrontEnd(host, port), **options)
+    return exporter.export(query, post_ids, part)
+
+
+def export_parallel(host, port, options, query, n_workers):
+    """Exports the comments of a query split in parts by worker processes.
+
+    Posts are split in n_workers parts of consecutive posts, each part is
+    written to its own files. Repeated ids are counted within each part.
+
+    Args:
+        host (str): Address where MongoDB is listening.
+        port (int): Port where MongoDB is listening.
+        options (dict): Keyword arguments of CommentsExporter, but mongo.
+        query (str): A tag or a user in Instagram.
+        n_workers (int): Amount of worker processes.
+
+    Returns:
+        tuple: The amount of comments written, and of repeated ids.
+
+    """
+    mongo = MongoFrontEnd(host, port, options['post_db'], query)
+    ids   = [post['id'] for post in mongo.find({}, {'id': 1, '_id': 0})]
+    size  = max(-(-len(ids) // n_workers), 1)
+    parts = [ids[start:start + size] for start in range(0, len(ids), size)]
+    logging.info('Exporting {} posts in {} parts.'.format(len(ids),
+                                                          len(parts)))
+    # Workers are spawned, forking would copy the connections and locks of
+    # the threads of this process
+    with ProcessPoolExecutor(
+            n_workers,
+            mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = [pool.submit(_export_part, host, port, options, query,
+                               part_ids, part)
+                   for part, part_ids in enumerate(parts)]
+        results = [future.result() for future in futures]
+    return (sum(n_comments for n_comments, _ in results),
+            sum(n_repeated for _, n_repeated in results))
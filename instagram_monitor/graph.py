@@ -0,0 +1,235 @@
+from   bson.objectid import ObjectId
+from   collections   import Counter
+from   datetime      import datetime, timezone
+import networkx
+import pymongo
+import re
+import time
+
+
+# The pattern to find Instagram user mentions,
+# example: 'dsdf @ds54d.sds.dd klfg' -> 'ds54d.sds.dd'.
+MENTION = re.compile('(?:@)([A-Za-z0-9_]'
+                           '(?:(?:[A-Za-z0-9_]|(?:\\.(?!\\.))){0,28}'
+                              '(?:[A-Za-z0-9_]))?)')
+
+
+class MentionGraph(object):
+
+    def __init__(self, mongo, post_db, comments_db, edges, owners,
+                 watermarks, layout='collections',
+                 comments_collection='comments', batch_size=1000, margin=60):
+        """Mentions between users of a query, kept up to date incrementally.
+
+        Edges are stored weighted by the amount of mentions from a user to
+        another, and by the amount of comments of a user to the posts of
+        another. Each update only reads the posts saved since the previous
+        one, by their 'last_checked', which are saved after their comments,
+        e.g. after all their pages when they are streamed. The owner of
+        each post is stored with the '_id' of the newest comment read, so
+        only newer comments are read, and captions are read once. Documents
+        saved less than margin seconds ago are read by the next update.
+
+        Args:
+            mongo (MongoFrontEnd): The frontend to read posts and comments.
+            post_db (str): Name of database storing Instagram posts.
+            comments_db (str): Name of database storing Instagram comments.
+            edges (pymongo.collection.Collection): Where edges are stored.
+            owners (pymongo.collection.Collection): Where the owner of each
+                post, and the '_id' of its newest comment read, are stored.
+            watermarks (MongoStore): Where the date of the posts read up to
+                is stored for each query.
+            layout (str): How comments are stored, see InstagramMonitor.
+            comments_collection (str): Collection with all comments, in the
+                'single' layout.
+            batch_size (int): Amount of texts counted before updating the
+                stored edges.
+            margin (float): Seconds before now not read yet.
+
+        """
+        self.mongo      = mongo
+        self.post_db    = post_db
+        self.comm_db    = comments_db
+        self.edges      = edges
+        self.owners     = owners
+        self.watermarks = watermarks
+        self.layout     = layout
+        self.comm_coll  = comments_collection
+        self.batch_size = batch_size
+        self.margin     = margin
+        self.edges.create_index([('query', pymongo.ASCENDING),
+                                 ('source', pymongo.ASCENDING),
+                                 ('target', pymongo.ASCENDING)], unique=True)
+        self.owners.create_index([('query', pymongo.ASCENDING),
+                                  ('post_id', pymongo.ASCENDING)],
+                                 unique=True)
+
+    def reset(self, query):
+        """Removes the edges of a query, the next update reads everything."""
+        self.edges.delete_many({'query': query})
+        self.owners.delete_many({'query': query})
+        self.watermarks.delete('graph:' + query)
+
+    def update(self, query):
+        """Adds the mentions of the texts stored since the last update.
+
+        Args:
+            query (str): A tag or a user in Instagram.
+
+        Returns:
+            int: The amount of captions and comments read.
+
+        """
+        state  = self.watermarks.get('graph:' + query)
+        cutoff = int(time.time() - self.margin)
+        saved  = {'$lt': cutoff}
+        if state:
+            saved['$gte'] = state['checked']
+
+        n_read = 0
+        self.mongo.change_db(self.post_db, query)
+        # Posts stored before 'last_checked' existed are read the first time
+        posts = self.mongo.find({'last_checked': saved} if state else {},
+                                {'id': 1, 'caption': 1, 'user.username': 1,
+                                 'comments.count': 1, '_id': 0})
+        batch = []
+        for post in posts.batch_size(self.batch_size):
+            batch.append(post)
+            if len(batch) >= self.batch_size:
+                n_read += self.__read_posts(query, batch, cutoff)
+                batch = []
+        if batch:
+            n_read += self.__read_posts(query, batch, cutoff)
+
+        self.watermarks.put('graph:' + query, {'checked': cutoff})
+        return n_read
+
+    def __read_posts(self, query, posts, cutoff):
+        """Counts the captions and new comments of a batch of posts.
+
+        Captions are counted the first time a post is read, comments newer
+        than the newest one read of each post, and created before cutoff.
+
+        Returns:
+            int: The amount of captions and comments read.
+
+        """
+        counts = Counter()
+        n_read = 0
+        read   = {owner['post_id']: owner for owner
+                  in self.owners.find({'query': query,
+                                       'post_id': {'$in': [post['id'] for
+                                                           post in posts]}})}
+        owners = {}
+        for post in posts:
+            if post['id'] in read:
+                owners[post['id']] = read[post['id']]
+                continue
+            owners[post['id']] = {'owner': post['user']['username'],
+                                  'read_id': None}
+            caption = post.get('caption')
+            if caption and caption.get('text'):
+                self.__count(counts, caption['from']['username'],
+                             caption['text'])
+                n_read += 1
+
+        post_ids = [post['id'] for post in posts
+                    if post['comments']['count']]
+        newest   = {}
+        for comment in self.__comments(post_ids, owners,
+                                       self.__first_id(cutoff)):
+            post_id = comment['post_id']
+            self.__count(counts, comment['from']['username'],
+                         comment['text'], owners[post_id]['owner'])
+            n_read += 1
+            newest[post_id] = max(newest.get(post_id, comment['_id']),
+                                  comment['_id'])
+            if len(counts) >= self.batch_size:
+                self.__save(query, counts)
+                counts = Counter()
+        # Counts are saved before the comments are marked as read
+        self.__save(query, counts)
+        requests = [pymongo.UpdateOne(
+                        {'query': query, 'post_id': post_id},
+                        {'$set': {'owner': owner['owner'],
+                                  'read_id': newest.get(post_id,
+                                                        owner['read_id'])}},
+                        upsert=True)
+                    for post_id, owner in owners.items()
+                    if post_id not in read or post_id in newest]
+        if requests:
+            self.owners.bulk_write(requests, ordered=False)
+        return n_read
+
+    @staticmethod
+    def __first_id(timestamp):
+        """Returns the lowest '_id' created at a date in unix format."""
+        return ObjectId.from_datetime(datetime.fromtimestamp(timestamp,
+                                                             timezone.utc))
+
+    def __comments(self, post_ids, owners, last_id):
+        """Yields the comments of some posts not read yet, before last_id."""
+        projection = {'text': 1, 'from.username': 1}
+        if self.layout == 'single':
+            if not post_ids:
+                return
+            self.mongo.change_db(self.comm_db, self.comm_coll)
+            projection['post_id'] = 1
+            read_ids = [owners[post_id]['read_id'] for post_id in post_ids]
+            new      = {'$lt': last_id}
+            if None not in read_ids:
+                new['$gt'] = min(read_ids)
+            for comment in self.mongo.find({'_id': new,
+                                            'post_id': {'$in': post_ids}},
+                                           projection):
+                read_id = owners[comment['post_id']]['read_id']
+                if read_id is None or comment['_id'] > read_id:
+                    yield comment
+        else:
+            for post_id in post_ids:
+                self.mongo.change_db(self.comm_db, post_id)
+                new = {'$lt': last_id}
+                if owners[post_id]['read_id'] is not None:
+                    new['$gt'] = owners[post_id]['read_id']
+                for comment in self.mongo.find({'_id': new}, projection):
+                    comment['post_id'] = post_id
+                    yield comment
+
+    @staticmethod
+    def __count(counts, username, text, owner=None):
+        for user in MENTION.findall(text):
+            counts[(username, user, 'mentions')] += 1
+        if owner is not None:
+            counts[(username, owner, 'replies')] += 1
+
+    def __save(self, query, counts):
+        if not counts:
+            return
+        requests = [pymongo.UpdateOne(
+                        {'query': query, 'source': source, 'target': target},
+                        {'$inc': {kind: n}}, upsert=True)
+                    for (source, target, kind), n in counts.items()]
+        self.edges.bulk_write(requests, ordered=False)
+
+    def graph(self, query, op_mentioned=False):
+        """Returns the mention graph of a query from the stored edges.
+
+        Args:
+            query (str): A tag or a user in Instagram.
+            op_mentioned (bool): If any comment counts as a mention to the
+                user who created the post.
+
+        Returns:
+            networkx.DiGraph: Users and their mentions, weighted by the
+                amount of mentions.
+
+        """
+        graph = networkx.DiGraph()
+        for edge in self.edges.find({'query': query}):
+            weight = edge.get('mentions', 0)
+            if op_mentioned:
+                weight += edge.get('replies', 0)
+            if weight:
+                graph.add_edge(edge['source'], edge['target'], weight=weight)
+        return graph
+
@@ -0,0 +1,274 @@
+from   contextlib  import contextmanager
+from   functools   import wraps
+from   http.server import BaseHTTPRequestHandler, HTTPServer
+from   threading   import Event, Lock, Thread
+import bisect
+import json
+import logging
+import time
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60, 300)
+
+
+class Registry(object):
+
+    def __init__(self, prefix='instagram_monitor_', buckets=DEFAULT_BUCKETS):
+        """A thread safe registry of counters and histograms.
+
+        Metrics are created the first time they are used, each combination
+        of labels of a metric is a different series.
+
+        Args:
+            prefix (str): Prefix of the names of the exported metrics.
+            buckets (tuple[float]): Upper bounds of the histogram buckets.
+
+        """
+        self.prefix     = prefix
+        self.buckets    = tuple(buckets)
+        self.counters   = {}
+        self.histograms = {}
+        self.__lock     = Lock()
+
+    @staticmethod
+    def __key(name, labels):
+        return (name, tuple(sorted(labels.items())))
+
+    def inc(self, name, value=1, **labels):
+        """Adds a value to a counter.
+
+        Args:
+            name (str): The name of the counter.
+            value (float): The amount to add.
+            labels: Labels of the series, e.g. endpoint='get_post'.
+
+        """
+        key = self.__key(name, labels)
+        with self.__lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Records a value, usually seconds, in a histogram.
+
+        Args:
+            name (str): The name of the histogram.
+            value (float): The value observed.
+            labels: Labels of the series.
+
+        """
+        key   = self.__key(name, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.__lock:
+            if key not in self.histograms:
+                self.histograms[key] = {
+                    'buckets': [0] * (len(self.buckets) + 1),
+                    'sum': 0, 'count': 0}
+            histogram = self.histograms[key]
+            histogram['buckets'][index] += 1
+            histogram['sum']   += value
+            histogram['count'] += 1
+
+    def snapshot(self):
+        """Returns the current values of every metric.
+
+        Returns:
+            dict: Lists of 'counters' and 'histograms', each one with its
+                'name', 'labels' and values. Buckets are not cumulative.
+
+        """
+        with self.__lock:
+            counters = [{'name': name, 'labels': dict(labels),
+                         'value': value}
+                        for (name, labels), value
+                        in sorted(self.counters.items())]
+            histograms = [{'name': name, 'labels': dict(labels),
+                           'buckets': list(histogram['buckets']),
+                           'sum': histogram['sum'],
+                           'count': histogram['count']}
+                          for (name, labels), histogram
+                          in sorted(self.histograms.items())]
+        return {'time': time.time(), 'le': list(self.buckets),
+                'counters': counters, 'histograms': histograms}
+
+    def prometheus(self):
+        """Returns every metric in the Prometheus text format."""
+        snapshot = self.snapshot()
+        lines    = []
+        typed    = set()
+
+        def series(name, labels, value):
+            labels = ','.join('{}="{}"'.format(
+                label, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                for label, value in sorted(labels.items()))
+            return '{}{}{} {}'.format(self.prefix, name,
+                                      '{' + labels + '}' if labels else '',
+                                      value)
+
+        for counter in snapshot['counters']:
+            if counter['name'] not in typed:
+                typed.add(counter['name'])
+                lines.append('# TYPE {}{} counter'.format(self.prefix,
+                                                         counter['name']))
+            lines.append(series(counter['name'], counter['labels'],
+                                counter['value']))
+        for histogram in snapshot['histograms']:
+            name = histogram['name']
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE {}{} histogram'.format(self.prefix, name))
+            total = 0
+            for le, count in zip(snapshot['le'] + ['+Inf'],
+                                 histogram['buckets']):
+                total += count
+                lines.append(series(name + '_bucket',
+                                    dict(histogram['labels'], le=le), total))
+            lines.append(series(name + '_sum', histogram['labels'],
+                                histogram['sum']))
+            lines.append(series(name + '_count', histogram['labels'],
+                                histogram['count']))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def inc(name, value=1, **labels):
+    """Adds a value to a counter of the default registry."""
+    registry.inc(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    """Records a value in a histogram of the default registry."""
+    registry.observe(name, value, **labels)
+
+
+@contextmanager
+def timer(name, **labels):
+    """Records the seconds a block takes in a histogram.
+
+    If the block raises an exception, it is also counted in the counter
+    name + '_errors_total' with the same labels.
+
+    Args:
+        name (str): The name of the histogram, e.g. 'endpoint_seconds'.
+        labels: Labels of the series.
+
+    """
+    start = time.monotonic()
+    try:
+        yield
+    except BaseException:
+        inc(name + '_errors_total', **labels)
+        raise
+    finally:
+        observe(name, time.monotonic() - start, **labels)
+
+
+def timed(name, **labels):
+    """Decorates a function to record the seconds each call takes.
+
+    Args:
+        name (str): The name of the histogram.
+        labels: Labels of the series.
+
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with timer(name, **labels):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class MetricsServer(object):
+
+    def __init__(self, port, host='127.0.0.1', registry=registry):
+        """Serves the metrics of a registry over HTTP in a thread.
+
+        The Prometheus text format is served at /metrics, and the JSON
+        snapshot at /metrics.json.
+
+        Args:
+            port (int): The port where to listen.
+            host (str): The address where to listen, local by default.
+            registry (Registry): The registry of the metrics.
+
+        """
+        source = registry
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body = source.prometheus().encode()
+                    kind = 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body = json.dumps(source.snapshot()).encode()
+                    kind = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', kind)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = HTTPServer((host, port), Handler)
+        self.thread = Thread(target=self.server.serve_forever,
+                             name='metrics-server', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        logging.info('Serving metrics at http://{}:{}/metrics'.format(
+            *self.server.server_address))
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class SnapshotWriter(object):
+
+    def __init__(self, path, interval=60, registry=registry):
+        """Appends JSON snapshots of a registry to a file periodically.
+
+        Each line of the file is a snapshot, the last one is written when
+        the writer stops.
+
+        Args:
+            path (str): The path of the file.
+            interval (float): Seconds between snapshots.
+            registry (Registry): The registry of the metrics.
+
+        """
+        self.path     = path
+        self.interval = interval
+        self.registry = registry
+        self.__stop   = Event()
+        self.__thread = Thread(target=self.__run, name='metrics-writer',
+                               daemon=True)
+
+    def start(self):
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.__stop.set()
+        self.__thread.join()
+
+    def write(self):
+        """Appends the current snapshot to the file."""
+        with open(self.path, 'a') as file_metrics:
+            file_metrics.write(json.dumps(self.registry.snapshot()) + '\n')
+
+    def __run(self):
+        while not self.__stop.wait(self.interval):
+            self.write()
+        self.write()
@@ -1,6 +1,8 @@
+from   instagram_monitor import metrics
 import datetime
 import json
 import pymongo
+import pymongo.errors
 import logging
 
 '''
@@ -20,17 +22,42 @@ class MongoFrontEnd:
     _extra_DB = "mulan-extra"
     _catalog_DB = "mulan-catalog"
 
-    def __init__(self, host, port, db=None, coll=None, username=None, password=None):
-        if username and password:
+    # Indexes as lists of (keys, options) accepted by create_index
+    POST_INDEXES = [
+        ([('id', pymongo.ASCENDING)], {'unique': True}),
+        ([('created_time', pymongo.ASCENDING)], {}),
+        ([('archived', pymongo.ASCENDING),
+          ('created_time', pymongo.ASCENDING)], {})]
+    COMMENT_INDEXES = [
+        ([('id', pymongo.ASCENDING)], {'unique': True}),
+        ([('created_time', pymongo.ASCENDING)], {})]
+    COMMENT_STORE_INDEXES = [
+        ([('post_id', pymongo.ASCENDING),
+          ('id', pymongo.ASCENDING)], {'unique': True}),
+        ([('post_id', pymongo.ASCENDING),
+          ('created_time', pymongo.ASCENDING)], {})]
+
+    def __init__(self, host, port, db=None, coll=None, username=None, password=None, client=None):
+        if client is not None:
+            c = client
+        elif username and password:
             mongo_uri = 'mongodb://%s:%s@%s:%s/admin' % (username, password, host, port)
             c = pymongo.MongoClient(mongo_uri)
         else:
             c = pymongo.MongoClient(host, port)
         self.__client = c
+        self.__indexed = set()
 
         if db != None:
             self.change_db(db, coll)
 
+    def share(self):
+        # Returns a frontend with its own current collection, using the same
+        # connections, e.g. for another thread
+        other = MongoFrontEnd(None, None, client=self.__client)
+        other.__indexed = self.__indexed
+        return other
+
     def change_db(self, db, coll=None):
         # Get a reference to a particular database
         self.__db = self.__client[db]
@@ -41,6 +68,10 @@ class MongoFrontEnd:
         # Reference a particular collection in the database
         self.__collection = self.__db[coll]
 
+    def get_collection(self, db, coll):
+        # Returns a collection without changing the current one
+        return self.__client[db][coll]
+
     def save_json(self, data):
         r = self.__collection.insert(data) #insert is deprecated
         return r
@@ -49,6 +80,39 @@ class MongoFrontEnd:
         for item in data:
             self.save_json(item)
 
+    def upsert_many(self, data, keys=('id',), batch_size=1000):
+        # Inserts or replaces documents matched by keys, using unordered bulk
+        # writes of batch_size operations instead of one request per document.
+        # Returns the amount of inserted and updated documents.
+        inserted = 0
+        updated  = 0
+        batch    = {}
+        for item in data:
+            item.pop('_id', None)
+            # Repeated keys in a batch would race, the last document wins
+            batch[tuple(item[key] for key in keys)] = item
+            if len(batch) >= batch_size:
+                n_ins, n_upd = self.__bulk_replace(self.__collection,
+                                                   batch, keys)
+                inserted += n_ins
+                updated  += n_upd
+                batch     = {}
+        if len(batch):
+            n_ins, n_upd = self.__bulk_replace(self.__collection, batch, keys)
+            inserted += n_ins
+            updated  += n_upd
+        return (inserted, updated)
+
+    def __bulk_replace(self, coll, batch, keys):
+        requests = [pymongo.ReplaceOne(dict(zip(keys, values)), item,
+                                       upsert=True)
+                    for values, item in batch.items()]
+        with metrics.timer('mongo_seconds', op='bulk_write'):
+            r = coll.bulk_write(requests, ordered=False)
+        metrics.inc('mongo_documents_written_total', len(requests),
+                    op='bulk_write')
+        return (r.upserted_count, r.matched_count)
+
     def find(self, criteria=None, projection=None):
         # Optionally, use criteria and projection to limit the data that is
         # returned as documented in
@@ -65,12 +129,26 @@ class MongoFrontEnd:
         # Returning a cursor
         return cursor
 
+    def count(self, criteria=None):
+        # Returns the amount of documents of the current collection matching
+        # criteria, counted by the server
+        with metrics.timer('mongo_seconds', op='count'):
+            return self.__collection.count_documents(criteria or {})
+
+    def aggregate(self, pipeline):
+        # Runs an aggregation pipeline in the current collection
+        with metrics.timer('mongo_seconds', op='aggregate'):
+            return self.__collection.aggregate(pipeline, allowDiskUse=True)
+
     def updateMany(self, filter=None, update=None):
         coll = self.__collection
         if filter is None:
             filter={}
         if update is not None:
-            doc = coll.update_many(filter, update)
+            with metrics.timer('mongo_seconds', op='update_many'):
+                doc = coll.update_many(filter, update)
+            metrics.inc('mongo_documents_written_total', doc.modified_count,
+                        op='update_many')
         return doc
 
     def get_limits(self, atr='id'):
@@ -84,7 +162,8 @@ class MongoFrontEnd:
         return (min_atr, max_atr)
 
     def get_info_limits(self, atr='id'):
-        return self.__collection.find_one(sort=[(atr, pymongo.ASCENDING)]), self.__collection.find_one(sort=[(atr, pymongo.DESCENDING)])
+        with metrics.timer('mongo_seconds', op='find_one'):
+            return self.__collection.find_one(sort=[(atr, pymongo.ASCENDING)]), self.__collection.find_one(sort=[(atr, pymongo.DESCENDING)])
 
     def get_databases(self):
         return [db for db in self.__client.database_names() if db not in ['local', 'admin', 'test']]
@@ -92,37 +171,65 @@ class MongoFrontEnd:
     def get_collections(self):
         return [c for c in self.__db.collection_names() if c not in ['system.indexes']]
 
-    def join_collections(self, source_collection, target_collection=None, source_database=None, target_database=None):
-        if target_collection is None:
-            if target_database is None:
-                return None
-            else:
-                target_collection = source_collection
-        if source_database is not None:
-            self.change_db(source_database)
-        self.change_collection(source_collection)
-
-        scr_coll = self.__collection
-        scr = self.find()
-        if target_database is not None:
-            self.change_db(target_database)
-        self.change_collection(target_collection)
-        target_coll = self.__collection
-        cnt = 0
-        for tweet in scr:
-            tid = tweet['id']
-            dst = self.find({'id':tid})
-            if dst.count() == 0:
-                cnt += 1
-                #not exists this 'id' in the target collection
-                self.save_json(tweet)
-            if dst.count() == 1:
-                cnt += 1
-                #updating this 'id' in the target collection
-                target_coll.remove({'id':tid})
-                self.save_json(tweet)
-            scr_coll.remove({'id':tid})
-        return cnt
+    def ensure_indexes(self, indexes):
+        # Creates the indexes of the current collection the first time it is
+        # used by this frontend. An unique index that cannot be built because
+        # of repeated values is skipped, check_indexes can repair it.
+        coll = self.__collection
+        key  = (self.__db.name, coll.name)
+        if key in self.__indexed:
+            return
+        for keys, options in indexes:
+            try:
+                coll.create_index(keys, **options)
+            except pymongo.errors.OperationFailure as e:
+                logging.warning('Index {} of {}.{} not created: {}'.format(
+                    keys, key[0], key[1], e))
+        self.__indexed.add(key)
+
+    def check_indexes(self, indexes, repair=False):
+        # Returns the indexes missing in the current collection, or whose
+        # keys exist with another unique flag. If repair is True, removes
+        # documents repeating values of unique indexes, keeping the last
+        # inserted one, and creates the missing indexes, dropping before
+        # those with the wrong unique flag.
+        coll     = self.__collection
+        existing = {tuple(map(tuple, info['key'])):
+                        (name, bool(info.get('unique')))
+                    for name, info in coll.index_information().items()}
+        missing  = []
+        for keys, options in indexes:
+            index = existing.get(tuple(map(tuple, keys)))
+            if index is None or index[1] != bool(options.get('unique')):
+                missing.append((keys, options))
+        if repair:
+            for keys, options in missing:
+                index = existing.get(tuple(map(tuple, keys)))
+                if index is not None:
+                    coll.drop_index(index[0])
+                if options.get('unique'):
+                    self.__remove_duplicates(coll, [k for k, _ in keys])
+                coll.create_index(keys, **options)
+            self.__indexed.add((self.__db.name, coll.name))
+        return missing
+
+    def __remove_duplicates(self, coll, fields):
+        groups = coll.aggregate([
+            {'$sort': {'_id': 1}},
+            {'$group': {'_id': {f.replace('.', '_'): '$' + f
+                                for f in fields},
+                        'ids': {'$push': '$_id'},
+                        'n': {'$sum': 1}}},
+            {'$match': {'n': {'$gt': 1}}}],
+            allowDiskUse=True)
+        removed = 0
+        for group in groups:
+            r = coll.delete_many({'_id': {'$in': group['ids'][:-1]}})
+            removed += r.deleted_count
+        if removed:
+            logging.info('Removed {} repeated documents from {}.'.format(
+                removed, coll.name))
+        return removed
 
     def drop_collection(self, collection):
         self.__db.drop_collection(collection)
\ No newline at end of file
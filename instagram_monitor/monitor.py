@@ -1,23 +1,44 @@
 from collections                       import Counter
 from datetime                          import date
+from instagram_monitor                 import metrics
+from instagram_monitor.export          import ColumnarExporter
+from instagram_monitor.export          import CommentsExporter
+from instagram_monitor.export          import export_parallel
+from instagram_monitor.graph           import MentionGraph
 from instagram_monitor.mongo_frontend  import MongoFrontEnd
 from instagram_monitor.searcher        import InstagramSearcher as Searcher
+from instagram_monitor.state           import Checkpoints, FileStore, MongoStore
+from instagram_monitor.state           import UserIds
 from matplotlib                        import pyplot            as plt
 from matplotlib                        import dates             as md
 from matplotlib.dates                  import MO, TU, WE, TH, FR, SA, SU
+from functools                         import partial
 from pathlib                           import Path
+from threading                         import Lock, local
 import logging
 import networkx
-import re
 import time
 
 
+# pyplot keeps global state, figures are made by one thread at a time
+_plot_lock = Lock()
+
+
 class InstagramMonitor(object):
 
+    # Collection of comments_db storing all comments, in the 'single' layout
+    COMMENTS_COLLECTION = 'comments'
+
     def __init__(self, username=None, password=None,
                  host='localhost', port=27017,
                  post_db='post', comments_db='comment',
-                 rich_comments=False, update_days=2):
+                 rich_comments=False, update_days=2, batch_size=1000,
+                 comments_layout='collections', engine='threads',
+                 max_requests=200, stream=False, checkpoint_pages=5,
+                 checkpoint_dir=None, incremental=False, user_cache_days=7,
+                 export_compression=None, export_workers=1,
+                 columnar_format='parquet', detect_changes=False,
+                 **searcher_options):
         """
 
         Args:
@@ -29,61 +50,306 @@ class InstagramMonitor(object):
             comments_db (str): Name of database storing Instagram comments.
             update_days (int): Amount of days old a post must be, to not try
                 to search for new comments.
+            batch_size (int): Amount of documents written to MongoDB in
+                each bulk operation.
+            comments_layout (str): How comments are stored in comments_db,
+                'collections' uses a collection for each post, 'single'
+                uses one collection for all comments tagged with 'post_id'.
+            engine (str): How posts are downloaded, 'threads' or 'asyncio'.
+            max_requests (int): Amount of requests in flight at the same
+                time with the 'asyncio' engine.
+            stream (bool): If downloaded posts are saved in batches while
+                the download continues, instead of all at the end.
+            checkpoint_pages (int): Amount of pages of a search between
+                checkpoints of its pagination, 0 disables checkpoints.
+            checkpoint_dir (str): Directory where checkpoints are saved,
+                by default they are saved in the '<post_db>-state' database.
+            incremental (bool): If updates only download comments newer
+                than the newest comment of the last complete download of
+                each post.
+            user_cache_days (float): Days the ids of users are cached in the
+                '<post_db>-state' database, 0 disables the cache.
+            export_compression (str): How exported comments are compressed,
+                None, 'gzip' or 'zstd'.
+            export_workers (int): Amount of processes exporting the comments
+                of a query.
+            columnar_format (str): Format of the columnar exports,
+                'parquet' or 'arrow'.
+            detect_changes (bool): If updates only download posts whose
+                counts of comments or likes changed in the GraphQL pages
+                of their query.
+            searcher_options: Other keyword arguments of InstagramSearcher.
 
         """
-        self.searcher    = Searcher(username, password,
-                                    rich_comments=rich_comments)
         self.host        = host
         self.port        = port
+        self.__mongo     = MongoFrontEnd(self.host, self.port)
+        self.__local     = local()
+        self.state_db    = post_db + '-state'
+        if checkpoint_dir:
+            store = FileStore(checkpoint_dir)
+        else:
+            store = MongoStore(
+                self.mongo.get_collection(self.state_db, 'checkpoints'))
+        checkpoints = (Checkpoints(store, checkpoint_pages)
+                       if checkpoint_pages else None)
+        user_ids    = (UserIds(MongoStore(self.mongo.get_collection(
+                                   self.state_db, 'users')), user_cache_days)
+                       if user_cache_days else None)
+        self.searcher    = Searcher(username, password,
+                                    rich_comments=rich_comments,
+                                    engine=engine, max_requests=max_requests,
+                                    checkpoints=checkpoints,
+                                    user_ids=user_ids,
+                                    **searcher_options)
         self.post_db     = post_db
         self.comm_db     = comments_db
         self.update_days = update_days
-        self.mongo       = MongoFrontEnd(self.host, self.port)
+        self.batch_size  = batch_size
+        self.comm_layout = comments_layout
+        self.stream      = stream
+        self.incremental = incremental
+        self.export_compression = export_compression
+        self.export_workers     = export_workers
+        self.columnar_format    = columnar_format
+        self.detect_changes     = detect_changes
+
+    @property
+    def mongo(self):
+        """The MongoDB frontend of the current thread.
+
+        Each thread gets its own frontend, so queries can run in parallel,
+        every frontend uses the same connections.
 
+        """
+        if not hasattr(self.__local, 'mongo'):
+            self.__local.mongo = self.__mongo.share()
+        return self.__local.mongo
+
+    def __use_posts(self, query):
+        """Points the MongoDB frontend to the posts collection of a query.
+
+        Args:
+            query (str): The name of the collection.
+
+        """
+        self.mongo.change_db(self.post_db, query)
+        self.mongo.ensure_indexes(MongoFrontEnd.POST_INDEXES)
+
+    def __use_comments(self, post_id):
+        """Points the MongoDB frontend to the comments of a post.
+
+        Args:
+            post_id (str): The id of the post.
+
+        Returns:
+            dict: The criteria selecting the comments of the post.
+
+        """
+        if self.comm_layout == 'single':
+            self.mongo.change_db(self.comm_db, self.COMMENTS_COLLECTION)
+            self.mongo.ensure_indexes(MongoFrontEnd.COMMENT_STORE_INDEXES)
+            return {'post_id': post_id}
+        else:
+            self.mongo.change_db(self.comm_db, post_id)
+            self.mongo.ensure_indexes(MongoFrontEnd.COMMENT_INDEXES)
+            return {}
+
+    @metrics.timed('save_seconds')
     def __save_query(self, query, posts):
         """Saves Instagram posts from a query.
 
         Saves in MongoDB in a query collection a list of Instagram posts
-        and their comments. If a post is older than self.update_days, it
+        and their comments, inserting new ones and replacing stored ones
+        with the same id. If a post is older than self.update_days, it
         is marked as archived.
 
+        Posts marked as 'partial' carry only a page of their comments, the
+        post itself is saved after all its pages. Posts are saved after
+        their comments.
+
         Args:
             query (str): The name of the collection where to save posts.
             posts (list[dict]): A list containing posts with their comments.
 
         """
         if len(posts):
-            logging.info('Saving posts: {}'.format(len(posts)))
-
-            ago_sec = time.time() - Searcher.daytosec(self.update_days)
-            for post in posts:
+            complete = [post for post in posts if not post.get('partial')]
+            logging.info('Saving posts: {}'.format(len(complete)))
+            metrics.inc('posts_saved_total', len(complete))
+
+            if self.comm_layout == 'single':
+                self.__use_comments(None)
+                inserted, updated = self.mongo.upsert_many(
+                    self.__tag_comments(posts), keys=('post_id', 'id'),
+                    batch_size=self.batch_size)
+            else:
+                inserted = updated = 0
+                for post in posts:
+                    if len(post['comments']):
+                        self.__use_comments(post['post']['id'])
+                        n_ins, n_upd = self.mongo.upsert_many(
+                            post['comments'], batch_size=self.batch_size)
+                        inserted += n_ins
+                        updated  += n_upd
+            logging.info('Comments: {} inserted, {} updated.'.format(
+                inserted, updated))
+
+            # Posts completed without comments, e.g. whose pages were
+            # streamed before, take the date of their newest stored comment
+            watermarks = self.__comment_watermarks(
+                [post['post']['id'] for post in complete
+                 if not post['comments']
+                 and post['post']['comments']['count']])
+
+            # Posts are saved after their comments, their 'last_checked'
+            # tells all their comments are stored
+            now     = int(time.time())
+            ago_sec = now - Searcher.daytosec(self.update_days)
+            for post in complete:
                 created_time = int(post['post']['created_time'])
                 post['post']['archived'] = created_time < ago_sec
                 post['post']['not_found'] = False
-
-            post_entry = self.post_db + '-entry'
-            comm_entry = self.comm_db + '-entry'
-
-            self.mongo.change_db(post_entry, query)
-            self.mongo.save_one_by_one([post['post'] for post in posts])
-            self.mongo.join_collections(query, query,
-                                        post_entry, self.post_db )
-            for post in posts:
-                if len(post['comments']):
-                    post_id = post['post']['id']
-                    self.mongo.change_db(comm_entry, post_id)
-                    self.mongo.save_one_by_one(post['comments'])
-                    self.mongo.join_collections(post_id, post_id,
-                                                comm_entry, self.comm_db)
+                post['post']['last_checked'] = now
+                if post['comments']:
+                    post['post']['comments_since'] = max(
+                        int(comment['created_time'])
+                        for comment in post['comments'])
+                elif post['post']['id'] in watermarks:
+                    post['post']['comments_since'] = \
+                        watermarks[post['post']['id']]
+
+            self.__use_posts(query)
+            inserted, updated = self.mongo.upsert_many(
+                [post['post'] for post in complete],
+                batch_size=self.batch_size)
+            logging.info('Posts: {} inserted, {} updated.'.format(
+                inserted, updated))
 
             logging.info('Saving completed.')
 
+    def __stream_to(self, query):
+        """Returns the callback saving streamed posts of a query, if any.
+
+        Args:
+            query (str): The name of the collection where to save posts.
+
+        """
+        if self.stream:
+            return partial(self.__save_query, query)
+        else:
+            return None
+
+    def __stored_ids(self, query, post_ids):
+        """Returns the ids of posts of a query already stored.
+
+        Args:
+            query (str): The name of the collection.
+            post_ids (list[str]): Ids of posts.
+
+        """
+        self.__use_posts(query)
+        stored = set()
+        for start in range(0, len(post_ids), self.batch_size):
+            stored.update(post['id'] for post in self.mongo.find(
+                {'id': {'$in': post_ids[start:start + self.batch_size]}},
+                {'id': 1, '_id': 0}))
+        return stored
+
+    def __changed_posts(self, query, posts):
+        """Returns the posts whose counts changed since they were stored.
+
+        Compares the stored counts of comments and likes of the posts with
+        the counts of the GraphQL pages of the query. Posts with the same
+        counts get their 'last_checked' date updated, and are archived if
+        older than self.update_days, as when they are saved. Posts not
+        found in the pages are returned too.
+
+        Args:
+            query (str): The name of the collection.
+            posts (list[dict]): Stored posts with their 'id',
+                'created_time' and counts.
+
+        """
+        dates  = [int(post['created_time']) for post in posts]
+        counts = self.searcher.get_counts(query, min(dates) - 1,
+                                          max(dates) + 1)
+        now       = int(time.time())
+        ago_sec   = now - Searcher.daytosec(self.update_days)
+        changed   = []
+        unchanged = []
+        archived  = []
+        for post in posts:
+            stored = (post['comments']['count'], post['likes']['count'])
+            if counts.get(post['id']) != stored:
+                changed.append(post)
+            elif int(post['created_time']) < ago_sec:
+                archived.append(post['id'])
+            else:
+                unchanged.append(post['id'])
+        logging.info('Posts unchanged: {}, archived: {}.'.format(
+            len(unchanged) + len(archived), len(archived)))
+        metrics.inc('posts_unchanged_total', len(unchanged) + len(archived))
+        self.__use_posts(query)
+        self.mongo.updateMany({'id': {'$in': unchanged}},
+                              {'$set': {'last_checked': now}})
+        self.mongo.updateMany({'id': {'$in': archived}},
+                              {'$set': {'last_checked': now,
+                                        'archived': True,
+                                        'not_found': False}})
+        return changed
+
+    def __comment_watermarks(self, post_ids):
+        """Returns the creation date of the newest stored comment of posts.
+
+        Only posts whose download completed have all their comments older
+        than it stored, pages streamed are stored newer first.
+
+        Args:
+            post_ids (list[str]): The ids of the posts.
+
+        Returns:
+            dict: Dates in unix format by post id, for posts with comments.
+
+        """
+        if not post_ids:
+            return {}
+        if self.comm_layout == 'single':
+            self.__use_comments(None)
+            newest = self.mongo.aggregate([
+                {'$match': {'post_id': {'$in': post_ids}}},
+                {'$group': {'_id': '$post_id',
+                            'since': {'$max': {'$toLong': '$created_time'}}}}])
+            return {doc['_id']: doc['since'] for doc in newest}
+        else:
+            watermarks = {}
+            for post_id in post_ids:
+                self.__use_comments(post_id)
+                date_min, date_max = self.mongo.get_limits('created_time')
+                if date_max is not None:
+                    watermarks[post_id] = int(date_max)
+            return watermarks
+
+    @staticmethod
+    def __tag_comments(posts):
+        """Yields the comments of a list of posts tagged with their post id.
+
+        Args:
+            posts (list[dict]): A list containing posts with their comments.
+
+        """
+        for post in posts:
+            for comment in post['comments']:
+                comment['post_id'] = post['post']['id']
+                yield comment
+
     def search_query(self, query):
         """Searchs new Instagram posts of a query
 
         Checks in MongoDB previous stored posts of the query, with the oldest
         date searchs new posts. If there aren't previous stored posts,
-        defaults to search posts of the last day.
+        defaults to search posts of the last day. Posts found already
+        stored, e.g. those created at that date, are not downloaded again.
 
         Args:
             query (str): A tag or a user in Instagram.
@@ -91,14 +357,19 @@ class InstagramMonitor(object):
         """
         logging.info('Searching \'{}\' new posts.'.format(query))
 
-        self.mongo.change_db(self.post_db, query)
+        self.__use_posts(query)
         date_min, date_max = self.mongo.get_limits('created_time')
+        callback = self.__stream_to(query)
+        known    = partial(self.__stored_ids, query)
         if date_max:
-            posts = self.searcher.search(query, unix_date=date_max)
+            posts = self.searcher.search(query, unix_date=date_max,
+                                         callback=callback, known=known)
         else:
-            posts = self.searcher.search(query, prev_days=1)
+            posts = self.searcher.search(query, prev_days=1,
+                                         callback=callback, known=known)
 
-        self.__save_query(query, posts)
+        if callback is None:
+            self.__save_query(query, posts)
 
     def update_query(self, query, older_days=None):
         """Updates stored Instagram posts of a query older than n days.
@@ -106,7 +377,11 @@ class InstagramMonitor(object):
         Checks in MongoDB stored posts of the query marked as not archived and
         their created_time. If older than older_days, updates them. If a post
         can't be found, maybe because the post was deleted, it is marked as
-        archived and not found.
+        archived and not found. With self.incremental, only comments newer
+        than the 'comments_since' date of each post, saved when its comments
+        were completely downloaded, are downloaded. With
+        self.detect_changes, only posts whose counts of comments or likes
+        changed are downloaded.
 
         Args:
             query (str): The name of the collection where to update posts.
@@ -118,26 +393,45 @@ class InstagramMonitor(object):
         logging.info(('Updating \'{}\'.').format(query, older_days))
 
         ago_sec = time.time() - Searcher.daytosec(older_days)
-        self.mongo.change_db(self.post_db, query)
+        self.__use_posts(query)
         not_archived = self.mongo.find({'archived': False},
                                        {'id': 1, 'code': 1,
-                                        'created_time': 1, '_id': 0})
+                                        'created_time': 1,
+                                        'comments.count': 1,
+                                        'likes.count': 1,
+                                        'comments_since': 1, '_id': 0})
 
-        if not_archived.count():
+        if self.mongo.count({'archived': False}):
             posts_to_up = [post for post in not_archived
                                 if int(post['created_time']) < ago_sec]
             logging.info('Posts to update: {}.'.format(
                     len(posts_to_up), query))
+            if len(posts_to_up) and self.detect_changes:
+                posts_to_up = self.__changed_posts(query, posts_to_up)
+            for post in posts_to_up:
+                since = post.pop('comments_since', None)
+                if self.incremental and since is not None:
+                    post['since'] = since
+            if len(posts_to_up) and self.incremental:
+                logging.info('Posts with stored comments: {}.'.format(
+                    sum('since' in post for post in posts_to_up)))
             if len(posts_to_up):
-                uped_posts = self.searcher.download_posts(posts_to_up)
+                callback = self.__stream_to(query)
+                uped_posts = self.searcher.download_posts(posts_to_up,
+                                                          callback)
                 ids_to_up = [post['id'] for post in posts_to_up]
-                uped_ids = [post['post']['id'] for post in uped_posts]
+                if callback is None:
+                    uped_ids = [post['post']['id'] for post in uped_posts]
+                else:
+                    uped_ids = uped_posts
                 not_uped_ids = list(set(ids_to_up).difference(uped_ids))
                 logging.info(('Posts not found: {}.').format(len(not_uped_ids)))
+                self.__use_posts(query)
                 self.mongo.updateMany(
                     {'id': {'$in': not_uped_ids}},
                     {'$set': {'archived': True, 'not_found': True}})
-                self.__save_query(query, uped_posts)
+                if callback is None:
+                    self.__save_query(query, uped_posts)
 
         logging.info(('Updated  \'{}\'.').format(query, older_days))
 
@@ -156,14 +450,91 @@ class InstagramMonitor(object):
 
         self.mongo.change_db(migrate_db, query)
         posts_cursor = self.mongo.find({},
-                                       {'id': 1})
+                                       {'id': 1, 'code': 1})
         list_ids = []
-        for post in post_cursor:
-            list_ids.append({'id' : post['id']})
+        for post in posts_cursor:
+            # Without the private API, posts are downloaded by their code
+            list_ids.append({'id' : post['id'], 'code': post['code']})
         list_ids = [list_ids[i:i+500] for i in range(0, len(list_ids), 500)]
+        callback = self.__stream_to(query)
         for ids in list_ids:
-            posts = self.searcher.download_posts(ids)
-            self.__save_query(query, posts)
+            posts = self.searcher.download_posts(ids, callback)
+            if callback is None:
+                self.__save_query(query, posts)
+
+    def check_indexes(self, repair=True):
+        """Checks the indexes of every stored posts and comments collection.
+
+        Logs how many collections miss some index. If repair is True,
+        the missing indexes are created, removing before documents with
+        repeated ids.
+
+        Args:
+            repair (bool): Represents if missing indexes must be created.
+
+        """
+        logging.info('Checking indexes.')
+
+        for db, indexes in ((self.post_db, MongoFrontEnd.POST_INDEXES),
+                            (self.comm_db, MongoFrontEnd.COMMENT_INDEXES)):
+            self.mongo.change_db(db)
+            collections = self.mongo.get_collections()
+            incomplete  = 0
+            for coll in collections:
+                self.mongo.change_collection(coll)
+                if db == self.comm_db and coll == self.COMMENTS_COLLECTION:
+                    missing = self.mongo.check_indexes(
+                        MongoFrontEnd.COMMENT_STORE_INDEXES, repair)
+                else:
+                    missing = self.mongo.check_indexes(indexes, repair)
+                if len(missing):
+                    incomplete += 1
+                    logging.debug('{}.{} misses indexes: {}'.format(
+                        db, coll, [keys for keys, _ in missing]))
+            logging.info(('Database \'{}\': {} of {} collections '
+                          'missed indexes.').format(
+                db, incomplete, len(collections)))
+
+        logging.info('Checked indexes.')
+
+    def migrate_comments(self):
+        """Moves comments stored in a collection per post to one collection.
+
+        Streams the comments of every post collection in comments_db to the
+        collection of the 'single' layout, tagging them with their post id,
+        and drops the post collection once it is moved.
+
+        """
+        logging.info('Migrating comments to \'{}\'.'.format(
+            self.COMMENTS_COLLECTION))
+
+        self.mongo.change_db(self.comm_db)
+        post_ids = [coll for coll in self.mongo.get_collections()
+                    if coll != self.COMMENTS_COLLECTION]
+        total = 0
+        for i, post_id in enumerate(post_ids):
+            self.mongo.change_db(self.comm_db, post_id)
+            comments = self.mongo.find({}, {'_id': 0})
+            comments.batch_size(self.batch_size)
+            self.mongo.change_collection(self.COMMENTS_COLLECTION)
+            self.mongo.ensure_indexes(MongoFrontEnd.COMMENT_STORE_INDEXES)
+            inserted, updated = self.mongo.upsert_many(
+                ({**comment, 'post_id': post_id} for comment in comments),
+                keys=('post_id', 'id'), batch_size=self.batch_size)
+            self.mongo.drop_collection(post_id)
+            total += inserted + updated
+            if (i + 1) % 1000 == 0:
+                logging.info('Migrated {} of {} posts.'.format(
+                    i + 1, len(post_ids)))
+
+        logging.info('Migrated {} comments from {} posts.'.format(
+            total, len(post_ids)))
+
+        # Migrated comments get new '_id', mention graphs are read again
+        self.mongo.change_db(self.state_db)
+        self.mongo.drop_collection('graph_edges')
+        self.mongo.drop_collection('graph_owners')
+        self.mongo.drop_collection('graphs')
 
     def export_comments_query(self, query):
         """Saves in a file all comments from a query collection.
@@ -172,6 +543,9 @@ class InstagramMonitor(object):
         of a file has a comment or caption with the next format:
         post_id \t username \t text_id \t text
 
+        With self.export_workers, posts are split in as many parts, each one
+        saved to its own files by a worker process.
+
         Args:
             query (str): The name of the collection.
 
@@ -179,95 +553,75 @@ class InstagramMonitor(object):
         logging.info(('Saving comments from '
                       'query \'{}\' to a file.').format(query) )
 
-        pathcomm = Path(''.join(['exported_comments/', query, '/',
-                                 query, '_comments.txt']))
-        pathcapt = Path(''.join(['exported_comments/', query, '/',
-                                 query, '_captions.txt']))
-        pathcomm.parent.mkdir(parents = True, exist_ok = True)
-        pathcapt.parent.mkdir(parents = True, exist_ok = True)
-        with pathcomm.open( 'w+', encoding = 'utf8' ) as file_comm, \
-             pathcapt.open( 'w+', encoding = 'utf8' ) as file_capt:
-
-            list_ids = []
-            self.mongo.change_db(self.post_db, query)
-            posts = self.mongo.find({},
-                                    {'id': 1, 'comments': 1, 'caption': 1})
-            for post in posts:
-                if (post['caption']
-                    and post['caption']['text']
-                    and len(post['caption']['text'])):
-                    cleaned_text = post['caption']['text'].replace('\n', ' ')
-                    file_capt.write(''.join([
-                        post['id'], '\t',
-                        post['caption']['from']['username'], '\t',
-                        post['caption']['id'], '\t',
-                        cleaned_text,'\n']))
-                if post['comments']['count']:
-                    self.mongo.change_db(self.comm_db, post['id'])
-                    comments = self.mongo.find({},
-                                               {'id': 1, 'text': 1, 'from': 1})
-                    for comment in comments:
-                        list_ids.append(comment['id'])
-                        cleaned_text = comment['text'].replace('\n', ' ')
-                        file_comm.write( ''.join([
-                            post['id'], '\t',
-                            comment['from']['username'], '\t',
-                            comment['id'], '\t',
-                            cleaned_text, '\n']))
-            logging.info('Saved {:>8} comments, {} repeated ids.'.format(
-                len(list_ids), len(list_ids) - len(set(list_ids))))
-
-    def export_graph_query(self, query, op_mentioned=False):
+        options = {'post_db': self.post_db,
+                   'comments_db': self.comm_db,
+                   'layout': self.comm_layout,
+                   'comments_collection': self.COMMENTS_COLLECTION,
+                   'batch_size': self.batch_size,
+                   'compression': self.export_compression}
+        if self.export_workers > 1:
+            n_comments, n_repeated = export_parallel(
+                self.host, self.port, options, query, self.export_workers)
+        else:
+            n_comments, n_repeated = CommentsExporter(
+                self.mongo, **options).export(query)
+        logging.info('Saved {:>8} comments, {} repeated ids.'.format(
+            n_comments, n_repeated))
+
+    def export_columnar_query(self, query):
+        """Saves the posts and comments of a query to columnar files.
+
+        Posts and comments are saved to parts in 'exported_columnar/<query>/
+        posts' and 'exported_columnar/<query>/comments', with a fixed schema,
+        in self.columnar_format. Comments have the 'post_id' of their post.
+
+        Args:
+            query (str): The name of the collection.
+
+        """
+        logging.info(('Saving posts and comments from '
+                      'query \'{}\' to columnar files.').format(query))
+
+        exporter = ColumnarExporter(self.mongo, self.post_db, self.comm_db,
+                                    self.comm_layout, self.COMMENTS_COLLECTION,
+                                    self.batch_size, self.columnar_format)
+        n_posts, n_comments = exporter.export(query)
+        logging.info('Saved {:>8} posts and {:>8} comments.'.format(
+            n_posts, n_comments))
+
+    def export_graph_query(self, query, op_mentioned=False, rebuild=False):
         """Saves a graph file representing mentions in comments.
 
         Creates a graph file using all the comments from a query,
         nodes represent usernames, and edges represent mentions
-        from a user to another. If op_mentioned is True,
-        any comment will count as a mention to the user who created the post,
-        although he is not mentioned in the text.
+        from a user to another, weighted by the amount of mentions.
+        If op_mentioned is True, any comment will count as a mention
+        to the user who created the post, although he is not mentioned
+        in the text. Edges are kept in the '<post_db>-state' database,
+        and only captions and comments stored since the previous graph
+        of the query are read.
 
         Args:
             query (str): The name of the collection.
             op_mentioned (bool): Represents if any comment must count
                 as a mention to the user who created the post.
+            rebuild (bool): If the stored edges are discarded, and every
+                caption and comment is read again, e.g. after migrating
+                comments, which get new '_id'.
         """
         logging.info('Creating graph of query \'{}\'.'.format(query))
 
-        # The pattern to find Instagram user mentions,
-        # example: 'dsdf @ds54d.sds.dd klfg' -> 'ds54d.sds.dd'.
-        pattern = re.compile('(?:@)([A-Za-z0-9_]'
-                                   '(?:(?:[A-Za-z0-9_]|(?:\.(?!\.))){0,28}'
-                                      '(?:[A-Za-z0-9_]))?)')
-
-        self.mongo.change_db(self.post_db, query)
-        posts = self.mongo.find({},
-                                {'id': 1, 'user': 1, 'caption': 1,
-                                 'comments': 1, 'usertags': 1})
-        list_texts = []
-        for post in posts:
-            if (post['caption']
-                and post['caption']['text']
-                and len(post['caption']['text'])):
-                list_texts.append(
-                    {'username': post['caption']['from']['username'],
-                     'text': post['caption']['text']})
-            if post['comments']['count']:
-                self.mongo.change_db( self.comm_db, post['id'])
-                comments = self.mongo.find({},
-                                           {'id': 1, 'text': 1, 'from': 1})
-                for comment in comments:
-                    list_texts.append(
-                        {'username': comment['from']['username'],
-                         'text': comment['text'],
-                         'op': post['user']['username']})
-
-        graph = networkx.DiGraph()
-        for text in list_texts:
-            mentioned_users = pattern.findall(text['text'])
-            for user in mentioned_users:
-                graph.add_edge(text['username'], user)
-            if op_mentioned and 'op' in text:
-                graph.add_edge(text['username'], text['op'])
+        mentions = MentionGraph(
+            self.mongo, self.post_db, self.comm_db,
+            self.mongo.get_collection(self.state_db, 'graph_edges'),
+            self.mongo.get_collection(self.state_db, 'graph_owners'),
+            MongoStore(self.mongo.get_collection(self.state_db, 'graphs')),
+            self.comm_layout, self.COMMENTS_COLLECTION, self.batch_size)
+        if rebuild:
+            mentions.reset(query)
+        logging.info('Read {} new captions and comments.'.format(
+            mentions.update(query)))
+        graph = mentions.graph(query, op_mentioned)
 
         path = Path('graphs/')
         path.mkdir(parents = True, exist_ok = True)
@@ -294,44 +648,56 @@ class InstagramMonitor(object):
         pathinfo = Path(''.join(['exported_info/', query, '/',
                                  query, '_info.txt']))
         pathinfo.parent.mkdir(parents = True, exist_ok = True)
+        # Posts are grouped by quarters of an hour, every UTC offset is a
+        # multiple of them, so each one falls in a single local day, with
+        # the offset of its own date across DST changes
+        self.__use_posts(query)
+        quarters = self.mongo.aggregate([
+            {'$group': {
+                '_id': {'$floor': {'$divide': [
+                    {'$toLong': '$created_time'}, 900]}},
+                'posts': {'$sum': 1},
+                'comments': {'$sum': '$comments.count'},
+                'likes': {'$sum': '$likes.count'}}}])
+        per_day     = Counter()
+        total_posts = 0
+        total_comms = 0
+        total_likes = 0
+        for quarter in quarters:
+            per_day[date.fromtimestamp(int(quarter['_id']) * 900)] += \
+                quarter['posts']
+            total_posts += quarter['posts']
+            total_comms += quarter['comments']
+            total_likes += quarter['likes']
         with pathinfo.open( 'w+', encoding = 'utf8' ) as file_comm:
-            self.mongo.change_db(self.post_db, query)
-            posts = self.mongo.find({},
-                                    {'id': 1, 'created_time': 1,
-                                     'comments': 1, 'likes': 1})
-            total_posts = posts.count()
-            total_comms = 0
-            total_likes = 0
-            post_dates = Counter()
-            for post in posts:
-                post_dates.update(
-                    [date.fromtimestamp(int(post['created_time']))])
-                total_comms += post['comments']['count']
-                total_likes += post['likes']['count']
             result = ('{:<20} {:>10.3f}\n'*3).format(
                 'Total posts:', total_posts,
-                'Average likes:', total_likes/total_posts,
-                'Average comments:', total_comms/total_posts)
+                'Average likes:', total_likes/max(total_posts, 1),
+                'Average comments:', total_comms/max(total_posts, 1))
             file_comm.write(result)
-            x, y = zip(*sorted(post_dates.items()))
-            fig, ax = plt.subplots()
-            ax.plot_date(x, y, fmt='r-')
-            days = md.DayLocator()
-            mons = md.WeekdayLocator(byweekday=MO)
-            monsFmt = md.DateFormatter('%Y-%m-%d')
-            ax.xaxis.set_minor_locator(days)
-            ax.xaxis.set_major_locator(mons)
-            ax.xaxis.set_major_formatter(monsFmt)
-            #ax.set_xlim([date(2017, 6, 7), date(2017, 7, 4)])
-            ax.format_xdata = md.DateFormatter('%Y-%m-%d')
-
-            ax.grid(True)
-            fig.autofmt_xdate()
-            plt.suptitle(query + ' posts per day',
-                         size=20, family='serif')
-            plt.savefig(
-                ''.join(['exported_info/', query, '/',
-                         query, '_post_dates.png']),
-                bbox_inches='tight')
-            plt.close()
+            if not per_day:
+                logging.info('No posts to plot.')
+                return
+            x, y = zip(*sorted(per_day.items()))
+            with _plot_lock:
+                fig, ax = plt.subplots()
+                ax.plot(x, y, 'r-')
+                days = md.DayLocator()
+                mons = md.WeekdayLocator(byweekday=MO)
+                monsFmt = md.DateFormatter('%Y-%m-%d')
+                ax.xaxis.set_minor_locator(days)
+                ax.xaxis.set_major_locator(mons)
+                ax.xaxis.set_major_formatter(monsFmt)
+                #ax.set_xlim([date(2017, 6, 7), date(2017, 7, 4)])
+                ax.format_xdata = md.DateFormatter('%Y-%m-%d')
+
+                ax.grid(True)
+                fig.autofmt_xdate()
+                plt.suptitle(query + ' posts per day',
+                             size=20, family='serif')
+                plt.savefig(
+                    ''.join(['exported_info/', query, '/',
+                             query, '_post_dates.png']),
+                    bbox_inches='tight')
+                plt.close()
             logging.info('Saved general information.')
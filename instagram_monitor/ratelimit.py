@@ -0,0 +1,123 @@
+from   instagram_monitor import metrics
+from   threading         import Lock
+import logging
+import time
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate, burst):
+        """A thread safe token bucket with a cooldown.
+
+        Tokens are refilled at rate tokens per second up to burst tokens,
+        each request takes one. During a cooldown no tokens are refilled,
+        so every request waits until the cooldown ends.
+
+        Args:
+            rate (float): Tokens refilled per second, 0 means no limit.
+            burst (int): Maximum amount of tokens.
+
+        """
+        self.rate  = rate
+        self.burst = burst
+        self.__tokens  = burst
+        self.__updated = time.monotonic()
+        self.__cooldown_until = 0
+        self.__lock = Lock()
+
+    def reserve(self):
+        """Takes a token, returns the seconds to wait before using it."""
+        with self.__lock:
+            now  = time.monotonic()
+            wait = max(self.__cooldown_until - now, 0)
+            if self.rate > 0:
+                if now > self.__updated:
+                    self.__tokens = min(self.burst, self.__tokens
+                        + (now - self.__updated)*self.rate)
+                    self.__updated = now
+                # Tokens may be negative, they are owed by waiting requests
+                self.__tokens -= 1
+                if self.__tokens < 0:
+                    wait = max(wait, self.__updated - now
+                                     - self.__tokens/self.rate)
+            return wait
+
+    def acquire(self):
+        """Blocks until a token can be used, returns the seconds waited."""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def cooldown(self, sec):
+        """Stops refilling tokens for an amount of seconds.
+
+        Args:
+            sec (float): The amount of seconds of the cooldown.
+
+        Returns:
+            bool: False if a longer cooldown was already running.
+
+        """
+        with self.__lock:
+            until = time.monotonic() + sec
+            if until <= self.__cooldown_until:
+                return False
+            self.__cooldown_until = until
+            self.__tokens  = min(self.__tokens, 0)
+            self.__updated = until
+            return True
+
+
+class RateLimiter(object):
+
+    # Requests per second and burst of each family of endpoints
+    DEFAULT_LIMITS = {'graphql': (5, 10),
+                      'web': (5, 10),
+                      'private': (2, 5)}
+
+    def __init__(self, limits=None):
+        """A token bucket for each family of Instagram endpoints.
+
+        Families are 'graphql' for GraphQL queries, 'web' for the web API
+        (addresses ending in ?__a=1), and 'private' for the private API.
+
+        Args:
+            limits (dict): Tuples (rate, burst) by family, overriding
+                DEFAULT_LIMITS.
+
+        """
+        limits = dict(self.DEFAULT_LIMITS, **(limits or {}))
+        self.buckets = {family: TokenBucket(rate, burst)
+                        for family, (rate, burst) in limits.items()}
+
+    @staticmethod
+    def family(url):
+        """Returns the family of endpoints of a web address."""
+        return 'graphql' if '/graphql/' in url else 'web'
+
+    def acquire(self, family):
+        """Blocks until a request of a family of endpoints can be made."""
+        wait = self.reserve(family)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def reserve(self, family):
+        """Returns the seconds to wait before a request of a family."""
+        wait = self.buckets[family].reserve()
+        metrics.observe('ratelimit_wait_seconds', wait, family=family)
+        return wait
+
+    def cooldown(self, family, sec):
+        """Makes every request of a family of endpoints wait.
+
+        Args:
+            family (str): The family of endpoints that was rate limited.
+            sec (float): The amount of seconds to wait.
+
+        """
+        metrics.inc('rate_limited_total', family=family)
+        if self.buckets[family].cooldown(sec):
+            logging.info('Rate limited on {}, waiting {} seconds.'.format(
+                family, sec))
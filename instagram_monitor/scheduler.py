@@ -0,0 +1,128 @@
+from   instagram_monitor.executor import QueryExecutor
+from   threading                  import Event
+import logging
+import random
+import signal
+import time
+
+
+def parse_queries(lines):
+    """Parses queries and their intervals from the lines of a queries file.
+
+    Each line has a query, optionally followed by the hours between runs of
+    every task of the query, and by the hours of single tasks, e.g.
+    'coffee 6 update=12'. Empty lines are skipped.
+
+    Args:
+        lines (list[str]): Lines of the queries file.
+
+    Returns:
+        tuple: The list of queries and a dict with the hours of each
+            (query, task name) or (query, None) given in the file.
+
+    """
+    queries   = []
+    intervals = {}
+    for line in lines:
+        fields = line.split()
+        if not fields:
+            continue
+        query = fields[0]
+        queries.append(query)
+        for field in fields[1:]:
+            name, _, hours = field.rpartition('=')
+            intervals[(query, name or None)] = float(hours)
+    return queries, intervals
+
+
+class Scheduler(object):
+
+    def __init__(self, tasks, queries, intervals=None, default_hours=2,
+                       jitter=0.1, max_queries=1):
+        """Runs tasks of queries periodically, sleeping between them.
+
+        Each pair of query and task has its own interval, the next run is
+        scheduled when the previous one ends. Tasks of a query that are due
+        at the same time run in order, e.g. search before update.
+
+        Args:
+            tasks (list[tuple]): Pairs of a task name and a function
+                receiving a query, in the order they must run.
+            queries (list[str]): Tags or users in Instagram.
+            intervals (dict): Hours between runs of a (query, task name),
+                of every task of a (query, None), or of a (None, task name).
+            default_hours (float): Hours between runs of the rest.
+            jitter (float): Fraction of the interval randomly added or
+                removed, so queries drift apart instead of running together.
+            max_queries (int): Amount of queries running at the same time.
+
+        """
+        self.tasks         = tasks
+        self.queries       = queries
+        self.intervals     = intervals or {}
+        self.default_hours = default_hours
+        self.jitter        = jitter
+        self.stop          = Event()
+        self.executor      = QueryExecutor([], max_queries, self.stop)
+        self.next_run      = {(query, name): 0
+                              for query in queries for name, _ in tasks}
+
+    def hours(self, query, name):
+        """Hours between runs of a task of a query."""
+        for key in ((query, name), (query, None), (None, name)):
+            if key in self.intervals:
+                return self.intervals[key]
+        return self.default_hours
+
+    def schedule(self, query, name):
+        """Schedules the next run of a task of a query, from now."""
+        seconds = self.hours(query, name) * 60 * 60
+        seconds *= 1 + random.uniform(-self.jitter, self.jitter)
+        self.next_run[(query, name)] = time.time() + seconds
+
+    def run_pending(self):
+        """Runs the tasks that are due, and schedules their next runs.
+
+        Tasks skipped after a task of their query failed are scheduled too,
+        they run again with the failed one after their interval.
+
+        """
+        now  = time.time()
+        jobs = []
+        for query in self.queries:
+            due = [(name, task) for name, task in self.tasks
+                   if self.next_run[(query, name)] <= now]
+            if due:
+                jobs.append((query, due))
+        if not jobs:
+            return
+        self.executor.run_jobs([(query, [task for _, task in due])
+                                for query, due in jobs])
+        for query, due in jobs:
+            for name, _ in due:
+                self.schedule(query, name)
+
+    def run(self):
+        """Runs tasks until SIGTERM or SIGINT is received.
+
+        The tasks running when the signal is received end, the rest are
+        skipped and run again in the next start.
+
+        """
+        def handle(signum, frame):
+            logging.info('Stopping after the running tasks.')
+            self.stop.set()
+
+        handlers = {signum: signal.signal(signum, handle)
+                    for signum in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            while not self.stop.is_set():
+                self.run_pending()
+                wait = max(min(self.next_run.values()) - time.time(), 0)
+                if wait > 0 and not self.stop.is_set():
+                    logging.info('Waiting {:.0f} minutes.'.format(wait / 60))
+                self.stop.wait(wait)
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+        logging.info('Scheduler stopped.')
@@ -1,3 +1,9 @@
+from   instagram_monitor                  import metrics
+from   instagram_monitor.async_downloader import AsyncDownloader
+from   instagram_monitor.clientpool import ClientPool
+from   instagram_monitor.concurrency import AdaptiveLimit
+from   instagram_monitor.ratelimit import RateLimiter
+from   instagram_monitor.session import PooledSession
 from   threading  import Thread
 from   queue      import Queue
 import instagram_private_api as api
@@ -12,7 +18,12 @@ import urllib
 class InstagramSearcher(object):
 
     def __init__(self, username=None, password=None, rich_comments=False,
-                       wait_time=30, n_threads=5):
+                       wait_time=30, n_threads=5, engine='threads',
+                       max_requests=200, base_url='https://www.instagram.com',
+                       retries=3, timeout=30, rate_limits=None,
+                       adaptive=False, min_threads=1, max_threads=20,
+                       queue_size=100, checkpoints=None, user_ids=None,
+                       pool_size=None, clients=None):
         """
 
         Args:
@@ -21,20 +32,84 @@ class InstagramSearcher(object):
             wait_time (int): Amount of seconds the client will wait when
                 errors from too many requests happen.
             n_threads (int): Amount of threads to speed up downloading.
+                With adaptive, the amount of threads working at start.
+            engine (str): How posts are downloaded, 'threads' uses a pool
+                of n_threads threads, 'asyncio' uses an event loop.
+            max_requests (int): Amount of requests in flight at the same
+                time with the 'asyncio' engine.
+            base_url (str): Address of the Instagram web site.
+            retries (int): Amount of times a web request is retried after
+                a connection error or a server error.
+            timeout (float): Seconds to wait for a web request to answer.
+            rate_limits (dict): Tuples (requests per second, burst) by
+                family of endpoints, 'graphql', 'web' or 'private'.
+            adaptive (bool): If the amount of threads working grows and
+                shrinks following latency and rate limit errors.
+            min_threads (int): The least threads working, with adaptive.
+            max_threads (int): The most threads working, with adaptive.
+            queue_size (int): Amount of downloaded posts waiting to be
+                written, when posts are streamed to a callback.
+            checkpoints (Checkpoints): If given, where the pagination of
+                searches is saved, to resume it after a restart.
+            user_ids (UserIds): If given, a cache of the ids of users.
+            pool_size (int): Amount of connections kept alive, by default
+                the most threads downloading, e.g. more if several searches
+                use the searcher at the same time.
+            clients (ClientPool): If given, the private API clients of
+                several accounts used instead of logging in username.
 
         """
-        if username and password:
+        if clients is not None:
+            self.priv_client = clients
+        elif username and password:
             self.priv_client = api.Client(
                 username, password, auto_patch=True, drop_incompat_keys=True)
         else:
             self.priv_client = None
         self.wait_time  = wait_time
         self.n_threads  = n_threads
+        self.adaptive   = adaptive
+        self.min_threads = min_threads
+        self.max_threads = max_threads
+        self.queue_size = queue_size
+        self.checkpoints = checkpoints
+        self.user_ids   = user_ids
         self.rich_comments = rich_comments
+        self.engine     = engine
+        self.max_requests = max_requests
+        self.base_url   = base_url.rstrip('/')
+        self.retries    = retries
+        self.timeout    = timeout
+        # Every request of every thread waits for the same rate limiter
+        self.limiter    = RateLimiter(rate_limits)
+        # One pool of keep-alive connections shared by every thread
+        if pool_size is None:
+            pool_size = max_threads if adaptive else n_threads
+        self.session    = PooledSession(pool_size=max(pool_size, 1),
+                                        retries=retries, timeout=timeout,
+                                        limiter=self.limiter,
+                                        cooldown=wait_time)
+        # Requests of the 'asyncio' engine, made with their own sessions
+        self.__async_requests    = 0
+        self.__async_connections = 0
 
     @staticmethod
     def daytosec(days): return days*24*60*60
 
+    def connection_stats(self):
+        """Returns how many web requests reused an open connection.
+
+        Returns:
+            dict: Amount of 'requests' made, of 'connections' opened, and
+                of 'reused' connections, by both engines.
+
+        """
+        stats = self.session.connection_stats()
+        stats['requests']    += self.__async_requests
+        stats['connections'] += self.__async_connections
+        stats['reused']       = stats['requests'] - stats['connections']
+        return stats
+
     def __wait(self, sec=None):
         """Waits an amount of seconds.
 
@@ -44,10 +119,34 @@ class InstagramSearcher(object):
         """
         if not sec: sec = self.wait_time
         logging.info('Waiting {} seconds.'.format(sec))
+        metrics.observe('wait_seconds', sec)
         time.sleep(sec)
         logging.info('Waiting ended.')
 
-    def search(self, query: str, unix_date=None, prev_days=0, len_days=None):
+    def private(self, method: str, *args, **kwargs):
+        """Calls a method of the private API client.
+
+        The call waits for the rate limiter, and if Instagram answers
+        with too many requests, every private API call waits. A pool of
+        clients limits and cools down each account instead.
+
+        Args:
+            method (str): The name of the method of the client.
+
+        """
+        pooled = isinstance(self.priv_client, ClientPool)
+        if not pooled:
+            self.limiter.acquire('private')
+        try:
+            with metrics.timer('private_seconds', method=method):
+                return getattr(self.priv_client, method)(*args, **kwargs)
+        except api.ClientError as e:
+            if int(e.code) in (0, 429) and not pooled:
+                self.limiter.cooldown('private', self.wait_time)
+            raise
+
+    def search(self, query: str, unix_date=None, prev_days=0, len_days=None,
+               callback=None, known=None):
         """Searchs Instagram posts of a query from a range of time.
 
         Retrieves Instagram posts with their comments, from a query,
@@ -62,6 +161,11 @@ class InstagramSearcher(object):
                 before the unix_date. It defaults to zero.
             len_days (int): The length in days of the period of search.
                 It defaults to the amount of days until the present date.
+            callback (callable): If given, downloaded posts are streamed to
+                it, see download_posts.
+            known (callable): If given, receives the list of ids found and
+                returns the set of those already stored, which are not
+                downloaded again.
 
         """
         if not unix_date:
@@ -79,33 +183,78 @@ class InstagramSearcher(object):
         posts = self.get_id_list(query, min_date, max_date)
         #posts = self.get_id_list2(query, min_date, max_date)
         logging.info('Posts found: {}'.format(len(posts)))
-        return self.download_posts(posts)
+        if known is not None:
+            stored = known([post['id'] for post in posts])
+            new    = [post for post in posts if post['id'] not in stored]
+            logging.info('Posts already stored, skipped: {}'.format(
+                len(posts) - len(new)))
+            metrics.inc('posts_skipped_total', len(posts) - len(new))
+            posts  = new
+        return self.download_posts(posts, callback)
+
+    def get_counts(self, query: str, min_date, max_date):
+        """Returns the comment and like counts of posts of a query.
+
+        Counts are taken from the GraphQL pages of the posts of the query,
+        so many posts are checked with each request.
+
+        Args:
+            query (str): A tag or a user in Instagram.
+            min_date (int): The lower limit date in unix format.
+            max_date (int): The upper limit date in unix format.
+
+        Returns:
+            dict: Tuples of the comment and like counts, by post id, None
+                where a page has no count.
+
+        """
+        return {post['id']: (post['comments'], post['likes'])
+                for post in self.get_id_list(query, min_date, max_date,
+                                             use_checkpoint=False)}
 
-    def get_id_list(self, query: str, min_date, max_date):
+    @staticmethod
+    def __feed_post(node):
+        """Returns the id, code and counts of a post of a GraphQL page."""
+        likes = (node.get('edge_media_preview_like')
+                 or node.get('edge_liked_by') or {})
+        return {'id': node['id'],
+                'code': node['shortcode'],
+                'comments': node.get('edge_media_to_comment', {}).get('count'),
+                'likes': likes.get('count')}
+
+    @metrics.timed('endpoint_seconds', endpoint='get_id_list')
+    def get_id_list(self, query: str, min_date, max_date,
+                    use_checkpoint=True):
         """Searchs Instagram posts' ids from a query between two dates.
 
         Searchs Instagram posts using Instagram's GraphQL. The posts are
         from a user, or contain a tag, returns the posts' ids from between
-        min_date and max_date.
+        min_date and max_date. With self.checkpoints, the pagination is
+        saved every some pages, and a search of the same query interrupted
+        before is resumed, within the period of time of that search.
 
         Args:
             query (str): A tag or a user in Instagram.
             min_date (int): The lower limit date in unix format.
             max_date (int): The upper limit date in unix format.
+            use_checkpoint (bool): If self.checkpoints are used, False for
+                walks that are not searches, so they do not resume or
+                discard the checkpoint of a search.
+
+        Returns:
+            list[dict]: The posts found, with their 'id', 'code', and the
+                counts of 'comments' and 'likes' of the pages.
 
         """
+        name_query = query
+        url        = None
         if query[0] == '#':
             type_query = 'tag'
             query      = query[1:]
             query_id   = '17882293912014529&tag_name='
         else:
             type_query = 'user'
-            user_info  = requests.get(''.join(['https://www.instagram.com/',
-                query, '/?__a=1'])).json()
-            query      = user_info['user']['id']
             query_id   = '17880160963012870&id='
-        url = ''.join(['https://www.instagram.com/graphql/query/?query_id=',
-            query_id, query, '&first=500'])
 
         json_media     = None
         end_cursor     = None
@@ -113,19 +262,45 @@ class InstagramSearcher(object):
         has_next_page  = None
         last_date      = None
         list_ids       = []
+        pages          = 0
+
+        checkpoints = self.checkpoints if use_checkpoint else None
+        checkpoint  = (checkpoints.load(name_query, min_date)
+                       if checkpoints else None)
+        if checkpoint:
+            end_cursor = checkpoint['end_cursor']
+            list_ids   = checkpoint['list_ids']
+            pages      = checkpoint['pages']
+            min_date   = checkpoint['min_date']
+            max_date   = checkpoint['max_date']
+            logging.info('Resuming search from page {}, {} posts found.'
+                         .format(pages, len(list_ids)))
 
         while True:
             try:
+                if url is None:
+                    # The id of a user is resolved here to retry failures
+                    if type_query == 'user':
+                        query = self.get_user_id(name_query)
+                    url = ''.join([self.base_url, '/graphql/query/?query_id=',
+                        query_id, query, '&first=500'])
                 if type_query == 'user':
                     while (not json_media
                            or (has_next_page
                                and len(edges)
                                and min_date < last_date)):
                         post_url = '&after=' + end_cursor if end_cursor else ''
-                        json_media = requests.get(url + post_url).json()
+                        json_media = self.session.get(url + post_url).json()
                         if json_media['status'] != 'ok' :
                             raise api.errors.ClientError(
                                 'GraphQL request failed.')
+                        if json_media['data']['user'] is None:
+                            # The id may be cached from a renamed user,
+                            # the next search resolves it again
+                            if self.user_ids:
+                                self.user_ids.invalidate(name_query)
+                            raise LookupError(
+                                'User {} not found.'.format(name_query))
                         has_next_page = (json_media['data']['user']
                             ['edge_owner_to_timeline_media']
                             ['page_info']['has_next_page'])
@@ -138,19 +313,22 @@ class InstagramSearcher(object):
                             post_date = int(edge['node']['taken_at_timestamp'])
                             if min_date < post_date < max_date:
                                 list_ids.append(
-                                    {'id': edge['node']['id'],
-                                     'code': edge['node']['shortcode']})
+                                    self.__feed_post(edge['node']))
                         if len(edges):
                             last_date = int(json_media['data']['user']
                                 ['edge_owner_to_timeline_media']
                                 ['edges'][-1]['node']['taken_at_timestamp'])
+                        pages += 1
+                        if checkpoints:
+                            self.__checkpoint(name_query, pages, min_date,
+                                              max_date, end_cursor, list_ids)
                 elif type_query == 'tag':
                     while (not json_media
                            or (has_next_page
                                and len(edges)
                                and min_date <= last_date)):
                         post_url = '&after=' + end_cursor if end_cursor else ''
-                        json_media = requests.get(url + post_url).json()
+                        json_media = self.session.get(url + post_url).json()
                         if json_media['status'] != 'ok' :
                             raise api.errors.ClientError(
                                 'GraphQL request failed.')
@@ -166,25 +344,84 @@ class InstagramSearcher(object):
                             post_date = int(edge['node']['taken_at_timestamp'])
                             if min_date <= post_date <= max_date:
                                 list_ids.append(
-                                    {'id': edge['node']['id'],
-                                     'code': edge['node']['shortcode']})
+                                    self.__feed_post(edge['node']))
                         if len(edges):
                             last_date = int(json_media['data']['hashtag']
                                 ['edge_hashtag_to_media']
                                 ['edges'][-1]['node']['taken_at_timestamp'])
+                        pages += 1
+                        if checkpoints:
+                            self.__checkpoint(name_query, pages, min_date,
+                                              max_date, end_cursor, list_ids)
             except (socket.timeout,
                     urllib.error.URLError,
                     requests.exceptions.ChunkedEncodingError,
                     requests.exceptions.SSLError,
                     requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout,
                     json.decoder.JSONDecodeError,
                     api.errors.ClientError) as e:
+                # Only too many requests and server errors are retried
+                if (isinstance(e, api.errors.ClientError) and e.code
+                        and int(e.code) < 500 and int(e.code) != 429):
+                    raise
                 logging.error(str(e))
                 json_media = None
                 self.__wait()
             else:            #: If it finishes without any error, returns list.
+                if checkpoints:
+                    checkpoints.delete(name_query)
                 return list_ids
 
+    def __checkpoint(self, query, pages, min_date, max_date,
+                     end_cursor, list_ids):
+        """Saves the pagination of a search, if checkpoints are enabled.
+
+        Args:
+            query (str): A tag or a user in Instagram.
+            pages (int): The amount of pages walked.
+            min_date (int): The lower limit date in unix format.
+            max_date (int): The upper limit date in unix format.
+            end_cursor (str): The cursor of the last page walked.
+            list_ids (list[dict]): The posts found until now.
+
+        """
+        if self.checkpoints:
+            self.checkpoints.save(query, pages, min_date=min_date,
+                                  max_date=max_date, end_cursor=end_cursor,
+                                  list_ids=list_ids)
+
+    def get_user_id(self, username: str):
+        """Retrieves the numeric id of an Instagram user.
+
+        With self.user_ids, ids are cached and only resolved on a miss.
+        A user not found, e.g. deleted or renamed, raises LookupError, and
+        other failed lookups raise ClientError with the status code.
+
+        Args:
+            username (str): An Instagram username.
+
+        """
+        if self.user_ids:
+            user_id = self.user_ids.get(username)
+            logging.info('User ids cache: {} hits, {} misses.'.format(
+                self.user_ids.hits, self.user_ids.misses))
+            if user_id is not None:
+                return user_id
+        user_info = self.session.get(''.join([self.base_url, '/',
+            username, '/?__a=1']))
+        if user_info.status_code == 404:
+            if self.user_ids:
+                self.user_ids.invalidate(username)
+            raise LookupError('User {} not found.'.format(username))
+        if not user_info.ok:
+            raise api.errors.ClientError('Web API request failed',
+                                         user_info.status_code)
+        user_id   = user_info.json()['user']['id']
+        if self.user_ids:
+            self.user_ids.put(username, user_id)
+        return user_id
+
     def get_id_list2( self, query: str, min_date, max_date ):
         """Searchs Instagram posts' ids from a query between two dates.
 
@@ -200,10 +437,10 @@ class InstagramSearcher(object):
             query      = query[1:]
             type_query = 'tag'
             url = ''.join(
-            ['https://www.instagram.com/explore/tags/', query, '/?__a=1'])
+            [self.base_url, '/explore/tags/', query, '/?__a=1'])
         else:
             type_query = 'user'
-            url = ''.join(['https://www.instagram.com/', query, '/media/'])
+            url = ''.join([self.base_url, '/', query, '/media/'])
 
         json_media    = None
         last_id       = None
@@ -217,7 +454,7 @@ class InstagramSearcher(object):
                     while (not json_media
                            or (has_next_page and min_date < last_date)):
                         post_url = '?max_id=' + last_id if last_id else ''
-                        json_media = requests.get(url + post_url).json()
+                        json_media = self.session.get(url + post_url).json()
                         has_next_page = json_media['more_available']
                         last_date = int(
                             json_media['items'][-1]['created_time'])
@@ -231,7 +468,7 @@ class InstagramSearcher(object):
                     while (not json_media
                            or (has_next_page and min_date <= last_date)):
                         post_url = '?max_id=' + last_id if last_id else ''
-                        json_media = requests.get(url + post_url).json()
+                        json_media = self.session.get(url + post_url).json()
                         has_next_page = (json_media['tag']['media']
                             ['page_info']['has_next_page'])
                         last_date = int(json_media['tag']['media']
@@ -247,51 +484,135 @@ class InstagramSearcher(object):
                    requests.exceptions.ChunkedEncodingError,
                    requests.exceptions.SSLError,
                    requests.exceptions.ConnectionError,
+                   requests.exceptions.Timeout,
                    json.decoder.JSONDecodeError) as e:
                 logging.error(str(e))
                 self.__wait(5)
             else:            #: If it finishes without any error, returns list.
                 return list_ids
 
-    def download_posts(self, list_ids: list):
+    def download_posts(self, list_ids: list, callback=None):
         """Retrieves Instagram posts with their comments from a id list.
 
+        If callback is given, downloaded posts are not returned, they are
+        put in a queue of self.queue_size posts, and a writer thread calls
+        callback with the posts queued, while downloads continue. Workers
+        wait while the queue is full.
+
         Args:
             list_ids (list[dict]): A list whose elements are dicts with
                 the key 'id' or 'code' from an Instagram's post.
+            callback (callable): A function receiving lists of posts.
+
+        Returns:
+            list: The downloaded posts as dicts with the keys 'post' and
+                'comments', or if callback is given, their ids.
 
         """
-        if len(list_ids):
+        if len(list_ids) and self.engine == 'asyncio':
+            logging.info('Downloading: {}'.format(len(list_ids)))
+
+            downloader = AsyncDownloader(self, self.max_requests)
+            try:
+                return downloader.download_posts(list_ids, callback)
+            finally:
+                stats = downloader.connection_stats()
+                self.__async_requests    += stats['requests']
+                self.__async_connections += stats['connections']
+                logging.info(('Connections: {connections} opened for '
+                              '{requests} requests.').format(**stats))
+        elif len(list_ids):
             logging.info('Downloading: {}'.format(len(list_ids)))
 
             list_posts   = []
             queue_ids    = Queue()
             list_threads = []
+            if callback is None:
+                output = list_posts.append
+            else:
+                queue_posts = Queue(self.queue_size)
+                output      = queue_posts.put
+                errors      = []
+                writer      = Thread(target=self.__post_writer,
+                                     args=(queue_posts, callback,
+                                           list_posts, errors))
+                writer.start()
+            if self.adaptive:
+                # Threads wait their turn while the limit is below max_threads
+                n_threads = self.max_threads
+                limit     = AdaptiveLimit(self.n_threads, self.min_threads,
+                                          self.max_threads)
+            else:
+                n_threads = self.n_threads
+                limit     = None
             # Creates threads and a queue to process quicker the pool of posts
             for enum_id in enumerate(list_ids):
                 queue_ids.put(enum_id)
-            for i in range(self.n_threads):
+            for i in range(n_threads):
                 thread = Thread(target=self.__post_worker,
-                                args=(queue_ids,list_posts))
+                                args=(queue_ids, output, limit,
+                                      callback is not None))
                 thread.start()
                 list_threads.append(thread)
 
             queue_ids.join()
-            for i in range(self.n_threads):
+            for i in range(n_threads):
                 queue_ids.put(None)
             for thread in list_threads:
                 thread.join(60)
-
+            if callback is not None:
+                queue_posts.put(None)
+                writer.join()
+                if len(errors):
+                    raise errors[0]
+
+            logging.info(('Connections: {connections} opened for '
+                          '{requests} requests.').format(
+                **self.connection_stats()))
             return list_posts
         else:
             return []
 
-    def __post_worker(self, queue_ids, list_posts):
+    def __post_writer(self, queue_posts, callback, list_ids, errors):
+        """The writer function for a thread streaming downloaded posts.
+
+        Calls callback with every post waiting in the queue, until a None
+        is queued. If callback fails, next posts are discarded to not block
+        the downloads, and the error is appended to errors.
+
+        Args:
+            queue_posts (Queue): Queue containing downloaded posts.
+            callback (callable): A function receiving lists of posts.
+            list_ids (list): The list where to save the written post ids.
+            errors (list): The list where to save an error of callback.
+
+        """
+        finished = False
+        while not finished:
+            batch = [queue_posts.get()]
+            while not queue_posts.empty():
+                batch.append(queue_posts.get())
+            if batch[-1] is None:
+                finished = True
+                batch.pop()
+            if len(batch) and not len(errors):
+                try:
+                    callback(batch)
+                    list_ids.extend(post['post']['id'] for post in batch
+                                    if not post.get('partial'))
+                except Exception as e:
+                    logging.error('Writing posts failed: {}'.format(e))
+                    errors.append(e)
+
+    def __post_worker(self, queue_ids, output, limit=None, stream=False):
         """The downloader function for a thread.
 
         Args:
             queue_ids (Queue): Queue containing post ids enumerated.
-            list_posts (list): The list where to save the downloaded posts.
+            output (callable): The function receiving downloaded posts.
+            limit (AdaptiveLimit): If given, limits the threads working.
+            stream (bool): If pages of comments from GraphQL are output
+                as they are downloaded, see __stream_comments.
 
         """
         while True:
@@ -299,31 +620,50 @@ class InstagramSearcher(object):
             #If a task is None, the thread finishes
             if enum_id is None:
                 break
+            if limit is not None:
+                limit.acquire()
+            latency   = None
+            congested = False
             try:
+                start = time.monotonic()
                 if 'id' in enum_id[1] and self.priv_client:
                     post = self.get_post(enum_id[1]['id'])
                 elif 'code' in enum_id[1]:
                     post = self.get_post2(enum_id[1]['code'])
-
-                if post['comments']['count']:
-                    if self.rich_comments and self.priv_client:
-                        comments = self.get_comments2(post['id'])                        
-                    else:
-                        comments = self.get_comments(post['code'])
+                latency = time.monotonic() - start
+
+                since = enum_id[1].get('since')
+                if not post['comments']['count']:
+                    comments   = []
+                    n_comments = 0
+                elif self.rich_comments and self.priv_client and stream:
+                    comments, n_comments = self.__stream_comments(
+                        post, self.__resumed_pages(post['id'], since,
+                                                   enum_id[1]),
+                        output, 'get_comments2')
+                elif self.rich_comments and self.priv_client:
+                    comments   = self.get_comments2(post['id'], since=since)
+                    n_comments = len(comments)
+                elif stream:
+                    comments, n_comments = self.__stream_comments(
+                        post, self.iter_comments(post['code'], since),
+                        output, 'get_comments')
                 else:
-                    comments = []
+                    comments   = self.get_comments(post['code'], since)
+                    n_comments = len(comments)
 
-                list_posts.append({'post': post, 'comments': comments})
+                output({'post': post, 'comments': comments})
                 logging.info('Post {:>5}: {:>5} from {:>5} comments.'.format(
-                    enum_id[0]+1, post['comments']['count'], len(comments)))
+                    enum_id[0]+1, post['comments']['count'], n_comments))
 
             except api.ClientError as e:
                 logging.error('Post {:>5}: {} {}.'.format(
                     enum_id[0]+1, str(e.code), str(e)))
-                # If error code is 0 or 429, our IP has made too much requests
+                # If error code is 0 or 429, our IP has made too much requests,
+                # the rate limiter makes every thread wait
                 if int(e.code) in (0, 429):
+                    congested = True
                     queue_ids.put(enum_id)
-                    self.__wait()
                 # If error code is 400, 404, maybe the post was deleted
                 elif int(e.code) in (400, 404):
                     pass
@@ -335,12 +675,61 @@ class InstagramSearcher(object):
                     requests.exceptions.ChunkedEncodingError,
                     requests.exceptions.SSLError,
                     requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout,
                     json.decoder.JSONDecodeError) as e:
                 logging.error(str(e))
+                congested = True
                 queue_ids.put(enum_id)
                 self.__wait(5)
+            if limit is not None:
+                limit.release(latency, congested)
             queue_ids.task_done()
 
+    def __stream_comments(self, post, pages, output, endpoint):
+        """Outputs the pages of comments of a post as they are downloaded.
+
+        Every page is output with the post marked as 'partial', so only its
+        comments are saved. The post is output by the caller when all its
+        comments are, with no more comments.
+
+        Args:
+            post (dict): A downloaded post.
+            pages (iterator): The pages of comments of the post.
+            output (callable): The function receiving downloaded posts.
+            endpoint (str): The name the download is timed with.
+
+        Returns:
+            tuple: An empty list of comments, and the amount of comments
+                of all pages.
+
+        """
+        n_comments = 0
+        with metrics.timer('endpoint_seconds', endpoint=endpoint):
+            for page in pages:
+                if len(page):
+                    output({'post': post, 'comments': page, 'partial': True})
+                n_comments += len(page)
+        return [], n_comments
+
+    def __resumed_pages(self, id, since, state):
+        """Yields the pages of iter_comments2, keeping the cursor in state.
+
+        The cursor of the next page is saved after a page is consumed, so
+        a download of the post retried with the same state resumes there.
+
+        Args:
+            id (int, str): An Instagram post id.
+            since (int): If given, only comments created after this date
+                in unix format are retrieved.
+            state (dict): The dict identifying the post in the queue.
+
+        """
+        for page, cursor in self.iter_comments2(id, since,
+                                                state.get('cursor')):
+            yield page
+            state['cursor'] = cursor
+
+    @metrics.timed('endpoint_seconds', endpoint='get_post')
     def get_post(self, id):
         """Retrieves the Instagram post from an id.
 
@@ -350,11 +739,12 @@ class InstagramSearcher(object):
             id (int, str): An Instagram post id, it can be called 'pk'.
 
         """
-        post         = self.priv_client.media_info(id)['items'][0]
+        post         = self.private('media_info', id)['items'][0]
         post['id']   = post.pop('id').split('_')[0]
         post['code'] = post['link'].split('/')[-2]
         return post
 
+    @metrics.timed('endpoint_seconds', endpoint='get_post2')
     def get_post2(self, code: str):
         """Retrieves the Instagram post from a code.
 
@@ -364,14 +754,47 @@ class InstagramSearcher(object):
             code (str): An Instagram post shortcode.
 
         """
-        post = requests.get(''.join(
-            ['https://www.instagram.com/p/', code, '/?__a=1']))
+        post = self.session.get(self.post_url(code))
         if not post.ok:
             raise api.errors.ClientError('Web API request failed',
                                          post.status_code)
         else:
             post = post.json()['graphql']['shortcode_media']
 
+        return self.patch_post(post, code)
+
+    def post_url(self, code: str):
+        """Returns the web API address of an Instagram post.
+
+        Args:
+            code (str): An Instagram post shortcode.
+
+        """
+        return ''.join([self.base_url, '/p/', code, '/?__a=1'])
+
+    def comments_url(self, code: str, end_cursor=None):
+        """Returns the GraphQL address of a page of comments of a post.
+
+        Args:
+            code (str): An Instagram post shortcode.
+            end_cursor (str): The cursor of the previous page, if any.
+
+        """
+        post_url = '&after=' + end_cursor if end_cursor else ''
+        return ''.join([self.base_url, '/graphql/query/',
+                        '?query_id=17852405266163336&shortcode=',
+                        code, '&first=1000', post_url])
+
+    def patch_post(self, post, code: str):
+        """Patches the keys of a post from the web API.
+
+        The post gets the same keys as a post from the private API.
+
+        Args:
+            post (dict): A 'shortcode_media' object from the web API.
+            code (str): An Instagram post shortcode.
+
+        """
         # Patch dict keys
         post['user'] = post.pop('owner')
         post['user']['profile_picture'] = post['user'].pop('profile_pic_url')
@@ -379,7 +802,7 @@ class InstagramSearcher(object):
         caption = post.pop('edge_media_to_caption')['edges']
         text = '' if not len(caption) else caption[0]['node']['text']
         post['caption'] = {'text': text, 'from': post['user']}
-        post['link'] = ''.join(['https://www.instagram.com/p/', code, '/'])
+        post['link'] = ''.join([self.base_url, '/p/', code, '/'])
         post['created_time'] = post.pop('taken_at_timestamp')
         post['images'] = {'standard_resolution': post.pop('dimensions')}
         post['images']['standard_resolution']['url'] = post.pop('display_url')
@@ -403,62 +826,170 @@ class InstagramSearcher(object):
 
         return post
 
-    def get_comments(self, code: str):
+    @metrics.timed('endpoint_seconds', endpoint='get_comments')
+    def get_comments(self, code: str, since=None):
         """Retrieves the comments of an Instagram post from a code.
 
+        Pages of comments go from the newest to the oldest ones, if since
+        is given, pagination stops at the first comment not newer than it.
+
         Args:
             code (str): An Instagram post shortcode.
+            since (int): If given, only comments created after this date
+                in unix format are retrieved.
+
+        """
+        pages = list(self.iter_comments(code, since))
+        # Pages are newer first, comments are returned older first
+        return [comment for page in reversed(pages) for comment in page]
+
+    def iter_comments(self, code: str, since=None):
+        """Yields the comments of an Instagram post from a code by pages.
+
+        Pages go from the newest comments to the oldest ones, comments of
+        a page are older first and patched as in get_comments. Only a page
+        is kept in memory, the next one is requested after the caller is
+        done with it. If since is given, pagination stops at the first
+        comment not newer than it.
+
+        Args:
+            code (str): An Instagram post shortcode.
+            since (int): If given, only comments created after this date
+                in unix format are retrieved.
+
+        Yields:
+            list[dict]: The comments of a page.
 
         """
-        query_id = ('https://www.instagram.com/graphql/'
-                    'query/?query_id=17852405266163336&shortcode=')
-        url = ''.join([query_id, code,'&first=1000'])
-        comments      = None
         end_cursor    = None
-        list_comments = []
-
-        while (not comments
-               or comments['page_info']['has_next_page']):
-            post_url = '&after=' + end_cursor if end_cursor else ''
-            comments = requests.get(url + post_url)
-            if (not comments.ok
-                or comments.json()['status'] != 'ok'):
+        has_next_page = True
+
+        while has_next_page:
+            response = self.session.get(self.comments_url(code, end_cursor))
+            comments = response.json() if response.ok else None
+            if comments is None or comments['status'] != 'ok':
                 raise api.errors.ClientError('GraphQL request failed',
-                                             comments.status_code)
-            else:
-                comments = (comments.json()
-                    ['data']['shortcode_media']['edge_media_to_comment'])
-            end_cursor = comments['page_info']['end_cursor']
-            comm_to_add = [edge['node'] for edge in comments['edges']]
-            list_comments = comm_to_add + list_comments
+                                             response.status_code)
+            comments = (comments
+                ['data']['shortcode_media']['edge_media_to_comment'])
+            end_cursor    = comments['page_info']['end_cursor']
+            page          = [edge['node'] for edge in comments['edges']]
+            has_next_page = (comments['page_info']['has_next_page']
+                             and not self.__reached(page, since))
+            yield [self.patch_comment(comment) for comment in page
+                   if since is None or int(comment['created_at']) > since]
 
-        for comment in list_comments:
-            comment['created_time'] = comment.pop('created_at')
-            comment['from'] = comment.pop('owner')
-            comment['from']['profile_picture'] = (
-                comment['from'].pop('profile_pic_url'))
+    @staticmethod
+    def __reached(comments, since, key='created_at'):
+        """Checks if a page of comments has comments not newer than since.
+
+        Args:
+            comments (list[dict]): A page of comments.
+            since (int): A date in unix format, or None.
+            key (str): The key of the creation date of the comments.
 
-        return list_comments
+        """
+        return (since is not None
+                and any(int(comment[key]) <= since for comment in comments))
 
-    def get_comments2(self, id, count=1000000):
+    @staticmethod
+    def patch_comment(comment):
+        """Patches the keys of a comment from GraphQL.
+
+        Args:
+            comment (dict): A comment node from GraphQL.
+
+        """
+        comment['created_time'] = comment.pop('created_at')
+        comment['from'] = comment.pop('owner')
+        comment['from']['profile_picture'] = (
+            comment['from'].pop('profile_pic_url'))
+        return comment
+
+    @metrics.timed('endpoint_seconds', endpoint='get_comments2')
+    def get_comments2(self, id, count=1000000, since=None):
         """Retrieves the comments of an Instagram post from an id.
 
         This version is much slower, but returns more information.
 
         Args:
             id (int, str): An Instagram post id, it can be called 'pk'.
+            count (int): Amount of comments after which pagination stops.
+            since (int): If given, only comments created after this date
+                in unix format are returned.
+
+        """
+        pages      = []
+        n_comments = 0
+        for page, _ in self.iter_comments2(id, since):
+            pages.append(page)
+            n_comments += len(page)
+            if n_comments >= count:
+                break
+        # Pages are newer first, comments are returned older first
+        return [comment for page in reversed(pages) for comment in page]
+
+    def iter_comments2(self, id, since=None, cursor=None):
+        """Yields the comments of an Instagram post from an id by pages.
+
+        Pages come from the private API, with replies as comments like the
+        others, and with the keys of get_comments2. Pages go from the
+        newest comments to the oldest ones, then to the newer comments
+        left out of the first page, like media_n_comments. Only a page is
+        kept in memory, the next one is requested after the caller is done
+        with it. If since is given, pagination to older comments stops at
+        the first comment not newer than it.
+
+        Args:
+            id (int, str): An Instagram post id, it can be called 'pk'.
+            since (int): If given, only comments created after this date
+                in unix format are retrieved.
+            cursor (dict): If given, a cursor yielded before, pagination
+                resumes after its page.
+
+        Yields:
+            tuple: The comments of a page, and the cursor of the next page,
+                None after the last page.
+
+        """
+        cursor = cursor or {}
+
+        while cursor is not None:
+            results = self.private('media_comments', id,
+                                   can_support_threading='false', **cursor)
+            page    = results.get('comments', [])
+            if (results.get('has_more_comments')
+                and results.get('next_max_id')
+                and not self.__reached(page, since, 'created_time')):
+                next_cursor = {'max_id': results['next_max_id']}
+            elif (results.get('has_more_headload_comments')
+                  and results.get('next_min_id')):
+                next_cursor = {'min_id': results['next_min_id']}
+            else:
+                next_cursor = None
+            # A repeated cursor would request the same page forever
+            if next_cursor == cursor:
+                next_cursor = None
+            cursor = next_cursor
+            yield ([self.patch_comment2(comment) for comment in page
+                    if since is None or int(comment['created_time']) > since],
+                   cursor)
+
+    @staticmethod
+    def patch_comment2(comment):
+        """Removes the redundant keys of a comment from the private API.
+
+        Args:
+            comment (dict): A comment from the private API.
 
         """
-        list_comments = self.priv_client.media_n_comments(id, n=count)
-        for comment in list_comments:
-            for key in ('pk',
-                        'user_id',
-                        'created_at',
-                        'created_at_utc',
-                        'user'):
-                comment.pop(key, None)
-
-        return list_comments
+        for key in ('pk',
+                    'user_id',
+                    'created_at',
+                    'created_at_utc',
+                    'user'):
+            comment.pop(key, None)
+        return comment
 
 '''
 
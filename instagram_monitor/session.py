@@ -0,0 +1,82 @@
+from   instagram_monitor           import metrics
+from   instagram_monitor.ratelimit import RateLimiter
+from   requests.adapters           import HTTPAdapter
+from   urllib3.util.retry          import Retry
+import requests
+
+
+class CountingRetry(Retry):
+    """A retry policy counting the retries in the metrics."""
+
+    def increment(self, *args, **kwargs):
+        metrics.inc('http_retries_total')
+        return super().increment(*args, **kwargs)
+
+
+class PooledSession(requests.Session):
+
+    def __init__(self, pool_size=5, retries=3, backoff=0.5, timeout=30,
+                 limiter=None, cooldown=30):
+        """A requests session keeping alive a pool of connections.
+
+        The session can be shared by several threads, each of them takes a
+        connection from the pool, so pool_size should be at least the amount
+        of threads using the session.
+
+        Args:
+            pool_size (int): Amount of connections kept alive for each host.
+            retries (int): Amount of times a request is retried after a
+                connection error or a 5xx response.
+            backoff (float): Factor of the exponential wait between retries.
+            timeout (float): Seconds to wait for the server to answer.
+            limiter (RateLimiter): If given, every request waits for it, and
+                a 429 response makes every request of its family wait.
+            cooldown (float): Seconds requests wait after a 429 response.
+
+        """
+        super().__init__()
+        self.timeout  = timeout
+        self.limiter  = limiter
+        self.cooldown = cooldown
+        retry = CountingRetry(total=retries, connect=retries, read=retries,
+                      backoff_factor=backoff,
+                      status_forcelist=(500, 502, 503, 504),
+                      raise_on_status=False)
+        self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size,
+                                   max_retries=retry)
+        self.mount('https://', self.adapter)
+        self.mount('http://', self.adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        family = RateLimiter.family(url)
+        if self.limiter is not None:
+            self.limiter.acquire(family)
+        with metrics.timer('http_request_seconds', family=family):
+            response = super().request(method, url, **kwargs)
+        metrics.inc('http_requests_total', family=family,
+                    status=response.status_code)
+        metrics.inc('http_response_bytes_total', len(response.content),
+                    family=family)
+        if response.status_code == 429 and self.limiter is not None:
+            self.limiter.cooldown(family, self.cooldown)
+        return response
+
+    def connection_stats(self):
+        """Returns how many requests reused an open connection.
+
+        Returns:
+            dict: Amount of 'requests' made, of 'connections' opened, and
+                of 'reused' connections.
+
+        """
+        n_requests    = 0
+        n_connections = 0
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            n_requests    += pool.num_requests
+            n_connections += pool.num_connections
+        return {'requests': n_requests,
+                'connections': n_connections,
+                'reused': n_requests - n_connections}
@@ -0,0 +1,218 @@
+from   pathlib import Path
+import json
+import re
+import time
+
+
+class FileStore(object):
+
+    def __init__(self, path):
+        """A store of JSON documents by key, as files in a directory.
+
+        Args:
+            path (str): The directory where documents are saved.
+
+        """
+        self.path = Path(path)
+        self.path.mkdir(parents = True, exist_ok = True)
+
+    def __file(self, key, suffix='.json'):
+        return self.path / (re.sub(r'[^A-Za-z0-9_.-]', '_', key) + suffix)
+
+    def get(self, key):
+        """Returns the document of a key, or None."""
+        try:
+            with self.__file(key).open(encoding = 'utf8') as file_doc:
+                return json.load(file_doc)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            return None
+
+    def put(self, key, doc):
+        """Saves the document of a key, replacing the previous one."""
+        path = self.__file(key)
+        temp = path.with_suffix('.tmp')
+        with temp.open('w', encoding = 'utf8') as file_doc:
+            json.dump(doc, file_doc)
+        temp.replace(path)
+
+    def delete(self, key):
+        """Removes the document and the items of a key, if any."""
+        for path in (self.__file(key), self.__file(key, '.jsonl')):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def append(self, key, items):
+        """Adds items to the list of a key, without rewriting it."""
+        path = self.__file(key, '.jsonl')
+        with path.open('a', encoding = 'utf8') as file_items:
+            for item in items:
+                file_items.write(json.dumps(item) + '\n')
+
+    def items(self, key):
+        """Returns the list of items of a key, empty if none."""
+        items = []
+        path  = self.__file(key, '.jsonl')
+        try:
+            with path.open(encoding = 'utf8') as file_items:
+                for line in file_items:
+                    items.append(json.loads(line))
+        except FileNotFoundError:
+            pass
+        except json.decoder.JSONDecodeError:
+            # A line cut by a crash while appending ends the list
+            pass
+        return items
+
+
+class MongoStore(object):
+
+    def __init__(self, collection):
+        """A store of documents by key, in a MongoDB collection.
+
+        Args:
+            collection (pymongo.collection.Collection): Where documents are
+                saved, the key is their '_id'. The items of a key are saved
+                in chunks with the key in 'list'.
+
+        """
+        self.collection = collection
+
+    def get(self, key):
+        """Returns the document of a key, or None."""
+        return self.collection.find_one({'_id': key}, {'_id': 0})
+
+    def put(self, key, doc):
+        """Saves the document of a key, replacing the previous one."""
+        self.collection.replace_one({'_id': key}, dict(doc, _id=key),
+                                    upsert=True)
+
+    def delete(self, key):
+        """Removes the document and the items of a key, if any."""
+        self.collection.delete_one({'_id': key})
+        self.collection.delete_many({'list': key})
+
+    def append(self, key, items):
+        """Adds items to the list of a key, without rewriting it."""
+        if items:
+            self.collection.insert_one({'list': key, 'items': list(items)})
+
+    def items(self, key):
+        """Returns the list of items of a key, empty if none."""
+        return [item for chunk in self.collection.find({'list': key},
+                                                       sort=[('_id', 1)])
+                for item in chunk['items']]
+
+
+class Checkpoints(object):
+
+    def __init__(self, store, every_pages=5, expire_hours=24):
+        """Pagination state of searches, to resume them after a restart.
+
+        The posts found by a search are appended to a list of the store,
+        only those found since the previous checkpoint, and the checkpoint
+        keeps how many of them it covers.
+
+        Args:
+            store (FileStore, MongoStore): Where checkpoints are saved.
+            every_pages (int): Amount of pages between checkpoints.
+            expire_hours (float): Hours after which a checkpoint is ignored.
+
+        """
+        self.store        = store
+        self.every_pages  = every_pages
+        self.expire_hours = expire_hours
+        # Amount of posts appended to the list of each query
+        self.__saved      = {}
+
+    def load(self, query, min_date):
+        """Returns the checkpoint of a search of a query, or None.
+
+        A checkpoint is only returned if it has not expired and its period
+        of search starts before or at min_date.
+
+        Args:
+            query (str): A tag or a user in Instagram.
+            min_date (int): The lower limit date in unix format.
+
+        """
+        checkpoint = self.store.get('search:' + query)
+        if checkpoint is None:
+            return None
+        if (time.time() - checkpoint['updated'] > self.expire_hours*60*60
+            or checkpoint['min_date'] > min_date):
+            self.delete(query)
+            return None
+        list_ids = self.store.items('search:' + query)
+        if len(list_ids) > checkpoint['n_ids']:
+            # Posts appended after the last checkpoint are found again
+            list_ids = list_ids[:checkpoint['n_ids']]
+            self.store.delete('search:' + query)
+            self.store.append('search:' + query, list_ids)
+            self.store.put('search:' + query, checkpoint)
+        checkpoint['list_ids'] = list_ids
+        self.__saved[query]    = len(list_ids)
+        return checkpoint
+
+    def save(self, query, pages, list_ids, **state):
+        """Saves the state of a search, if pages is a multiple of every_pages.
+
+        Args:
+            query (str): A tag or a user in Instagram.
+            pages (int): The amount of pages of the search walked.
+            list_ids (list[dict]): The posts found until now.
+            state: The rest of the state of the search, e.g. end_cursor.
+
+        """
+        if self.every_pages and pages % self.every_pages == 0:
+            if query not in self.__saved:
+                # Posts of a search which was not resumed are discarded
+                self.store.delete('search:' + query)
+                self.__saved[query] = 0
+            self.store.append('search:' + query,
+                              list_ids[self.__saved[query]:])
+            self.__saved[query] = len(list_ids)
+            self.store.put('search:' + query,
+                           dict(state, pages=pages, n_ids=len(list_ids),
+                                updated=time.time()))
+
+    def delete(self, query):
+        """Removes the checkpoint of a query, once its search is finished."""
+        self.__saved.pop(query, None)
+        self.store.delete('search:' + query)
+
+
+class UserIds(object):
+
+    def __init__(self, store, ttl_days=7):
+        """A cache of the numeric ids of Instagram usernames.
+
+        Args:
+            store (FileStore, MongoStore): Where ids are saved.
+            ttl_days (float): Days after which an id is resolved again.
+
+        """
+        self.store    = store
+        self.ttl_days = ttl_days
+        self.hits     = 0
+        self.misses   = 0
+
+    def get(self, username):
+        """Returns the cached id of a username, or None."""
+        doc = self.store.get('user:' + username)
+        if (doc is None
+            or time.time() - doc['updated'] > self.ttl_days*24*60*60):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return doc['id']
+
+    def put(self, username, user_id):
+        """Caches the id of a username."""
+        self.store.put('user:' + username,
+                       {'id': user_id, 'updated': time.time()})
+
+    def invalidate(self, username):
+        """Removes the cached id of a username."""
+        self.store.delete('user:' + username)
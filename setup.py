@@ -7,6 +7,8 @@ setup(
     author_email='elpoliticamentecorrecto@gmail.com',
     packages=['instagram_monitor'],
     install_requires=['networkx', 'pymongo', 'requests', 'matplotlib'],
+    extras_require={'asyncio': ['aiohttp'], 'zstd': ['zstandard'],
+                    'columnar': ['pyarrow']},
     dependency_links=['https://codeload.github.com/ping/instagram_private_api/tar.gz/1.3.3'],
     entry_points={'console_scripts': 
         ['instagram_monitor = instagram_monitor.__main__:main']})
@@ -0,0 +1,8 @@
+"""Fixtures shared by the tests."""
+import pytest
+
+
+@pytest.fixture
+def unlimited():
+    """Rate limits of the searcher which never make a request wait."""
+    return {family: (0, 1) for family in ('graphql', 'web', 'private')}
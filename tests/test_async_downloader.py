@@ -0,0 +1,38 @@
+"""Downloads posts with the asyncio engine from the local stand-in."""
+from   benchmarks.fake_instagram          import FakeInstagram
+from   instagram_monitor.searcher         import InstagramSearcher
+import pytest
+import time
+
+pytest.importorskip('aiohttp')
+
+from   instagram_monitor.async_downloader import AsyncDownloader
+
+
+def test_connections_of_the_asyncio_engine_are_counted(unlimited):
+    with FakeInstagram(30, 10, 0) as fake:
+        searcher = InstagramSearcher(engine='asyncio', max_requests=4,
+                                     base_url=fake.base_url,
+                                     rate_limits=unlimited)
+        posts = searcher.download_posts([{'code': 'p{}'.format(i)}
+                                         for i in range(10)])
+    stats = searcher.connection_stats()
+    assert len(posts) == 10
+    # A post and its 3 pages of comments
+    assert stats['requests'] == 10 * (1 + 3)
+    assert 1 <= stats['connections'] <= 4
+    assert stats['reused'] == stats['requests'] - stats['connections']
+
+
+def test_posts_timing_out_are_retried_a_few_times(unlimited):
+    with FakeInstagram(30, 10, 1) as fake:
+        searcher   = InstagramSearcher(engine='asyncio', retries=2,
+                                       timeout=0.1, base_url=fake.base_url,
+                                       rate_limits=unlimited)
+        downloader = AsyncDownloader(searcher, backoff=0.01)
+        start = time.monotonic()
+        posts = downloader.download_posts([{'code': 'p1'}, {'code': 'p2'}])
+        elapsed = time.monotonic() - start
+    assert posts == []
+    assert downloader.connection_stats()['requests'] == 2 * (1 + 2)
+    assert elapsed < 1
@@ -0,0 +1,73 @@
+"""Drives a pool of private API clients against the local stand-in."""
+from   benchmarks.fake_instagram       import FakeInstagram, FakeClient
+from   functools                       import partial
+from   instagram_monitor.clientpool    import ClientPool
+from   instagram_monitor.searcher      import InstagramSearcher
+from   threading                       import Lock, Thread
+import instagram_private_api as api
+import time
+
+
+def test_failing_accounts_cool_down_while_others_work(unlimited):
+    with FakeInstagram(50, 100, 0, n_posts=20, post_spacing=60,
+                       throttled_users=('throttled',),
+                       bad_logins=('bad_login',)) as fake:
+        pool = ClientPool([('first', 'x'), ('throttled', 'x'),
+                           ('bad_login', 'x'), ('second', 'x')],
+                          0, 1, cooldown=60,
+                          factory=partial(FakeClient, fake))
+        searcher = InstagramSearcher(base_url=fake.base_url, wait_time=0.1,
+                                     rich_comments=True, clients=pool,
+                                     rate_limits=unlimited)
+        ids   = searcher.get_id_list('#tag', 0, int(time.time()) + 10)
+        posts = searcher.download_posts(ids)
+
+        assert len(posts) == 20
+        assert all(len(post['comments']) == 50 for post in posts)
+        # Every post and page of comments was served to the healthy accounts
+        assert set(fake.user_requests) == {'first', 'second'}
+        # A post and its 3 pages of comments, some restarted after a 429
+        assert sum(fake.user_requests.values()) >= 20 * (1 + 3)
+        stats = {account['username']: account for account in pool.stats()}
+        assert stats['throttled']['cooldown'] > 0
+        assert stats['bad_login']['cooldown'] > 0
+        assert not stats['bad_login']['logged_in']
+        assert stats['first']['failures'] == stats['second']['failures'] == 0
+
+
+class _ExpiringClient(object):
+    # A client whose session expires every few calls
+
+    calls = 0
+    lock  = Lock()
+
+    def media_info(self, media_id):
+        with self.lock:
+            _ExpiringClient.calls += 1
+            expired = _ExpiringClient.calls % 3 == 0
+        if expired:
+            raise api.ClientLoginRequiredError('login_required', 403)
+        return {'status': 'ok'}
+
+
+def test_expired_sessions_log_in_again():
+    # Calls wait for the bucket while others find the session expired
+    pool   = ClientPool([('user', 'x')], 100, 1, cooldown=0.01,
+                        factory=lambda username, password: _ExpiringClient())
+    errors = []
+
+    def work():
+        for _ in range(5):
+            try:
+                pool.media_info('1')
+            except api.ClientError:
+                pass
+            except Exception as e:
+                errors.append(e)
+
+    threads = [Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
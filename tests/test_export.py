@@ -0,0 +1,39 @@
+"""Exports the posts and comments saved from the local stand-in."""
+from   benchmarks.fake_instagram import FakeInstagram
+import matplotlib
+import pymongo
+import pytest
+
+# The monitor imports pyplot, plots must not need a display
+matplotlib.use('Agg')
+
+mongomock = pytest.importorskip('mongomock')
+pyarrow   = pytest.importorskip('pyarrow')
+
+from   instagram_monitor.monitor import InstagramMonitor
+import pyarrow.parquet
+
+
+def test_columnar_export_has_the_comments_of_the_text_export(tmp_path,
+                                                              monkeypatch,
+                                                              unlimited):
+    monkeypatch.chdir(tmp_path)
+    with FakeInstagram(30, 50, 0, n_posts=5, post_spacing=60) as fake, \
+         mongomock.patch(servers=(('localhost', 27017),)):
+        monitor = InstagramMonitor(None, None, base_url=fake.base_url,
+                                   wait_time=0.1, rate_limits=unlimited)
+        monitor.search_query('#tag')
+        monitor.export_comments_query('#tag')
+        monitor.export_columnar_query('#tag')
+
+    with open('exported_comments/#tag/#tag_comments.txt',
+              encoding='utf8') as file_comm:
+        lines = [tuple(line.split('\t')[:3]) for line in file_comm]
+    posts    = pyarrow.parquet.read_table(
+        'exported_columnar/#tag/posts/part-00000.parquet')
+    comments = pyarrow.parquet.read_table(
+        'exported_columnar/#tag/comments/part-00000.parquet')
+    assert posts.num_rows == 5
+    assert sorted(lines) == sorted(
+        zip(*(comments.column(name).to_pylist()
+              for name in ('post_id', 'username', 'comment_id'))))
@@ -0,0 +1,87 @@
+"""Keeps the mention graph of the posts saved from the local stand-in."""
+from   benchmarks.fake_instagram         import FakeInstagram
+import matplotlib
+import pymongo
+import pytest
+import time
+
+# The monitor imports pyplot, plots must not need a display
+matplotlib.use('Agg')
+
+mongomock = pytest.importorskip('mongomock')
+
+from   instagram_monitor.graph          import MentionGraph
+from   instagram_monitor.mongo_frontend import MongoFrontEnd
+from   instagram_monitor.monitor        import InstagramMonitor
+from   instagram_monitor.state          import MongoStore
+
+
+def _comment(username):
+    return {'id': username, 'text': 'hi @friend', 'created_time': '1',
+            'from': {'username': username}}
+
+
+def test_updates_read_comments_of_posts_saved_since(tmp_path, monkeypatch,
+                                                    unlimited):
+    monkeypatch.chdir(tmp_path)
+    with FakeInstagram(20, 50, 0, n_posts=3, post_spacing=60) as fake, \
+         mongomock.patch(servers=(('localhost', 27017),)):
+        InstagramMonitor(None, None, base_url=fake.base_url, wait_time=0.1,
+                         rate_limits=unlimited).search_query('#tag')
+        client   = pymongo.MongoClient('localhost', 27017)
+        mentions = MentionGraph(MongoFrontEnd('localhost', 27017), 'post',
+                                'comment', client['state']['graph_edges'],
+                                client['state']['graph_owners'],
+                                MongoStore(client['state']['graphs']),
+                                margin=0)
+        time.sleep(1)
+        # 3 captions and their comments
+        assert mentions.update('#tag') == 3 + 3 * 20
+
+        posts = client['post']['#tag']
+        saved, other = [post['id'] for post in posts.find()][:2]
+        time.sleep(1)
+        client['comment'][saved].insert_one(_comment('new'))
+        posts.update_one({'id': saved},
+                         {'$set': {'last_checked': int(time.time())}})
+        # A post not saved since the previous update is not read
+        client['comment'][other].insert_one(_comment('unread'))
+        time.sleep(1)
+        assert mentions.update('#tag') == 1
+
+        graph = mentions.graph('#tag', op_mentioned=True)
+    assert graph['new']['friend']['weight'] == 1
+    assert graph['new']['owner']['weight'] == 1
+    assert 'unread' not in graph
+
+
+@pytest.mark.parametrize('layout', ['collections', 'single'])
+def test_streamed_pages_are_read_when_their_post_is_saved(layout):
+    with mongomock.patch(servers=(('localhost', 27017),)):
+        client   = pymongo.MongoClient('localhost', 27017)
+        mentions = MentionGraph(MongoFrontEnd('localhost', 27017), 'post',
+                                'comment', client['state']['graph_edges'],
+                                client['state']['graph_owners'],
+                                MongoStore(client['state']['graphs']),
+                                layout=layout, margin=0)
+        pages = [dict(_comment('user{}'.format(i)), post_id='9')
+                 for i in range(2)]
+        if layout == 'single':
+            client['comment']['comments'].insert_many(pages)
+        else:
+            client['comment']['9'].insert_many(pages)
+        time.sleep(1)
+        # The pages are stored, the post is still downloading
+        assert mentions.update('#tag') == 0
+
+        time.sleep(1)
+        client['post']['#tag'].insert_one(
+            {'id': '9', 'user': {'username': 'owner'},
+             'comments': {'count': 2}, 'last_checked': int(time.time())})
+        time.sleep(1)
+        assert mentions.update('#tag') == 2
+        assert mentions.update('#tag') == 0
+
+        graph = mentions.graph('#tag', op_mentioned=True)
+    assert graph['user0']['friend']['weight'] == 1
+    assert graph['user1']['owner']['weight'] == 1
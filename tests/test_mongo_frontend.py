@@ -0,0 +1,41 @@
+"""Runs the MongoDB frontend against an in-memory MongoDB."""
+import pymongo
+import pytest
+
+mongomock = pytest.importorskip('mongomock')
+
+from   instagram_monitor.mongo_frontend import MongoFrontEnd
+
+
+@pytest.fixture
+def mongo():
+    with mongomock.patch(servers=(('localhost', 27017),)):
+        yield MongoFrontEnd('localhost', 27017, 'post', '#tag')
+
+
+def test_non_unique_index_is_repaired(mongo):
+    coll = mongo.get_collection('post', '#tag')
+    coll.create_index('id')
+    coll.insert_many([{'id': '1', 'n': 1}, {'id': '1', 'n': 2},
+                      {'id': '2', 'n': 1}])
+    unique_id = [([('id', pymongo.ASCENDING)], {'unique': True})]
+
+    assert mongo.check_indexes(unique_id) == unique_id
+    mongo.check_indexes(unique_id, repair=True)
+
+    assert mongo.check_indexes(unique_id) == []
+    assert sorted((doc['id'], doc['n']) for doc in coll.find()) == [
+        ('1', 2), ('2', 1)]
+
+
+def test_upserts_count_inserted_and_updated_documents(mongo):
+    assert mongo.upsert_many([{'id': '1'}, {'id': '2'}]) == (2, 0)
+    assert mongo.upsert_many([{'id': '1', 'n': 2}, {'id': '3'}],
+                             batch_size=1) == (1, 1)
+    # Repeated documents of a batch are written once, the last one wins
+    assert mongo.upsert_many([{'id': '4', 'n': 1},
+                              {'id': '4', 'n': 2}]) == (1, 0)
+
+    coll = mongo.get_collection('post', '#tag')
+    assert sorted((doc['id'], doc.get('n')) for doc in coll.find()) == [
+        ('1', 2), ('2', None), ('3', None), ('4', 2)]
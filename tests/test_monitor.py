@@ -0,0 +1,107 @@
+"""Runs the monitor against the local stand-in of Instagram."""
+from   benchmarks.fake_instagram import FakeInstagram
+from   datetime                  import date
+import calendar
+import matplotlib
+import matplotlib.axes
+import pymongo
+import pytest
+import time
+
+# The monitor imports pyplot, plots must not need a display
+matplotlib.use('Agg')
+
+mongomock = pytest.importorskip('mongomock')
+
+from   instagram_monitor.monitor import InstagramMonitor
+
+
+@pytest.fixture
+def fake():
+    with FakeInstagram(5, 50, 0, n_posts=10, post_spacing=60) as fake:
+        yield fake
+
+
+@pytest.fixture
+def mongo(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with mongomock.patch(servers=(('localhost', 27017),)):
+        yield pymongo.MongoClient('localhost', 27017)
+
+
+def test_detect_changes_archives_unchanged_posts(fake, mongo, unlimited):
+    monitor = InstagramMonitor(None, None, base_url=fake.base_url,
+                               wait_time=0.1, detect_changes=True,
+                               rate_limits=unlimited)
+    monitor.search_query('#tag')
+    posts = mongo['post']['#tag']
+    assert posts.count_documents({}) == 10
+    assert posts.count_documents({'archived': True}) == 0
+
+    # Every post is now older than update_days, and its counts are the same
+    monitor.update_days = 1e-6
+    n_requests = fake.n_requests
+    monitor.update_query('#tag', older_days=1e-6)
+
+    assert posts.count_documents({'archived': True,
+                                  'not_found': False}) == 10
+    assert posts.count_documents({'last_checked': {'$exists': True}}) == 10
+    # Only the GraphQL page of the tag was requested, no post
+    assert fake.n_requests - n_requests == 1
+
+
+def test_migrate_query_downloads_posts_again(fake, mongo, unlimited):
+    old = InstagramMonitor(None, None, base_url=fake.base_url, wait_time=0.1,
+                           post_db='old_post', rate_limits=unlimited)
+    old.search_query('#tag')
+
+    monitor = InstagramMonitor(None, None, base_url=fake.base_url,
+                               wait_time=0.1, rate_limits=unlimited)
+    monitor.migrate_query('#tag', 'old_post')
+    assert mongo['post']['#tag'].count_documents({}) == 10
+
+
+def test_posts_per_day_follow_dst(mongo, monkeypatch):
+    # Just before midnight in winter, just after midnight in summer
+    winter = calendar.timegm((2026, 1, 10, 22, 30, 0))  # 23:30 CET
+    summer = calendar.timegm((2026, 7, 9, 22, 30, 0))   # 00:30 CEST
+    mongo['post']['#tag'].insert_many([
+        {'id': str(i), 'created_time': str(created_time),
+         'comments': {'count': 1}, 'likes': {'count': 2}}
+        for i, created_time in enumerate((winter, summer))])
+    plotted = []
+    monkeypatch.setattr(matplotlib.axes.Axes, 'plot',
+                        lambda ax, x, y, fmt: plotted.append((list(x),
+                                                              list(y))))
+    monkeypatch.setenv('TZ', 'Europe/Madrid')
+    time.tzset()
+    try:
+        InstagramMonitor(None, None).export_info_query('#tag')
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+
+    assert plotted == [([date(2026, 1, 10), date(2026, 7, 10)], [1, 1])]
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_incremental_updates_redownload_incomplete_posts(fake, mongo, stream,
+                                                         unlimited):
+    monitor = InstagramMonitor(None, None, base_url=fake.base_url,
+                               wait_time=0.1, stream=stream, incremental=True,
+                               rate_limits=unlimited)
+    monitor.search_query('#tag')
+    posts = mongo['post']['#tag']
+    assert posts.count_documents({'comments_since': 1500000004}) == 10
+
+    # A download of a post stopped after storing its newest page
+    post_id  = posts.find_one()['id']
+    comments = mongo['comment'][post_id]
+    assert comments.delete_many(
+        {'created_time': {'$lt': 1500000003}}).deleted_count == 3
+    posts.update_one({'id': post_id}, {'$unset': {'comments_since': 1}})
+    monitor.update_days = 1e-6
+    monitor.update_query('#tag', older_days=1e-6)
+
+    assert comments.count_documents({}) == 5
+    assert posts.count_documents({'comments_since': 1500000004}) == 10
@@ -0,0 +1,52 @@
+"""Checks the waits of the rate limits and the adaptive concurrency."""
+from   instagram_monitor.concurrency import AdaptiveLimit
+from   instagram_monitor.ratelimit   import TokenBucket
+import pytest
+import time
+
+
+def test_requests_beyond_the_burst_wait_for_tokens():
+    bucket = TokenBucket(10, 2)
+    waits  = [bucket.reserve() for _ in range(4)]
+    assert waits[:2] == [0, 0]
+    assert waits[2:] == [pytest.approx(0.1, abs=0.01),
+                         pytest.approx(0.2, abs=0.01)]
+
+
+def test_unlimited_buckets_never_wait():
+    bucket = TokenBucket(0, 1)
+    assert [bucket.reserve() for _ in range(10)] == [0]*10
+
+
+def test_cooldowns_make_every_request_wait():
+    bucket = TokenBucket(100, 10)
+    assert bucket.cooldown(1)
+    assert not bucket.cooldown(0.5)
+    assert bucket.reserve() == pytest.approx(1, abs=0.05)
+    assert bucket.reserve() == pytest.approx(1, abs=0.05)
+
+
+def test_adaptive_limit_grows_up_to_its_maximum():
+    limit = AdaptiveLimit(initial=2, min_limit=1, max_limit=4)
+    for _ in range(50):
+        limit.acquire()
+        limit.release(latency=0.01)
+    assert limit.current == 4
+
+
+def test_adaptive_limit_decreases_down_to_its_minimum():
+    limit = AdaptiveLimit(initial=8, min_limit=2, max_limit=8)
+    for _ in range(10):
+        limit.acquire()
+        limit.release(latency=0.001, congested=True)
+        time.sleep(0.005)
+    assert limit.current == 2
+
+
+def test_errors_of_a_round_decrease_the_limit_once():
+    limit = AdaptiveLimit(initial=8, min_limit=1, max_limit=8)
+    for _ in range(4):
+        limit.acquire()
+    for _ in range(4):
+        limit.release(latency=1, congested=True)
+    assert limit.current == 4
@@ -0,0 +1,62 @@
+"""Checks when the scheduler runs tasks and how it stops."""
+from   instagram_monitor.scheduler import Scheduler
+import signal
+import threading
+import time
+
+
+def _scheduler(calls, **kwargs):
+    def task(name):
+        def run(query):
+            calls.append((query, name))
+        run.__name__ = name
+        return (name, run)
+    return Scheduler([task('search'), task('update')], ['a', 'b'],
+                     jitter=0, **kwargs)
+
+
+def test_tasks_are_rescheduled_after_their_interval():
+    calls     = []
+    scheduler = _scheduler(calls, intervals={('a', 'update'): 1},
+                           default_hours=2)
+    start = time.time()
+    scheduler.run_pending()
+    assert calls == [('a', 'search'), ('a', 'update'),
+                     ('b', 'search'), ('b', 'update')]
+    assert scheduler.next_run[('a', 'update')] - start >= 60*60
+    assert scheduler.next_run[('a', 'update')] - start < 60*60 + 10
+    assert scheduler.next_run[('b', 'update')] - start >= 2*60*60
+
+    calls.clear()
+    scheduler.run_pending()
+    assert calls == []
+    scheduler.next_run[('a', 'update')] = 0
+    scheduler.run_pending()
+    assert calls == [('a', 'update')]
+
+
+def test_sigterm_stops_after_the_running_task():
+    calls = []
+    main  = threading.main_thread().ident
+
+    def search(query):
+        calls.append((query, 'search'))
+        # As a kill from outside, handled by the waiting main thread
+        signal.pthread_kill(main, signal.SIGTERM)
+        # The task is still running when the signal is handled
+        scheduler.stop.wait(10)
+
+    def update(query):
+        calls.append((query, 'update'))
+
+    scheduler = Scheduler([('search', search), ('update', update)], ['a'])
+    # Stops a scheduler which missed the signal instead of waiting hours
+    timeout   = threading.Timer(10, scheduler.stop.set)
+    timeout.start()
+    previous  = signal.getsignal(signal.SIGTERM)
+    try:
+        scheduler.run()
+    finally:
+        timeout.cancel()
+    assert calls == [('a', 'search')]
+    assert signal.getsignal(signal.SIGTERM) is previous
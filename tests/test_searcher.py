@@ -0,0 +1,97 @@
+"""Runs the searcher against the local stand-in of Instagram."""
+from   benchmarks.fake_instagram  import FakeInstagram, FakeClient
+from   instagram_monitor.searcher import InstagramSearcher
+from   instagram_monitor.state    import Checkpoints, FileStore
+import pytest
+
+
+@pytest.fixture
+def searcher(unlimited):
+    with FakeInstagram(130, 100, 0, n_posts=2) as fake:
+        searcher = InstagramSearcher(base_url=fake.base_url,
+                                     rate_limits=unlimited)
+        searcher.priv_client = FakeClient(fake)
+        yield searcher
+
+
+def test_private_comments_include_replies(searcher):
+    comments = searcher.get_comments2('1000')
+    assert len({comment['id'] for comment in comments}) == 130
+
+
+def test_private_comments_resume_from_cursor(searcher):
+    page, cursor = next(searcher.iter_comments2('1000'))
+    rest = [comment['id']
+            for page_rest, _ in searcher.iter_comments2('1000', cursor=cursor)
+            for comment in page_rest]
+    assert len(page) + len(rest) == 130
+    assert not {comment['id'] for comment in page} & set(rest)
+
+
+def test_missing_users_are_not_retried(unlimited):
+    with FakeInstagram(0, 100, 0, missing_users=('gone',)) as fake:
+        searcher = InstagramSearcher(base_url=fake.base_url, wait_time=0.01,
+                                     rate_limits=unlimited)
+        with pytest.raises(LookupError):
+            searcher.get_id_list('gone', 0, 1)
+        assert fake.n_requests == 1
+
+
+def test_throttled_user_lookups_are_retried(unlimited):
+    with FakeInstagram(0, 100, 0, n_posts=5, error_rate=0.8) as fake:
+        searcher = InstagramSearcher(base_url=fake.base_url, wait_time=0.01,
+                                     retries=0, rate_limits=unlimited)
+        posts = searcher.get_id_list('user', 0, fake.now + 10)
+        assert len(posts) == 5
+        assert fake.n_throttled
+
+
+def test_known_posts_are_not_downloaded(unlimited):
+    with FakeInstagram(5, 100, 0, n_posts=4) as fake:
+        searcher = InstagramSearcher(base_url=fake.base_url,
+                                     rate_limits=unlimited)
+        asked    = []
+
+        def known(ids):
+            asked.extend(ids)
+            return set(ids[:3])
+
+        posts = searcher.search('#tag', prev_days=1, known=known)
+    assert len(asked) == 4
+    assert [post['post']['id'] for post in posts] == [asked[3]]
+
+
+class _Interrupted(Exception):
+    pass
+
+
+def test_interrupted_searches_resume_from_their_checkpoint(tmp_path,
+                                                           unlimited):
+    with FakeInstagram(0, 100, 0, n_posts=10, feed_page_size=2) as fake:
+        searcher = InstagramSearcher(base_url=fake.base_url,
+                                     rate_limits=unlimited)
+        expected = searcher.get_id_list('#tag', 0, fake.now + 10)
+        n_pages  = fake.n_requests
+
+        checkpoints = Checkpoints(FileStore(tmp_path), every_pages=1)
+        save        = checkpoints.save
+
+        def save_and_stop(query, pages, **state):
+            save(query, pages, **state)
+            if pages == 2:
+                raise _Interrupted()
+
+        checkpoints.save = save_and_stop
+        searcher = InstagramSearcher(base_url=fake.base_url,
+                                     rate_limits=unlimited,
+                                     checkpoints=checkpoints)
+        with pytest.raises(_Interrupted):
+            searcher.get_id_list('#tag', 0, fake.now + 10)
+
+        searcher = InstagramSearcher(
+            base_url=fake.base_url, rate_limits=unlimited,
+            checkpoints=Checkpoints(FileStore(tmp_path), every_pages=1))
+        fake.n_requests = 0
+        assert searcher.get_id_list('#tag', 0, fake.now + 10) == expected
+        assert fake.n_requests == n_pages - 2
+        assert FileStore(tmp_path).get('search:#tag') is None
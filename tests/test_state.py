@@ -0,0 +1,97 @@
+"""Checks the checkpoints of searches on the stores they are saved in."""
+import pytest
+
+from   instagram_monitor.state import (Checkpoints, FileStore, MongoStore,
+                                     UserIds)
+
+
+@pytest.fixture(params=['file', 'mongo'])
+def store(request, tmp_path):
+    if request.param == 'file':
+        yield FileStore(tmp_path)
+    else:
+        mongomock = pytest.importorskip('mongomock')
+        yield MongoStore(mongomock.MongoClient()['state']['checkpoints'])
+
+
+def _ids(start, stop):
+    return [{'id': str(i), 'shortcode': 'c{}'.format(i)}
+            for i in range(start, stop)]
+
+
+def test_found_posts_are_appended_to_the_checkpoint(store):
+    checkpoints = Checkpoints(store, every_pages=1)
+    list_ids    = _ids(0, 3)
+    checkpoints.save('#tag', 1, list_ids, min_date=0, end_cursor='a')
+    list_ids   += _ids(3, 5)
+    checkpoints.save('#tag', 2, list_ids, min_date=0, end_cursor='b')
+
+    saved = store.get('search:#tag')
+    assert 'list_ids' not in saved
+    assert saved['n_ids'] == 5
+    assert store.items('search:#tag') == _ids(0, 5)
+
+    checkpoint = Checkpoints(store).load('#tag', 0)
+    assert checkpoint['end_cursor'] == 'b'
+    assert checkpoint['list_ids'] == _ids(0, 5)
+
+
+def test_posts_after_the_last_checkpoint_are_dropped(store):
+    checkpoints = Checkpoints(store, every_pages=1)
+    checkpoints.save('#tag', 1, _ids(0, 3), min_date=0, end_cursor='a')
+    # A crash between appending posts and saving their checkpoint
+    store.append('search:#tag', _ids(3, 5))
+
+    checkpoints = Checkpoints(store, every_pages=1)
+    list_ids    = checkpoints.load('#tag', 0)['list_ids']
+    assert list_ids == _ids(0, 3)
+    list_ids   += _ids(3, 4)
+    checkpoints.save('#tag', 2, list_ids, min_date=0, end_cursor='b')
+    assert store.items('search:#tag') == _ids(0, 4)
+
+
+def test_a_new_search_discards_old_posts(store):
+    store.append('search:#tag', _ids(0, 3))
+    checkpoints = Checkpoints(store, every_pages=1)
+    checkpoints.save('#tag', 1, _ids(10, 12), min_date=0, end_cursor='a')
+    assert store.items('search:#tag') == _ids(10, 12)
+
+    checkpoints.delete('#tag')
+    assert store.get('search:#tag') is None
+    assert store.items('search:#tag') == []
+
+
+def test_expired_checkpoints_are_discarded(store):
+    checkpoints = Checkpoints(store, every_pages=1, expire_hours=1)
+    checkpoints.save('#tag', 1, _ids(0, 3), min_date=0, end_cursor='a')
+    saved = store.get('search:#tag')
+    store.put('search:#tag', dict(saved, updated=saved['updated'] - 2*60*60))
+
+    assert checkpoints.load('#tag', 0) is None
+    assert store.get('search:#tag') is None
+    assert store.items('search:#tag') == []
+
+
+def test_checkpoints_of_a_later_period_are_discarded(store):
+    checkpoints = Checkpoints(store, every_pages=1)
+    checkpoints.save('#tag', 1, _ids(0, 3), min_date=100, end_cursor='a')
+
+    assert checkpoints.load('#tag', 100)['list_ids'] == _ids(0, 3)
+    assert checkpoints.load('#tag', 50) is None
+    assert store.get('search:#tag') is None
+
+
+def test_user_ids_are_cached_until_they_expire(store):
+    user_ids = UserIds(store, ttl_days=1)
+    assert user_ids.get('user') is None
+    user_ids.put('user', '123')
+    assert user_ids.get('user') == '123'
+    assert (user_ids.hits, user_ids.misses) == (1, 1)
+
+    saved = store.get('user:user')
+    store.put('user:user', dict(saved, updated=saved['updated'] - 2*24*60*60))
+    assert user_ids.get('user') is None
+    user_ids.put('user', '456')
+    user_ids.invalidate('user')
+    assert user_ids.get('user') is None
+    assert (user_ids.hits, user_ids.misses) == (1, 3)